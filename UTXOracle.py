@@ -35,8 +35,9 @@
 
 
 # 1. Make sure you have python3 and a bitcoin node installed
-# 2. Make sure "server = 1" is in bitcoin.conf
-# 3. Run this file as "python3 UTXOracle.py"
+# 2. Install numpy with "pip install numpy" (the only library needed)
+# 3. Make sure "server = 1" is in bitcoin.conf
+# 4. Run this file as "python3 UTXOracle.py"
 
 
 
@@ -51,19 +52,19 @@
 # builds on results in the previous sections. The flow of the procedure
 # and approximate line numbers of the sections are as follows
 
-# Part 1) Get options from user and read settings......	.	Line 72
-# Part 2) Create a way to talk to your node.............	Line 183		
-# Part 3) Get the latest block from your node..........	.	Line 222
-# Part 4) Check that the date entered is acceptable....	.	Line 270
-# Part 5) Find all blocks on the target day............	.	Line 323
-# Part 6) Build a map of the binary block files........	.	Line 485
-# Part 7) Build the output bell curve container........	.	Line 593
-# Part 8) Read all outputs on target day...............	.	Line 643
-# Part 9) Remove non-USD related outputs...............	.	Line 904
-# Part 10) Construct the USD price finding stencil.....	.	Line 980
-# Part 11) Find central output and average deviation...	.	Line 1251
-# Part 12) Generate chart and serve as a local webpage.	.	Line 1359		
-# License..............................................	.	Line 1781 
+# Part 1) Get options from user and read settings......	.	Line 73
+# Part 2) Create a way to talk to your node.............	Line 193		
+# Part 3) Get the latest block from your node..........	.	Line 239
+# Part 4) Check that the date entered is acceptable....	.	Line 284
+# Part 5) Find all blocks on the target day............	.	Line 337
+# Part 6) Build a map of the binary block files........	.	Line 464
+# Part 7) Build the output bell curve container........	.	Line 548
+# Part 8) Read all outputs on target day...............	.	Line 597
+# Part 9) Remove non-USD related outputs...............	.	Line 694
+# Part 10) Construct the USD price finding stencil.....	.	Line 729
+# Part 11) Find central output and average deviation...	.	Line 837
+# Part 12) Generate chart and serve as a local webpage.	.	Line 892		
+# License..............................................	.	Line 1318 
 
 
 
@@ -114,6 +115,8 @@ Options:
   -d YYYY/MM/DD    Specify a UTC date to evaluate
   -p /path/to/dir  Specify the data directory for blk files
   -rb              Use last 144 recent blocks instead of date mode
+  -j N             Parse blocks using N processes (default 1)
+  -l               Find blocks with the node's LevelDB block index (needs plyvel)
 """
     print(help_text)
     sys.exit(0)
@@ -139,6 +142,16 @@ if "-rb" in sys.argv:
     date_mode = False
     block_mode = True
 
+#did user ask to parse blocks on several cores?
+block_parse_processes = 1
+if "-j" in sys.argv:
+    j_index = sys.argv.index("-j")
+    if j_index + 1 < len(sys.argv):
+        block_parse_processes = int(sys.argv[j_index + 1])
+
+#did user ask to find blocks with the node's own block index?
+use_leveldb_index = "-l" in sys.argv
+
 # Validate bitcoin.conf in data_dir
 conf_path = os.path.join(data_dir, "bitcoin.conf")
 if not os.path.exists(conf_path):
@@ -146,35 +159,32 @@ if not os.path.exists(conf_path):
     print("Expected to find 'bitcoin.conf' in this directory.")
     sys.exit(1)
 
-#parse the conf file for the blocks dir and rpc credentials
+#parse the conf file for the blocks dir and rpc credentials, keeping the
+#settings under a [main], [test], [signet] or [regtest] header as section.key
 conf_path = os.path.join(data_dir, "bitcoin.conf")
 conf_settings = {}
+section = ""
 if os.path.exists(conf_path):
     with open(conf_path, 'r') as f:
         for line in f:
             line = line.strip()
             if not line or line.startswith("#"):
                 continue
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1].strip() + "."
+                continue
             if "=" in line:
                 key, value = line.split("=", 1)
-                conf_settings[key.strip()] = value.strip().strip('"')
+                conf_settings[section + key.strip()] = value.strip().strip('"')
 
-# Set blocks directory from default or user specified
-blocks_dir = os.path.expanduser(conf_settings.get("blocksdir", os.path.join(data_dir, "blocks")))
+# Set blocks directory from default or user specified (for a test network the
+# default is its own folder in the data dir, e.g. testnet3/blocks)
+from node_rpc import NodeRPC, RPCError, conf_blocks_dir
+blocks_dir = conf_blocks_dir(conf_settings, data_dir)
 
-# Build CLI options if specified in conf file
-bitcoin_cli_options = []
-if "rpcuser" in conf_settings and "rpcpassword" in conf_settings:
-    bitcoin_cli_options.append(f"-rpcuser={conf_settings['rpcuser']}")
-    bitcoin_cli_options.append(f"-rpcpassword={conf_settings['rpcpassword']}")
-else:
-    cookie_path = conf_settings.get("rpccookiefile", os.path.join(data_dir, ".cookie"))
-    if os.path.exists(cookie_path):
-        bitcoin_cli_options.append(f"-rpccookiefile={cookie_path}")
-
-for opt in ["rpcconnect", "rpcport"]:
-    if opt in conf_settings:
-        bitcoin_cli_options.append(f"-{opt}={conf_settings[opt]}")
+# Set the rpc connection (rpcconnect, rpcport) and credentials (rpcuser and
+# rpcpassword, or the .cookie file) from default or user specified
+node = NodeRPC.from_conf(conf_settings, data_dir)
 
 
 
@@ -189,28 +199,35 @@ for opt in ["rpcconnect", "rpcport"]:
 # whenever we need it instead of copy and pasting the same code several times. 
 # The function asks the node a question and returns the answer to the algorithm 
 # where it is needed. If you get an error in this function, the problem is 
-# likely that you don't have server=1 in your bitcoin conf file.
+# likely that you don't have server=1 in your bitcoin conf file. Rather than 
+# starting a bitcoin-cli program for every question, we talk to the node's rpc
+# server directly over one connection that stays open. Many questions can also
+# be sent together in a batch and answered in a single round trip.
 
 print("\nCurrent operation  \t\t\t\tTotal Completion",flush=True)
 print("\nConnecting to node...\t\t\t\t", end="",flush=True)
 
-# define the node communication function
-import subprocess
+# define the node communication functions
 def Ask_Node(command):
-    full_command = ["bitcoin-cli"] + bitcoin_cli_options + command
+    try:
+        return node.call(command[0], *command[1:])
+    except (RPCError, OSError) as e:
+        Node_Error(e)
 
+def Ask_Node_Batch(commands):
     try:
-        rv = subprocess.check_output(full_command)
-        #subprocess.run('echo "\\033]0;UTXOracle\\007"', shell=True)
-        return rv
-    except Exception as e:
-        print("Error connecting to your node. Troubleshooting steps:\n")
-        print("\t1) Make sure bitcoin-cli is working: try 'bitcoin-cli getblockcount'")
-        print("\t2) Make sure bitcoind is running (and server=1 in bitcoin.conf)")
-        print("\t3) If needed, set rpcuser/rpcpassword or point to the .cookie file")
-        print("\nThe full command was:", " ".join(full_command))
-        print("\nThe error from bitcoin-cli was:\n", e)
-        sys.exit()
+        return node.batch((command[0], command[1:]) for command in commands)
+    except (RPCError, OSError) as e:
+        Node_Error(e)
+
+def Node_Error(e):
+    print("Error connecting to your node. Troubleshooting steps:\n")
+    print("\t1) Make sure bitcoind is running (and server=1 in bitcoin.conf)")
+    print("\t2) If needed, set rpcuser/rpcpassword or point to the .cookie file")
+    print("\t3) If the node is not local, set rpcconnect/rpcport in bitcoin.conf")
+    print("\nThe node was expected at:", f"{node.host}:{node.port}")
+    print("\nThe error from the node was:\n", e)
+    sys.exit()
 
 
 
@@ -228,19 +245,16 @@ def Ask_Node(command):
 # btc price estimate. The time information of blocks is listed in the block
 # header, so we ask for the header only when we just need to know the time.
 
-#import built in tools for dates/times and json style lists
+#import built in tools for dates/times
 from datetime import datetime, timezone, timedelta
-import json 
 
 #get current block height from local node and exit if connection not made
-block_count_b = Ask_Node(['getblockcount'])
-block_count = int(block_count_b)             #convert text to integer
+block_count = Ask_Node(['getblockcount'])
 block_count_consensus = block_count-6
 
 #get block header from current block height
-block_hash = Ask_Node(['getblockhash', str(block_count_consensus)]).decode().strip()
-block_header_b = Ask_Node(['getblockheader', block_hash, 'true'])
-block_header = json.loads(block_header_b)
+block_hash = Ask_Node(['getblockhash', block_count_consensus])
+block_header = Ask_Node(['getblockheader', block_hash, True])
 
 
 #get the date and time of the current block height
@@ -327,16 +341,24 @@ if date_mode:
 # Now that we have the target day we need to find which blocks were mined on this day.
 # This would be easy if bitcoin blocks were organized by time
 # instead of by block height. However there's no way to ask bitcoin for a block at a
-# specific time. Instead one must ask for a block, look at it's time, then estimate
-# the number of blocks to jump for the next guess. So we use this
-# guess and check method to find all blocks on the target day.
-
-#define a shortcut for getting the block time from the block number
-def get_block_time(height):
-    block_hash_b = Ask_Node(['getblockhash',str(height)])
-    block_header_b = Ask_Node(['getblockheader',block_hash_b[:64],'true'])
-    block_header = json.loads(block_header_b)
-    return(block_header['time'], block_hash_b[:64].decode())
+# specific time. Instead one must ask for blocks and look at their times. So we
+# keep the times of all blocks we've asked about in a local cache, and search the
+# cached times for the first and last blocks on the target day.
+
+#define a shortcut for getting the times of many blocks in just two batches
+def get_block_times(heights):
+    block_hashes = Ask_Node_Batch([['getblockhash',height] for height in heights])
+    block_headers = Ask_Node_Batch([['getblockheader',bh,True] for bh in block_hashes])
+    return([(header['time'], header['hash']) for header in block_headers])
+
+#define a shortcut for walking forward block by block that asks the node
+#for the next 200 block times at once instead of one at a time
+read_ahead_times = {}
+def get_block_time_read_ahead(height):
+    if height not in read_ahead_times:
+        heights = range(height, max(min(height+200, block_count+1), height+1))
+        read_ahead_times.update(zip(heights, get_block_times(heights)))
+    return(read_ahead_times[height])
 
 #define a shortcut for getting the day of money from a time in seconds
 def get_day_of_month(time_in_seconds):
@@ -354,9 +376,9 @@ if block_mode:
     
     #append needed block nums and hashes needed
     block_num = block_start_num
-    time_in_seconds, hash_end = get_block_time(block_start_num)
     print_every = 0
     while block_num < block_finish_num:
+        time_in_seconds, hash_end = get_block_time_read_ahead(block_num)
         
         #print update
         if (block_num-block_start_num)/144*100 > print_every and print_every < 100:
@@ -366,7 +388,6 @@ if block_mode:
         block_hashes_needed.append(hash_end)
         block_times_needed.append(time_in_seconds)
         block_num += 1
-        time_in_seconds, hash_end = get_block_time(block_num)
         
     print("100%\t\t\t25% done",flush=True)
 
@@ -375,97 +396,55 @@ elif date_mode:
     
     print("\nFinding all blocks on "+datetime_entered.strftime("%b %d, %Y"),flush=True)
     print("0%..",end="", flush=True)
-    #first estimate of the block height of the price day
-    seconds_since_price_day = latest_time_in_seconds - price_day_seconds
-    blocks_ago_estimate = round(144*float(seconds_since_price_day)/float(seconds_in_a_day))
-    price_day_block_estimate = block_count_consensus - blocks_ago_estimate
     
-    #check the time of the price day block estimate
-    time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
+    #the times of blocks buried under the consensus block never change, so they are
+    #kept in a local cache (next to the block index) and only new blocks are asked for
+    from header_cache import HeaderCache
+    header_cache = HeaderCache()
     
-    #get new block estimate from the seconds difference using 144 blocks per day
-    print("20%..",end="",flush=True)
-    seconds_difference = time_in_seconds - price_day_seconds
-    block_jump_estimate = round(144*float(seconds_difference)/float(seconds_in_a_day))
+    #drop any cached blocks that a reorg took off the best chain
+    header_cache.verify(get_block_times, block_count)
     
-    #iterate above process until it oscillates around the correct block
-    last_estimate = 0
-    last_last_estimate = 0
+    #make sure the cache reaches from before the price day up to the consensus block
+    print("20%..",end="",flush=True)
+    header_cache.cover_day(get_block_times, price_day_seconds, block_count_consensus)
     
+    #block times aren't always increasing but their median of 11 is, so bisect the
+    #medians to get near midnight, then step back over blocks stamped after midnight
+    #to exactly the first block of the target day and forward to the last
     print("40%..",end="",flush=True)
-    while block_jump_estimate >6 and block_jump_estimate != last_last_estimate:
-        
-        #when we oscillate around the correct block, last_last_estimate = block_jump_estimate
-        last_last_estimate = last_estimate
-        last_estimate = block_jump_estimate
-        
-        #get block header or new estimate
-        price_day_block_estimate = price_day_block_estimate-block_jump_estimate
-        
-        #check time of new block and get new block jump estimate
-        time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
-        seconds_difference = time_in_seconds - price_day_seconds
-        block_jump_estimate = round(144*float(seconds_difference)/float(seconds_in_a_day))
+    day_blocks = header_cache.day_blocks(price_day_seconds)
     
+    #in the rare case the day ends above the consensus block reach for the tip
     print("60%..",end="",flush=True)
-    #the oscillation may be over multiple blocks so we add/subtract single blocks 
-    #to ensure we have exactly the first block of the target day
-    if time_in_seconds > price_day_seconds:
-        
-        # if the estimate was after price day look at earlier blocks
-        while time_in_seconds > price_day_seconds:
-            
-            #decrement the block by one, read new block header, check time
-            price_day_block_estimate = price_day_block_estimate-1
-            time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
-            
-        #the guess is now perfectly the first block before midnight
-        price_day_block_estimate = price_day_block_estimate + 1
-        
-    # if the estimate was before price day look for later blocks
-    elif time_in_seconds < price_day_seconds:
-        
-        while time_in_seconds < price_day_seconds:
-            
-            #increment the block by one, read new block header, check time
-            price_day_block_estimate = price_day_block_estimate+1
-            time_in_seconds, hash_end = get_block_time(price_day_block_estimate) 
+    if day_blocks is None:
+        header_cache.cover_day(get_block_times, price_day_seconds, block_count)
+        day_blocks = header_cache.day_blocks(price_day_seconds)
+    if day_blocks is None:
+        print("\nCouldn't find the last block of the day. Run UTXOracle.py -rb for the most recent blocks")
+        sys.exit()
+    price_day_block, price_day_block_end = day_blocks
     
     print("80%..",end="",flush=True)
-    #assign the estimate as the price day block since it is correct now    
-    price_day_block = price_day_block_estimate
-    
-    #get the day of the month 
-    time_in_seconds, hash_start = get_block_time(price_day_block)
-    day1 = get_day_of_month(time_in_seconds)
-    
-    #get the last block number of the day
-    price_day_block_end = price_day_block 
-    time_in_seconds, hash_end = get_block_time(price_day_block_end)
-    day2 = get_day_of_month(time_in_seconds)
-    
     print("100%\t\t\t25% done",flush=True)
     print("\nDetermining the correct order of blocks",flush=True)
     
     #load block nums and hashes needed
-    block_num = 0
     print_next = 0
-    while day1 == day2:
+    for block_num in range(price_day_block, price_day_block_end):
         
         #print progress update
-        block_num+=1
-        if block_num/144 * 100 > print_next:
+        if (block_num-price_day_block+1)/144 * 100 > print_next:
             if print_next < 100:
                 print(str(print_next)+"%..",end="",flush=True)
                 print_next +=20
         
         #append needed block
-        block_nums_needed.append(price_day_block_end)
+        time_in_seconds, hash_end = header_cache.block_time(block_num)
+        block_nums_needed.append(block_num)
         block_hashes_needed.append(hash_end)
         block_times_needed.append(time_in_seconds)
-        price_day_block_end += 1 #assume 30+ blocks this day
-        time_in_seconds, hash_end = get_block_time(price_day_block_end)
-        day2 = get_day_of_month(time_in_seconds)
+    header_cache.close()
     
     #complete print update status
     while print_next<100:
@@ -487,91 +466,67 @@ elif date_mode:
 ##############################################################################  
 
 # In this section we find the byte-wise location of all the block data
-# that we need in terms of where it's stored on the user's hard drive
+# that we need in terms of where it's stored on the user's hard drive. The node
+# doesn't tell us where a block is stored, so we keep our own index of every
+# block's file, offset, size and time. The index is built once and after that
+# only the blocks the node wrote since the last run are added to it. This turns
+# finding a day of blocks into a quick lookup instead of a multi-GB read.
+# Since version 28 the node may obfuscate the blk files with the key in the
+# blocks directory's xor.dat, which the index and block reader undo as they read.
+# With -l the node's own LevelDB block index (blocks/index) is read instead,
+# which already knows where every block is, however old.
 
 print("\nMaping block locations in raw block files",flush=True)
 
-# standard variables for block readind and estiamted blocks per binary .blk file
-blocks_per_file=50 #generous, likely much more
-Mainnet_flag = b'\xf9\xbe\xb4\xd9'
-Header_size = 80
+#print progress updates as the index is extended
+print_next = 0
+def print_index_progress(fraction):
+    global print_next
+    while fraction*100 > print_next and print_next < 100:
+        print(str(print_next)+"%..",end="",flush=True)
+        print_next +=20
 
-#short cut for hashing
-from hashlib import sha256
-def sha256d(b): return sha256(sha256(b).digest()).digest()
+# the node's own LevelDB block index already holds every block's file and
+# position, so if asked to use it there's nothing to scan or estimate
+if use_leveldb_index:
+    from leveldb_index import LevelDBBlockIndex
+    try:
+        block_index = LevelDBBlockIndex(blocks_dir)
+    except (ImportError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    locations = block_index.lookup(block_hashes_needed)
+    block_index.close()
 
-# Get all .blk files sorted by index
-block_hashes_needed = set(block_hashes_needed)
+else:
+    # open the index (stored next to this file) of blocks in the binary .blk files
+    from block_index import BlockIndex, list_blk_files
+    block_index = BlockIndex(blocks_dir)
+
+    # conservatively estimate the first blk file needed. This only matters the first
+    # time the index is built, after that only new blocks get read
+    blocks_per_file=50 #generous, likely much more
+    block_depth_start = block_count_consensus - block_nums_needed[0]
+    last_blk_file_num = list_blk_files(blocks_dir)[-1]
+    start_blk_index = last_blk_file_num - int(block_depth_start/blocks_per_file +1) - 1
+
+    # add any new blocks to the index and look up the blocks needed. A date older
+    # than the index covers needs earlier blk files indexed too, so the start is
+    # stepped back the same number of files at a time until every block is found
+    locations = block_index.find_blocks(block_hashes_needed, start_blk_index, print_index_progress)
+    block_index.close()
+
+# keep the found blocks in block height order
 found_blocks = {}
-blk_files = sorted(
-        [f for f in os.listdir(blocks_dir) if f.startswith('blk') and f.endswith('.dat')],
-        key=lambda f: int(f[3:8])
-    )
-
-# conservatively estimate the first and last blk file needed
-block_depth_start = block_count_consensus - block_nums_needed[0]
-last_blk_file_num = int(blk_files[-1][3:8])
-start_blk_index = last_blk_file_num - int(block_depth_start/blocks_per_file +1) - 1
-end_blk_index_est = last_blk_file_num - int(int(block_depth_start/128))
-
-# read a swath of block files looking for the block hashes needeed
-blk_files = [f for f in blk_files if int(f[3:8]) >= start_blk_index]
-print_next = 0
-block_file_num  = 0
-for blk_file in blk_files:
-    
-    #path to the next blk file
-    path = os.path.join(blocks_dir, blk_file)
-    
-    #print progress update
-    block_file_num+=1
-    if block_file_num/(end_blk_index_est-start_blk_index)*100 > print_next:
-        if print_next < 100:
-            print(str(print_next)+"%..",end="",flush=True)
-            print_next +=20
-    
-    #read the blk file
-    with open(path, "rb") as f:
-        
-        while True:
-            #read the headers to the block
-            start = f.tell()
-            magic = f.read(4)
-            if not magic or len(magic) < 4:
-                break
-            if magic != Mainnet_flag:
-                f.seek(start + 1)
-                continue
-            size_bytes = f.read(4)
-            if len(size_bytes) < 4:
-                break
-            block_size = int.from_bytes(size_bytes, "little")
-            header = f.read(Header_size)
-            if len(header) < Header_size:
-                break
-
-            #read the block hash and time stamp
-            block_hash = sha256d(header)[::-1]  # big-endian
-            block_hash_hex = block_hash.hex()
-            timestamp = int.from_bytes(header[68:72], "little")
-           
-            #add block to the list if a needed block
-            if block_hash_hex in block_hashes_needed:
-                found_blocks[block_hash] = {
-                    "file": blk_file,
-                    "offset": start,
-                    "block_size": block_size,
-                    "time": timestamp
-                }
-                if len(found_blocks) == len(block_hashes_needed):
-                    break
-                
-            # find the next block in the blk file 
-            f.seek(start + 8 + block_size)
-    
-    # stop if all blocks found
-    if len(found_blocks) == len(block_hashes_needed):
-        break
+for block_hash_hex in block_hashes_needed:
+    if block_hash_hex in locations:
+        location = locations[block_hash_hex]
+        found_blocks[bytes.fromhex(block_hash_hex)] = {
+            "file": location.file,
+            "offset": location.offset,
+            "block_size": location.size,
+            "time": location.time
+        }
 
 # error if all blocks found, if good print progress update
 if len(found_blocks) != len(block_hashes_needed):
@@ -624,11 +579,10 @@ for exponent in range(-6,6): #python range uses 'less than' for the big number
         bin_value = 10 ** (exponent + b/200)
         output_bell_curve_bins.append(bin_value)
 
-# Create a list the same size as the bell curve to keep the count of the bins
+# Create an array the same size as the bell curve to keep the count of the bins
+import numpy as np
 number_of_bins = len(output_bell_curve_bins)
-output_bell_curve_bin_counts = []
-for n in range(0,number_of_bins):
-    output_bell_curve_bin_counts.append(float(0.0))
+output_bell_curve_bin_counts = np.zeros(number_of_bins)
 
 
 
@@ -654,96 +608,45 @@ for n in range(0,number_of_bins):
 
 print("\nLoading every transaction from every block",flush=True)
 
-#shortcut for reading bytes of data from the block file
-import struct
-from math import log10 
-import hashlib
-def read_varint(f):
-    i = f.read(1)
-    if not i:
-        return 0
-    i = i[0]
-    if i < 0xfd:
-        return i
-    elif i == 0xfd:
-        val = struct.unpack("<H", f.read(2))[0]
-    elif i == 0xfe:
-        val = struct.unpack("<I", f.read(4))[0]
-    else:
-        val = struct.unpack("<Q", f.read(8))[0]
-    return val
-
-#shortcut for encoding variable size integers to bytes
-from io import BytesIO
-def encode_varint(i: int) -> bytes:
-    assert i >= 0
-    if i < 0xfd:
-        return i.to_bytes(1, 'little')
-    elif i <= 0xffff:
-        return b'\xfd' + i.to_bytes(2, 'little')
-    elif i <= 0xffffffff:
-        return b'\xfe' + i.to_bytes(4, 'little')
-    else:
-        return b'\xff' + i.to_bytes(8, 'little')
-
-#shortcut for computing the txid because blk files don't store txids
-def compute_txid(raw_tx_bytes: bytes) -> bytes:
-    
-    stream = BytesIO(raw_tx_bytes)
-
-    # Read version
-    version = stream.read(4)
-
-    # Peek at marker/flag to detect SegWit
-    marker = stream.read(1)
-    flag = stream.read(1)
-    is_segwit = (marker == b'\x00' and flag == b'\x01')
-
-    if not is_segwit:
-        # Legacy tx: rewind and hash full raw tx
-        stream.seek(0)
-        stripped_tx = stream.read()
-    else:
-        # Start stripped tx with version
-        stripped_tx = bytearray()
-        stripped_tx += version
-
-        # Inputs
-        input_count = read_varint(stream)
-        stripped_tx += encode_varint(input_count)
-        for _ in range(input_count):
-            stripped_tx += stream.read(32)  # prev txid
-            stripped_tx += stream.read(4)   # vout index
-            script_len = read_varint(stream)
-            stripped_tx += encode_varint(script_len)
-            stripped_tx += stream.read(script_len)
-            stripped_tx += stream.read(4)   # sequence
-
-        # Outputs
-        output_count = read_varint(stream)
-        stripped_tx += encode_varint(output_count)
-        for _ in range(output_count):
-            stripped_tx += stream.read(8)   # value
-            script_len = read_varint(stream)
-            stripped_tx += encode_varint(script_len)
-            stripped_tx += stream.read(script_len)
-
-        # Skip witness data
-        for _ in range(input_count):
-            stack_count = read_varint(stream)
-            for _ in range(stack_count):
-                item_len = read_varint(stream)
-                stream.read(item_len)
-
-        # Locktime
-        stripped_tx += stream.read(4)
-
-    return hashlib.sha256(hashlib.sha256(stripped_tx).digest()).digest()[::-1]
-
+# Each blk file is memory mapped and every block is parsed in place, so a block
+# is read from disk only once and no tx is re-read just to compute its txid.
+# Blocks hand back their txids and the txs that pass the per-tx filters. The
+# same day filter then needs the txids of every earlier tx on this day. Blocks
+# don't depend on each other so they can be parsed on several cores (-j), but
+# they always come back in block order so the result is identical.
+#
+# What a block parses to never changes, so parsed blocks are also kept in a cache
+# (next to this file) by block hash. Only blocks not parsed on an earlier run are
+# read from the blk files, which makes re-running a date or an overlapping block
+# window much quicker.
+from block_reader import SameDayFilter, parse_blocks
+from block_cache import BlockCache
+from price_finder import bin_amounts
+same_day_filter = SameDayFilter()
+block_cache = BlockCache()
+cached_blocks = block_cache.load(block_hashes_needed)
+new_block_hashes = [bh for bh in block_hashes_needed if bh not in cached_blocks]
+new_block_locations = []
+for block_hash_hex in new_block_hashes:
+    meta = found_blocks[bytes.fromhex(block_hash_hex)]
+    new_block_locations.append((meta["file"], meta["offset"]))
+newly_parsed_blocks = parse_blocks(blocks_dir, new_block_locations, block_parse_processes)
+
+#hand out the blocks in height order, from the cache or freshly parsed
+def blocks_in_order():
+    for block_hash_hex in block_hashes_needed:
+        if block_hash_hex in cached_blocks:
+            yield cached_blocks[block_hash_hex]
+        else:
+            block_outputs = next(newly_parsed_blocks)
+            cached_blocks[block_hash_hex] = block_outputs
+            yield block_outputs
+parsed_blocks = blocks_in_order()
+
+#the bin edges as an array to search amounts against
+bin_edges = np.array(output_bell_curve_bins)
 
 #initialize output lists and variables
-from struct import unpack
-todays_txids = set()
 raw_outputs = []
 block_heights_dec = []
 block_times_dec = []
@@ -751,150 +654,37 @@ print_next = 0
 block_num = 0
 
 #loop through all found blocks
-for block_hash, meta in found_blocks.items():
+for block_outputs in parsed_blocks:
     
     #init variables for next block
     block_num += 1
-    num_block_txs = 0
-    txs_to_add = []
     
     #print progress update
     if block_num/len(block_nums_needed)*100 > print_next:
         print(str(print_next)+"%..",end="", flush=True)
         print_next +=20
     
-    #get the location of the block on the hard drive
-    file_path = os.path.join(blocks_dir, meta["file"])
-    with open(file_path, "rb") as f:
-        
-        #get tx count in this block
-        f.seek(meta["offset"])
-        f.read(8)   # skip magic + block size
-        f.read(80)  # skip block header
-        tx_count = read_varint(f)
-
-        #loop through all transactions 
-        for tx_index in range(tx_count):
-            num_block_txs += 1
-             
-            # read tx version type
-            start_tx = f.tell()
-            version = f.read(4)
-
-            # Segwit check
-            marker_flag = f.read(2)
-            is_segwit = (marker_flag == b'\x00\x01')
-            if not is_segwit:
-                f.seek(start_tx + 4)  # rewind if legacy
-
-            # read input count
-            input_count = read_varint(f)
-            inputs = []
-            has_op_return = False
-            witness_exceeds = False
-            is_coinbase = False
-            input_txids = []
-            
-            #loop through inputs
-            for _ in range(input_count):
-                prev_txid = f.read(32)
-                prev_index = f.read(4)
-                script_len = read_varint(f)
-                script = f.read(script_len)
-                f.read(4)  # sequence
-                
-                #add input txids to a list
-                input_txids.append(prev_txid[::-1].hex())
-                
-                #check for coinbase tx
-                if prev_txid == b'\x00' * 32 and prev_index == b'\xff\xff\xff\xff':
-                    is_coinbase = True
-                
-                # add input scripts to a list
-                inputs.append({ "script": script })
-
-            #read number of outputs
-            output_count = read_varint(f)
-            output_values = []
-            
-            #loop through outputs
-            for _ in range(output_count):
-                value_sats = unpack("<Q", f.read(8))[0]
-                script_len = read_varint(f)
-                script = f.read(script_len)
-                
-                # check for op_returns
-                if script and script[0] == 0x6a:  # OP_RETURN in output
-                    has_op_return = True
-                
-                # check for amount out of range
-                value_btc = value_sats / 1e8
-                if 1e-5 < value_btc < 1e5:
-                    output_values.append(value_btc)
-
-            #if segqt, check witness data
-            if is_segwit:
-                for input_data in inputs:
-                    stack_count = read_varint(f)
-                    total_witness_len = 0
-                    for _ in range(stack_count):
-                        item_len = read_varint(f)
-                        total_witness_len += item_len
-                        f.read(item_len)
-                        if item_len > 500:
-                            witness_exceeds = True
-
-                    # check it witness data larger than reasonable                    
-                    if total_witness_len > 500:
-                        witness_exceeds = True
-
-            #calculate the TXID of this transaction and add it to list
-            f.read(4)
-            end_tx = f.tell()
-            f.seek(start_tx)
-            raw_tx = f.read(end_tx - start_tx)
-            txid = compute_txid(raw_tx)
-            todays_txids.add(txid.hex())
-
-            #check for same day input re-use
-            is_same_day_tx = False
-            for itxid in input_txids:
-                if itxid in todays_txids:
-                    is_same_day_tx = True
-                
-            # === Final inclusion check ===
-            if (input_count <= 5 and output_count == 2 and not is_coinbase and
-                not has_op_return and not witness_exceeds) and not is_same_day_tx:
-                
-                # add all outputs to the bell curve
-                for amount in output_values:
-                    
-                    #find the right output amount bin to increment
-                    amount_log = log10(amount)
-                    percent_in_range = (amount_log-first_bin_value)/range_bin_values
-                    bin_number_est = int(percent_in_range * number_of_bins)
-                    
-                    #double check exact right bin (won't be less than)
-                    while output_bell_curve_bins[bin_number_est] <= amount:
-                        bin_number_est += 1
-                    bin_number = bin_number_est - 1
-                    
-                    #add this output to the bell curve
-                    output_bell_curve_bin_counts[bin_number] += 1.0
-                    
-                    #add the output to this block's output list
-                    txs_to_add.append(amount)
+    # === Final inclusion check (includes no same day inputs) ===
+    txs_to_add = same_day_filter.accept(block_outputs)
+    
+    # add all outputs to the bell curve. Each amount goes in the last bin
+    # whose lower edge is at or below it, found for the whole block at once
+    # with a binary search over the bin edges
+    output_bell_curve_bin_counts += bin_amounts(txs_to_add, bin_edges)
                     
     #add the block's output list to the total output list
     if len(txs_to_add)>0:
-        block_dec_inc = 1/len(txs_to_add)
         bkh = block_nums_needed[block_num-1]
         tm = block_times_needed[block_num-1]
         for amt in txs_to_add:
             raw_outputs.append(amt)
             block_heights_dec.append(bkh)
             block_times_dec.append(tm)
-                        
+
+#save the newly parsed blocks for next time
+block_cache.store({bh: cached_blocks[bh] for bh in new_block_hashes})
+block_cache.close()
+
 print("100% \t\t\t95% done",flush=True)
 
             
@@ -920,54 +710,13 @@ print("100% \t\t\t95% done",flush=True)
 print("\nFinding prices and rendering plot",flush=True)
 print("0%..",end="",flush=True)
 
-#remove outputs below 10k sat (increased from 1k sat in v6)
-for n in range(0,201):
-    output_bell_curve_bin_counts[n]=0
-
-#remove outputs above ten btc
-for n in range(1601,len(output_bell_curve_bin_counts)):
-    output_bell_curve_bin_counts[n]=0
-
-#create a list of round btc bin numbers
-round_btc_bins = [
-201,  # 1k sats
-401,  # 10k 
-461,  # 20k
-496,  # 30k
-540,  # 50k
-601,  # 100k 
-661,  # 200k
-696,  # 300k
-740,  # 500k
-801,  # 0.01 btc
-861,  # 0.02
-896,  # 0.03
-940,  # 0.04
-1001, # 0.1 
-1061, # 0.2
-1096, # 0.3
-1140, # 0.5
-1201  # 1 btc
-]
-
-#smooth over the round btc amounts
-for r in round_btc_bins:
-    amount_above = output_bell_curve_bin_counts[r+1]
-    amount_below = output_bell_curve_bin_counts[r-1]
-    output_bell_curve_bin_counts[r] = .5*(amount_above+amount_below)
-
-#get the sum of the curve
-curve_sum = 0.0
-for n in range(201,1601):
-    curve_sum += output_bell_curve_bin_counts[n]
-
-#normalize the curve by dividing by it's sum and removing extreme values
-for n in range(201,1601):
-    output_bell_curve_bin_counts[n] /= curve_sum
-    
-    #remove extremes (0.008 chosen by historical testing)
-    if output_bell_curve_bin_counts[n] > 0.008:
-        output_bell_curve_bin_counts[n] = 0.008
+#remove outputs below 10k sat (increased from 1k sat in v6) and above ten btc,
+#smooth over the round btc amounts (the bins listed in ROUND_BTC_BINS, from 1k
+#sats to 1 btc) with the average of the bins either side of them, then divide the
+#curve by its sum and cap extreme values at 0.008 (chosen by historical testing).
+#These steps live in price_finder.py so every tool cleans the curve the same way.
+from price_finder import clean_curve
+curve = clean_curve(output_bell_curve_bin_counts)
 
 #print update    
 print("20%..",end="",flush=True)
@@ -1005,16 +754,9 @@ print("20%..",end="",flush=True)
 #      *                                            *  
 #   10k sats        0.01 btc           1 btc        10btc 
 
-# Parameters
-num_elements = 803
-mean = 411 #(num_elements - 1) / 2  # Center of the array
-std_dev = 201
-
-#contstruct the smooth stencil
-smooth_stencil = []
-for x in range(num_elements):
-    exp_part = -((x - mean) ** 2) / (2 * (std_dev ** 2))
-    smooth_stencil.append( (.00150 * 2.718281828459045 ** exp_part) + (.0000005 * x) )
+# The smooth stencil (smooth_stencil in price_finder.py) is a bell shape over 803
+# bins centered on bin 411 with a standard deviation of 201 bins, plus a slight
+# upward slope.
 
 # Load the spike stencil that fine tunes the alignment on popular usd amounts
 #
@@ -1028,40 +770,9 @@ for x in range(num_elements):
 #       *   *    *    *   *    *     *    *     *     
 #      $1 $10  $20  $50  $100  $500  $1k  $2k   $10k
 
-spike_stencil = []
-for n in range(0,803):
-    spike_stencil.append(0.0)
-    
-#round usd bin location   #popularity    #usd amount  
-spike_stencil[40] = 0.001300198324984352  # $1
-spike_stencil[141]= 0.001676746949820743  # $5
-spike_stencil[201]= 0.003468805546942046  # $10
-spike_stencil[202]= 0.001991977522512513  # 
-spike_stencil[236]= 0.001905066647961839  # $15
-spike_stencil[261]= 0.003341772718156079  # $20
-spike_stencil[262]= 0.002588902624584287  # 
-spike_stencil[296]= 0.002577893841190244  # $30
-spike_stencil[297]= 0.002733728814200412  # 
-spike_stencil[340]= 0.003076117748975647  # $50
-spike_stencil[341]= 0.005613067550103145  # 
-spike_stencil[342]= 0.003088253178535568  # 
-spike_stencil[400]= 0.002918457489366139  # $100
-spike_stencil[401]= 0.006174500465286022  # 
-spike_stencil[402]= 0.004417068070043504  # 
-spike_stencil[403]= 0.002628663628020371  # 
-spike_stencil[436]= 0.002858828161543839  # $150
-spike_stencil[461]= 0.004097463611984264  # $200
-spike_stencil[462]= 0.003345917406120509  # 
-spike_stencil[496]= 0.002521467726855856  # $300
-spike_stencil[497]= 0.002784125730361008  # 
-spike_stencil[541]= 0.003792850444811335  # $500
-spike_stencil[601]= 0.003688240815848247  # $1000
-spike_stencil[602]= 0.002392400117402263  # 
-spike_stencil[636]= 0.001280993059008106  # $1500
-spike_stencil[661]= 0.001654665137536031  # $2000
-spike_stencil[662]= 0.001395501347054946  # 
-spike_stencil[741]= 0.001154279140906312  # $5000
-spike_stencil[801]= 0.000832244504868709  # $10000
+# The spike stencil (spike_stencil in price_finder.py) is zero except at the bins
+# of round usd amounts, where it holds how popular that amount is. The bins and
+# their popularity are listed in SPIKE_STENCIL_WEIGHTS.
 
 
 
@@ -1075,86 +786,15 @@ spike_stencil[801]= 0.000832244504868709  # $10000
 # where it fits the best. The best fit location and it's neighbor are used
 # in a weighted average to estimate the best fit USD price
 
-# set up scores for sliding the stencil
-best_slide        = 0
-best_slide_score  = 0
-total_score       = 0
-
-#weighting of the smooth and spike slide scores
-smooth_weight     = 0.65
-spike_weight      = 1
-
-#establish the center slide such that if zero slide then 0.001 btc is $100 ($100k price)
-center_p001 = 601   # 601 is where 0.001 btc is in the output bell curve
-left_p001   = center_p001 - int((len(spike_stencil) +1)/2)
-right_p001  = center_p001 + int((len(spike_stencil) +1)/2)
-
-#upper and lower limits for sliding the stencil
-min_slide = -141   # $500k
-max_slide =  201   # $5k
-    
-#slide the stencil and calculate slide score
-for slide in range(min_slide,max_slide):
-    
-    #shift the bell curve by the slide
-    shifted_curve = output_bell_curve_bin_counts[left_p001+slide:right_p001+slide]
-    
-    #score the smoothslide by multiplying the curve by the stencil
-    slide_score_smooth = 0.0
-    for n in range(0,len(smooth_stencil)):
-        slide_score_smooth += shifted_curve[n]*smooth_stencil[n]
-    
-    #score the spiky slide by multiplying the curve by the stencil
-    slide_score = 0.0
-    for n in range(0,len(spike_stencil)):
-        slide_score += shifted_curve[n]*spike_stencil[n]
-    
-    # add the spike and smooth slide scores, neglect smooth slide over wrong regions
-    if slide < 150:
-        slide_score = slide_score + slide_score_smooth*.65
-        
-    # see if this score is the best so far
-    if slide_score > best_slide_score:
-        best_slide_score = slide_score
-        best_slide = slide
-    
-    # increment the total score
-    total_score += slide_score
-        
-# estimate the usd price of the best slide
-usd100_in_btc_best = output_bell_curve_bins[center_p001+best_slide]
-btc_in_usd_best = 100/(usd100_in_btc_best)
-
-#find best slide neighbor up
-neighbor_up = output_bell_curve_bin_counts[left_p001+best_slide+1:right_p001+best_slide+1]
-neighbor_up_score = 0.0
-for n in range(0,len(spike_stencil)):
-    neighbor_up_score += neighbor_up[n]*spike_stencil[n]
-
-#find best slide neighbor down
-neighbor_down = output_bell_curve_bin_counts[left_p001+best_slide-1:right_p001+best_slide-1]
-neighbor_down_score = 0.0
-for n in range(0,len(spike_stencil)):
-    neighbor_down_score += neighbor_down[n]*spike_stencil[n]
-
-#get best neighbor
-best_neighbor = +1
-neighbor_score = neighbor_up_score
-if neighbor_down_score > neighbor_up_score:
-    best_neighbor = -1
-    neighbor_score = neighbor_down_score
-
-#get best neighbor usd price
-usd100_in_btc_2nd = output_bell_curve_bins[center_p001+best_slide+best_neighbor]
-btc_in_usd_2nd = 100/(usd100_in_btc_2nd)
-
-#weight average the two usd price estimates
-avg_score = total_score/len(range(min_slide,max_slide))
-a1 = best_slide_score - avg_score
-a2 = abs(neighbor_score - avg_score)
-w1 = a1/(a1+a2)
-w2 = a2/(a1+a2)
-rough_price_estimate = int(w1*btc_in_usd_best + w2*btc_in_usd_2nd)
+# The slide is measured from the center slide where 0.001 btc is $100 (a $100k
+# price) and runs from -141 ($500k) to 201 ($5k). At every slide both stencils
+# are scored by multiplying the curve by the stencil, and the smooth score is
+# added in at a weight of .65 (except for slides of 150 and up, where the smooth
+# stencil is over the wrong region). The first slide with the best score gives
+# one usd price, the better of its two neighbors another, and the two are
+# averaged, weighted by how far their scores stand above the average score.
+from price_finder import rough_price
+rough_price_estimate = rough_price(curve, bin_edges)
 
 # Print update
 print("40%..",end="",flush=True)
@@ -1171,75 +811,21 @@ print("40%..",end="",flush=True)
 # In this section we converting the outputs to the price used by those outputs to
 # create a round USD amount. we also further remove micro round sat amounts (new in v 9)
 
-
-# list of round USD prices to collect outputs from
-usds = [5,10,15,20,25,30,40,50,100,150,200,300,500,1000]
-
-# pct of price increase of decrease to include
-pct_range_wide = .25
-
-# filter for micro round satoshi amounts
-micro_remove_list = []
-i = .00005000
-while i<.0001:
-    micro_remove_list.append(i)
-    i += .00001
-i = .0001
-while i<.001:
-    micro_remove_list.append(i)
-    i += .00001
-i = .001
-while i<.01:
-    micro_remove_list.append(i)
-    i += .0001
-i = .01
-while i<.1:
-    micro_remove_list.append(i)
-    i += .001
-i = .1
-while i<1:
-    micro_remove_list.append(i)
-    i += .01
-pct_micro_remove = .0001
-
-# init output prices list
-output_prices = []
-output_blocks = []
-output_times = []
-
-#loop through all outputs
-for i in range (0,len(raw_outputs)):
-    
-    #get the amount, height and time of the next output
-    n = raw_outputs[i]
-    b = block_heights_dec[i]
-    t = block_times_dec[i]
-    
-    #loop throughll usd amounts possible
-    for usd in usds:
-        
-        #calculate the upper and lower bounds for the USD range
-        avbtc = usd/rough_price_estimate
-        btc_up = avbtc + pct_range_wide * avbtc 
-        btc_dn = avbtc - pct_range_wide * avbtc
-    
-        # check if inside price bounds
-        if btc_dn < n < btc_up:
-            append = True
-            
-            #remove perfectly round sats
-            for r in micro_remove_list:
-                
-                rm_dn = r - pct_micro_remove * r
-                rm_up = r + pct_micro_remove * r
-                if rm_dn < n < rm_up:
-                    append = False
-            
-            # if in price range and not perfectly round sat, add to list
-            if append:
-                output_prices.append(usd/n)
-                output_blocks.append(b)
-                output_times.append(t)
+# The round USD amounts to collect outputs near are $5 to $1000 (USDS), and an
+# output counts if it's within 25% of one at the rough price (PCT_RANGE_WIDE).
+# Micro round satoshi amounts (5k sats up to 1 btc, see micro_round_amounts) are
+# left out if an output is within 0.01% of one (PCT_MICRO_REMOVE).
+from price_finder import PCT_MICRO_REMOVE, PCT_RANGE_WIDE, USDS, micro_round_amounts, round_sat_mask, usd_price_points
+raw_outputs_array = np.array(raw_outputs)
+round_sats = round_sat_mask(raw_outputs_array, micro_round_amounts(), PCT_MICRO_REMOVE)
+
+# for every output and every usd amount, check if the output is inside the
+# price bounds of the usd amount and, if not perfectly round sats, add the
+# price that makes it that usd amount
+output_indexes, prices = usd_price_points(raw_outputs_array, USDS, rough_price_estimate, PCT_RANGE_WIDE, round_sats)
+output_prices = prices.tolist()
+output_blocks = np.array(block_heights_dec)[output_indexes].tolist()
+output_times = np.array(block_times_dec)[output_indexes].tolist()
 
 print("60%..",end="",flush=True)
 
@@ -1258,69 +844,16 @@ print("60%..",end="",flush=True)
 # points of the day. This has been found by testing to be better than
 # the mean or the median because we specifically need the cluster center
 
-# define an algorithm for finding the central price point and avg deviation
-def find_central_output(r2, price_min, price_max):
-    
-    #sort the list of prices
-    r6 = [r for r in r2 if price_min < r < price_max]
-    outputs = sorted(r6)
-    n = len(outputs)
-
-    # Prefix sums
-    prefix_sum = []
-    total = 0
-    for x in outputs:
-        total += x
-        prefix_sum.append(total)
-
-    # count the number of point left and right
-    left_counts = list(range(n))
-    right_counts = [n - i - 1 for i in left_counts]
-    left_sums = [0] + prefix_sum[:-1]
-    right_sums = [total - x for x in prefix_sum]
-
-    # find the total distance to other points
-    total_dists = []
-    for i in range(n):
-        dist = (outputs[i] * left_counts[i] - left_sums[i]) + (right_sums[i] - outputs[i] * right_counts[i])
-        total_dists.append(dist)
-
-    # find the Most central output
-    min_index, _ = min(enumerate(total_dists), key=lambda x: x[1])
-    best_output = outputs[min_index]
-
-    # Median absolute deviation
-    deviations = [abs(x - best_output) for x in outputs]
-    deviations.sort()
-    m = len(deviations)
-    if m % 2 == 0:
-        mad = (deviations[m//2 - 1] + deviations[m//2]) / 2
-    else:
-        mad = deviations[m//2]
-
-    return best_output, mad
-
-
-# use a tight pct range to find the first central price
-pct_range_tight = .05
-price_up = rough_price_estimate + pct_range_tight * rough_price_estimate 
-price_dn = rough_price_estimate - pct_range_tight * rough_price_estimate
-central_price, av_dev = find_central_output(output_prices,price_dn,price_up)
-
-# find the deviation as a percentage of the price range
-price_range = price_up - price_dn
-dev_pct = av_dev/price_range
+# The central output is the one with the least total distance to all other
+# outputs in a price window, and the deviation is the median absolute deviation
+# from it (find_central_output in price_finder.py). The prices are sorted only
+# once so each window is just a slice of them.
+from price_finder import central_price as find_central_price, find_central_output
+sorted_prices = np.sort(np.array(output_prices))
 
-# iteratively re-center the bounds and find a new center price until convergence
-avs = set()
-avs.add(central_price)
-while central_price not in avs:
-    avs.add(central_price)
-    price_up = central_price + pct_range_tight * central_price 
-    price_dn = central_price - pct_range_tight * central_price
-    central_price, av_dev = find_central_output(output_prices,price_dn,price_up)
-    price_range = price_up - price_dn
-    dev_pct = av_dev/price_range
+# start from a window 5% either side of the rough price, then re-center the
+# window on the central price and find the center again until it repeats
+central_price = find_central_price(sorted_prices, rough_price_estimate)
 
 #print update
 print("80%..",end="",flush=True)
@@ -1330,7 +863,7 @@ pct_range_med = .1
 price_up = central_price + pct_range_med * central_price 
 price_dn = central_price - pct_range_med * central_price
 price_range = price_up - price_dn
-unused_price, av_dev = find_central_output(output_prices,price_dn,price_up)
+unused_price, av_dev = find_central_output(sorted_prices,price_dn,price_up)
 dev_pct = av_dev/price_range
 
 # use the pct deviation of data to set y axis range
@@ -138,11 +138,22 @@ def _(mo):
 
 
 @app.cell
-def _(pl):
-    blocks = pl.read_parquet('dude_data/blocks.parquet')
-    txs = pl.read_parquet('dude_data/txs.parquet').drop(['locktime'])
-    inputs = pl.read_parquet('dude_data/inputs.parquet')
-    outputs = pl.read_parquet('dude_data/outputs.parquet').drop(['script_size'])
+def _():
+    from parquet_oracle import scan_table
+
+    # each table is a directory of part-files partitioned by height_bucket, and
+    # outputs are tied to their tx by (block_id, tx_index). The tables are scanned
+    # lazily so only the columns used are read, and narrowing the block range
+    # skips every partition (and row group) outside it.
+    first_block, last_block = 0, 2**32 - 1
+    txs = (
+        scan_table('dude_data', 'txs', first_block, last_block)
+        .select(['block', 'block_id', 'tx_index', 'n_inputs', 'n_outputs', 'witness_size'])
+    )
+    outputs = (
+        scan_table('dude_data', 'outputs', first_block, last_block)
+        .select(['block_id', 'tx_index', 'index', 'amount'])
+    )
     return outputs, txs
 
 
@@ -157,19 +168,20 @@ def _(outputs, pl, txs):
             (pl.col('witness_size') > 500).alias('is_witness_too_big'),
         )
         .drop(['n_inputs', 'n_outputs', 'witness_size'])
-        .join(outputs, on='txid', how='inner')
+        .join(outputs, on=['block_id', 'tx_index'], how='inner')
         .with_columns(
             (pl.col('amount') < 1000).alias('is_amount_too_small'),
             (pl.col('amount') >= 10e8).alias('is_amount_too_big'),
         )
         .rename({'index': 'output_index'})
         .select(
-            pl.col(['block', 'txid', 'amount', 'output_index']),
+            pl.col(['block', 'tx_index', 'amount', 'output_index']),
             pl.col('^is_.*$')
         )
         .with_columns(
             pl.any_horizontal(pl.col('^is_.*$')).alias('exclude')
         )
+        .collect(engine='streaming')
     )
     return (outputs_with_flags,)
 
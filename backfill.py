@@ -0,0 +1,249 @@
+import argparse
+import logging
+import os
+import platform
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from block_index import BlockIndex, list_blk_files
+from block_reader import BlockOutputs, SameDayFilter, parse_blocks
+from header_cache import HeaderCache
+from leveldb_index import LevelDBBlockIndex
+from node_rpc import NodeRPC, RPCError, conf_blocks_dir
+from price_finder import bin_amounts, estimate_price, output_bins
+
+# Building a price history by running UTXOracle.py once per date redoes the node
+# queries, the block lookups and the block parsing for every day. A backfill takes
+# a whole date range instead: it finds every day's blocks from the header cache,
+# reads the blk files holding them in one pass in file order, and hands each parsed
+# block to the day (or days) it belongs to. As soon as all of a day's blocks are in,
+# the day is run through the same-day filter in block height order and priced
+# exactly as UTXOracle.py would price it.
+
+logger = logging.getLogger(__name__)
+
+FIRST_PRICE_DATE = datetime(2023, 12, 15, tzinfo=timezone.utc)
+BLOCKS_PER_FILE = 50  # generous, only used to guess the first blk file of a cold index
+
+
+def default_data_dir() -> str:
+    system = platform.system()
+    if system == "Darwin":
+        return os.path.expanduser("~/Library/Application Support/Bitcoin")
+    elif system == "Windows":
+        return os.path.join(os.environ.get("APPDATA", ""), "Bitcoin")
+    return os.path.expanduser("~/.bitcoin")
+
+
+def read_conf(data_dir: str) -> Dict[str, str]:
+    """Return the key=value settings in the data dir's bitcoin.conf, as 'section.key' under a [section]."""
+    conf_settings = {}
+    section = ""
+    with open(os.path.join(data_dir, "bitcoin.conf")) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1].strip() + "."
+                continue
+            if "=" in line:
+                key, value = line.split("=", 1)
+                conf_settings[section + key.strip()] = value.strip().strip('"')
+    return conf_settings
+
+
+def parse_date(text: str) -> datetime:
+    year, month, day = (int(part) for part in text.split("/"))
+    return datetime(year, month, day, tzinfo=timezone.utc)
+
+
+@dataclass
+class DayAccumulator:
+    """The blocks of one UTC day and what has been parsed of them so far."""
+    date: datetime
+    heights: List[int]
+    parsed: Dict[int, BlockOutputs] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.parsed) == len(self.heights)
+
+    def price(self, bins: np.ndarray) -> float:
+        """Filter the day's blocks in height order and price the outputs that pass."""
+        same_day_filter = SameDayFilter()
+        bin_counts = np.zeros(len(bins))
+        raw_outputs = []
+        for height in self.heights:
+            amounts = same_day_filter.accept(self.parsed[height])
+            bin_counts += bin_amounts(amounts, bins)
+            raw_outputs.extend(amounts)
+        return estimate_price(bin_counts, raw_outputs, bins)
+
+
+def find_days(node: NodeRPC, start: datetime, end: datetime) -> Tuple[List[DayAccumulator], Dict[int, str]]:
+    """
+    Find the blocks of every day from start to end (inclusive).
+
+    Returns:
+        The days, and the hash of every block height needed.
+    """
+    block_count = node.call("getblockcount")
+    block_count_consensus = block_count - 6
+    latest_time = node.get_block_headers([block_count_consensus])[0]["time"]
+    latest_utc_midnight = datetime.fromtimestamp(latest_time, tz=timezone.utc).replace(hour=0, minute=0, second=0)
+
+    if start < FIRST_PRICE_DATE:
+        raise ValueError("the start date is before 2023-12-15")
+    if end >= latest_utc_midnight:
+        raise ValueError("the end date is after the latest available, we need 6 blocks after UTC midnight")
+    if end < start:
+        raise ValueError("the end date is before the start date")
+
+    def get_block_times(heights):
+        return [(header["time"], header["hash"]) for header in node.get_block_headers(list(heights))]
+
+    header_cache = HeaderCache()
+    try:
+        header_cache.verify(get_block_times, block_count)
+        header_cache.cover_day(get_block_times, int(start.timestamp()), block_count_consensus)
+
+        days = []
+        block_hashes = {}
+        date = start
+        while date <= end:
+            day_blocks = header_cache.day_blocks(int(date.timestamp()))
+            if day_blocks is None:
+                raise ValueError(f"couldn't find the blocks of {date:%Y-%m-%d}")
+            heights = list(range(*day_blocks))
+            for height in heights:
+                block_hashes[height] = header_cache.block_time(height)[1]
+            days.append(DayAccumulator(date, heights))
+            date += timedelta(days=1)
+    finally:
+        header_cache.close()
+
+    return days, block_hashes
+
+
+def locate_blocks(
+    blocks_dir: str, block_hashes: Dict[int, str], depth: int, leveldb: bool = False
+) -> Dict[int, Tuple[str, int]]:
+    """
+    Find the blk file and offset of every block, extending the block index as needed.
+
+    Args:
+        blocks_dir: The node's blocks directory.
+        block_hashes: Height -> hash of every block needed.
+        depth: How many blocks below the tip the oldest block is (sizes a cold index build).
+        leveldb: Read the node's own LevelDB block index instead of our index.
+
+    Returns:
+        Height -> (blk file name, offset).
+    """
+    if leveldb:
+        with LevelDBBlockIndex(blocks_dir) as block_index:
+            locations = block_index.lookup(block_hashes.values())
+    else:
+        with BlockIndex(blocks_dir) as block_index:
+            start_blk_index = list_blk_files(blocks_dir)[-1] - int(depth / BLOCKS_PER_FILE + 1) - 1
+            locations = block_index.find_blocks(block_hashes.values(), start_blk_index)
+
+    missing = [height for height, block_hash in block_hashes.items() if block_hash not in locations]
+    if missing:
+        raise ValueError(f"{len(missing)} blocks are not in the blk files, e.g. height {missing[0]}")
+    return {
+        height: (locations[block_hash].file, locations[block_hash].offset)
+        for height, block_hash in block_hashes.items()
+    }
+
+
+def backfill(data_dir: str, start: datetime, end: datetime, processes: int = 1, leveldb: bool = False):
+    """
+    Price every day from start to end (inclusive) with one pass over the blk files.
+
+    Args:
+        data_dir: The node's data directory (holding bitcoin.conf).
+        start: First UTC date to price.
+        end: Last UTC date to price.
+        processes: Number of processes parsing blocks.
+        leveldb: Find the blocks with the node's LevelDB block index (needs plyvel).
+
+    Yields:
+        (date, price, first block height, last block height) for each day, in date order.
+    """
+    conf_settings = read_conf(data_dir)
+    blocks_dir = conf_blocks_dir(conf_settings, data_dir)
+    node = NodeRPC.from_conf(conf_settings, data_dir)
+
+    days, block_hashes = find_days(node, start, end)
+    block_count = node.call("getblockcount")
+    node.close()
+    logger.info(f"Found {len(block_hashes):,} blocks on {len(days)} days")
+
+    locations = locate_blocks(blocks_dir, block_hashes, block_count - min(block_hashes), leveldb)
+
+    # a block stamped out of order near midnight can belong to two days
+    days_of_height: Dict[int, List[DayAccumulator]] = {}
+    for day in days:
+        for height in day.heights:
+            days_of_height.setdefault(height, []).append(day)
+
+    # parse in file order so every blk file is read once, front to back
+    heights = sorted(block_hashes, key=lambda height: locations[height])
+    bins = output_bins()
+    next_day = 0
+    priced: Dict[int, float] = {}
+    parsed = parse_blocks(blocks_dir, [locations[height] for height in heights], processes)
+    for height, block_outputs in zip(heights, parsed):
+        for day in days_of_height[height]:
+            day.parsed[height] = block_outputs
+            if day.complete:
+                priced[id(day)] = day.price(bins)
+                day.parsed.clear()
+
+        # hand back finished days in date order
+        while next_day < len(days) and id(days[next_day]) in priced:
+            day = days[next_day]
+            yield day.date, priced.pop(id(day)), day.heights[0], day.heights[-1]
+            next_day += 1
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Price every day in a date range in one pass over the blk files.")
+    parser.add_argument("-s", "--start", required=True, help="first UTC date, YYYY/MM/DD")
+    parser.add_argument("-e", "--end", required=True, help="last UTC date, YYYY/MM/DD")
+    parser.add_argument("-p", "--data-dir", default=default_data_dir(), help="the node's data directory")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="number of processes parsing blocks")
+    parser.add_argument("-o", "--output", help="also write the prices to this csv file")
+    parser.add_argument("-l", "--leveldb", action="store_true",
+                        help="find blocks with the node's LevelDB block index (needs plyvel)")
+    args = parser.parse_args(argv)
+
+    out = None
+    try:
+        if args.output:
+            out = open(args.output, "w")
+            out.write("date,price,first_block,last_block\n")
+        for date, price, first_block, last_block in backfill(
+            args.data_dir, parse_date(args.start), parse_date(args.end), args.processes, args.leveldb
+        ):
+            print(f"{date:%Y-%m-%d} ${int(price):,}", flush=True)
+            if out:
+                out.write(f"{date:%Y-%m-%d},{price},{first_block},{last_block}\n")
+                out.flush()
+    except (ImportError, ValueError, RPCError, OSError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        if out:
+            out.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    main()
@@ -0,0 +1,635 @@
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from struct import pack
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backfill import parse_date
+from block_index import BlockIndex, blk_file_name
+from block_reader import SameDayFilter, parse_blocks
+from block_xor import XOR_KEY_FILE, deobfuscate
+from header_cache import HeaderCache
+from node_rpc import NodeRPC
+from price_finder import (
+    PCT_MICRO_REMOVE,
+    PCT_RANGE_WIDE,
+    USDS,
+    bin_amounts,
+    central_price,
+    clean_curve,
+    find_central_output,
+    micro_round_amounts,
+    output_bins,
+    rough_price,
+    round_sat_mask,
+    usd_price_points,
+)
+
+# There was no way to tell whether a change made UTXOracle faster or slower, and
+# the scripts that did touch real data were hardcoded to one blk file. This
+# benchmark needs no node and no blockchain: it writes a deterministic synthetic
+# chain around a UTC day as blk files, with a mainnet-like mix of legacy, segwit
+# and taproot spends, inscriptions (oversized witness items), op_returns, coinbases,
+# consolidations with many inputs, batched payouts and same-day spends, and with
+# payment amounts clustered on round usd values at a known price. A fake node on
+# localhost answers the rpc calls about it.
+#
+# Every stage of pricing that day then runs on its own with the same code the
+# scripts use, and is timed separately: finding the day's blocks over rpc (Part 5),
+# indexing the blk files (Part 6), parsing the blocks and filtering the outputs
+# (Part 8), cleaning the bell curve (Part 9), the stencil slide and the prices of
+# the outputs near round usd amounts (Part 10) and the central price (Part 11),
+# the last three with the same price_finder calls UTXOracle.py makes. Results can
+# be saved as a baseline which later runs are compared against, stage by stage.
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+MAINNET_MAGIC = b'\xf9\xbe\xb4\xd9'
+FIRST_HEIGHT = 820000
+BLOCK_INTERVAL = 600            # seconds between blocks, on average
+HOURS_BEFORE = 8                # chain generated before the day, for the header search
+HOURS_AFTER = 4                 # and after it, for the consensus depth
+MAX_BLK_FILE_SIZE = 16 * 2**20  # smaller than the node's 128 MiB so there are several files
+RECENT_TXIDS = 5000             # earlier txids a synthetic tx may spend from
+RPC_USER = "bench"
+RPC_PASSWORD = "bench"
+
+# (kind, share of the non-coinbase txs)
+TX_MIX = [
+    ("legacy", .15),
+    ("segwit", .40),
+    ("taproot", .22),
+    ("inscription", .05),  # taproot script path spend with a witness item over 500 bytes
+    ("op_return", .05),
+    ("many_inputs", .06),
+    ("batch", .07),        # one payer, many outputs
+]
+ROUND_USD_SHARE = .6   # payments of a round usd amount, the rest are random amounts
+SAME_DAY_SHARE = .25   # inputs spending an earlier synthetic tx instead of an older one
+
+# regressions are stages this much slower than the baseline
+DEFAULT_TOLERANCE = .2
+# the price finding stages take well under a millisecond, they are repeated for this long
+MIN_TIMED_SECONDS = .2
+
+
+def sha256d(data: bytes) -> bytes:
+    return sha256(sha256(data).digest()).digest()
+
+
+def compact_size(n: int) -> bytes:
+    if n < 0xfd:
+        return bytes([n])
+    elif n <= 0xffff:
+        return b'\xfd' + pack('<H', n)
+    elif n <= 0xffffffff:
+        return b'\xfe' + pack('<I', n)
+    return b'\xff' + pack('<Q', n)
+
+
+def serialize_tx(
+    inputs: List[Tuple[bytes, bytes]],
+    outputs: List[Tuple[int, bytes]],
+    witnesses: Optional[List[List[bytes]]] = None,
+) -> Tuple[bytes, bytes]:
+    """
+    Serialize a version 2 tx.
+
+    Args:
+        inputs: (36 byte prevout, script sig) per input.
+        outputs: (amount in sats, script pubkey) per output.
+        witnesses: The witness stack of every input, or None for a legacy tx.
+
+    Returns:
+        The raw tx and its txid (internal byte order).
+    """
+    body = compact_size(len(inputs))
+    body += b''.join(prevout + compact_size(len(script)) + script + b'\xff\xff\xff\xff' for prevout, script in inputs)
+    body += compact_size(len(outputs))
+    body += b''.join(pack('<Q', amount) + compact_size(len(script)) + script for amount, script in outputs)
+    version, locktime = pack('<I', 2), pack('<I', 0)
+    txid = sha256d(version + body + locktime)
+    if witnesses is None:
+        return version + body + locktime, txid
+    witness = b''.join(
+        compact_size(len(stack)) + b''.join(compact_size(len(item)) + item for item in stack) for stack in witnesses
+    )
+    return version + b'\x00\x01' + body + witness + locktime, txid
+
+
+def merkle_root(txids: List[bytes]) -> bytes:
+    level = txids
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + level[-1:]
+        level = [sha256d(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def write_conf(node_dir: str, rpc_port: Optional[int] = None) -> None:
+    """Write a bitcoin.conf pointing at the fake node."""
+    with open(os.path.join(node_dir, "bitcoin.conf"), "w") as f:
+        f.write(f"server=1\nrpcuser={RPC_USER}\nrpcpassword={RPC_PASSWORD}\n")
+        if rpc_port is not None:
+            f.write(f"rpcport={rpc_port}\n")
+
+
+class SyntheticChain:
+    """
+    Deterministic synthetic blocks around a UTC day.
+
+    The same arguments always give the same blocks, byte for byte.
+
+    Args:
+        date: The UTC day the chain is built around.
+        txs_per_block: Txs in every block, the coinbase included.
+        price: The usd price the round usd payments are made at.
+        seed: Seed of the random generator.
+    """
+
+    def __init__(self, date: datetime, txs_per_block: int = 2000, price: float = 43000, seed: int = 1):
+        self.date = date
+        self.txs_per_block = txs_per_block
+        self.price = price
+        self.rng = random.Random(seed)
+        self.recent_txids: List[bytes] = []
+        self.kinds = [kind for kind, _ in TX_MIX]
+        self.weights = [share for _, share in TX_MIX]
+
+    def _prevout(self) -> bytes:
+        rng = self.rng
+        if self.recent_txids and rng.random() < SAME_DAY_SHARE:
+            txid = self.recent_txids[rng.randrange(len(self.recent_txids))]
+        else:
+            txid = rng.randbytes(32)
+        return txid + pack('<I', rng.randrange(4))
+
+    def _payment_amount(self) -> int:
+        rng = self.rng
+        if rng.random() < ROUND_USD_SHARE:
+            usd = rng.choice(USDS) * (1 + rng.gauss(0, .002))
+            return max(1, int(round(usd / (self.price * (1 + rng.gauss(0, .01))) * 1e8)))
+        return int(10 ** rng.uniform(3.5, 9.5))
+
+    def _coinbase(self, height: int) -> Tuple[bytes, bytes]:
+        rng = self.rng
+        script_sig = b'\x03' + height.to_bytes(3, 'little') + rng.randbytes(20)  # BIP-34 height push
+        outputs = [
+            (312500000, b'\x00\x14' + rng.randbytes(20)),
+            (0, b'\x6a\x24\xaa\x21\xa9\xed' + rng.randbytes(32)),  # witness commitment
+        ]
+        return serialize_tx([(bytes(32) + b'\xff\xff\xff\xff', script_sig)], outputs, [[bytes(32)]])
+
+    def _tx(self) -> Tuple[bytes, bytes]:
+        rng = self.rng
+        kind = rng.choices(self.kinds, self.weights)[0]
+        n_inputs = rng.randint(6, 40) if kind == "many_inputs" else (1 if rng.random() < .7 else rng.randint(2, 5))
+        prevouts = [self._prevout() for _ in range(n_inputs)]
+
+        outputs = [(self._payment_amount(), b'\x00\x14' + rng.randbytes(20))]
+        if kind == "batch":
+            outputs += [(self._payment_amount(), b'\x00\x14' + rng.randbytes(20)) for _ in range(rng.randint(3, 60))]
+        elif kind == "many_inputs" or rng.random() < .1:
+            pass  # no change
+        else:
+            outputs.append((int(10 ** rng.uniform(4, 9)), b'\x51\x20' + rng.randbytes(32)))
+        if kind == "op_return":
+            outputs.append((0, b'\x6a\x14' + rng.randbytes(20)))
+
+        if kind == "legacy":
+            script_sig = b'\x48' + rng.randbytes(72) + b'\x21' + rng.randbytes(33)
+            return serialize_tx([(prevout, script_sig) for prevout in prevouts], outputs)
+        if kind in ("taproot", "batch"):
+            witnesses = [[rng.randbytes(64)] for _ in prevouts]
+        elif kind == "inscription":
+            witnesses = [[rng.randbytes(64), rng.randbytes(rng.randint(501, 4000)), rng.randbytes(33)]
+                         for _ in prevouts]
+        else:
+            witnesses = [[rng.randbytes(71), rng.randbytes(33)] for _ in prevouts]
+        return serialize_tx([(prevout, b'') for prevout in prevouts], outputs, witnesses)
+
+    def write(self, node_dir: str, xor_key: Optional[bytes] = None) -> List[Dict[str, Any]]:
+        """
+        Write the chain as a node data directory: blocks/blk*.dat and bitcoin.conf.
+
+        Args:
+            node_dir: The data directory to create.
+            xor_key: Obfuscate the blk files with this 8 byte key, as Bitcoin Core 28+ does.
+
+        Returns:
+            {height, hash, time, n_txs} of every block, also saved as chain.json.
+        """
+        rng = self.rng
+        blocks_dir = os.path.join(node_dir, "blocks")
+        os.makedirs(blocks_dir, exist_ok=True)
+        write_conf(node_dir)
+        if xor_key is not None:
+            with open(os.path.join(blocks_dir, XOR_KEY_FILE), "wb") as f:
+                f.write(xor_key)
+
+        n_blocks = (HOURS_BEFORE + 24 + HOURS_AFTER) * 3600 // BLOCK_INTERVAL
+        block_time = int(self.date.timestamp()) - HOURS_BEFORE * 3600
+        prev_hash = rng.randbytes(32)
+        chain = []
+        file_num = 0
+        blk_file = bytearray()
+
+        def write_blk_file():
+            data = bytes(blk_file) if xor_key is None else bytes(deobfuscate(blk_file, xor_key, 0))
+            with open(os.path.join(blocks_dir, blk_file_name(file_num)), "wb") as f:
+                f.write(data)
+
+        for height in range(FIRST_HEIGHT, FIRST_HEIGHT + n_blocks):
+            txs = [self._coinbase(height)] + [self._tx() for _ in range(self.txs_per_block - 1)]
+            txids = [txid for _, txid in txs]
+            self.recent_txids = (self.recent_txids + txids[1:])[-RECENT_TXIDS:]
+
+            # block times are only roughly increasing, like on mainnet
+            block_time += int(rng.expovariate(1 / BLOCK_INTERVAL))
+            stamped_time = block_time + (rng.randint(-900, 900) if rng.random() < .05 else 0)
+            header = pack('<I', 0x20000000) + prev_hash + merkle_root(txids)
+            header += pack('<III', stamped_time, 0x17034219, rng.getrandbits(32))
+            block = header + compact_size(len(txs)) + b''.join(raw_tx for raw_tx, _ in txs)
+
+            if blk_file and len(blk_file) + len(block) + 8 > MAX_BLK_FILE_SIZE:
+                write_blk_file()
+                file_num += 1
+                blk_file = bytearray()
+            blk_file += MAINNET_MAGIC + pack('<I', len(block)) + block
+
+            prev_hash = sha256d(header)
+            chain.append({"height": height, "hash": prev_hash[::-1].hex(), "time": stamped_time, "n_txs": len(txs)})
+        write_blk_file()
+
+        with open(os.path.join(node_dir, "chain.json"), "w") as f:
+            json.dump(chain, f)
+        return chain
+
+
+class FakeNode:
+    """
+    A local json-rpc server answering the calls UTXOracle makes about a synthetic chain.
+
+    Args:
+        chain: The blocks from SyntheticChain.write().
+        port: Port to listen on, 0 picks a free one.
+    """
+
+    def __init__(self, chain: List[Dict[str, Any]], port: int = 0):
+        self.chain = chain
+        self.by_hash = {block["hash"]: block for block in chain}
+        self.auth = "Basic " + base64.b64encode(f"{RPC_USER}:{RPC_PASSWORD}".encode()).decode()
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if self.headers.get("Authorization") != node.auth:
+                    self.send_response(401)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if isinstance(request, list):
+                    response = [node.handle(call) for call in request]
+                else:
+                    response = node.handle(request)
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def handle(self, call: Dict[str, Any]) -> Dict[str, Any]:
+        method, params = call["method"], call.get("params", [])
+        try:
+            if method == "getblockcount":
+                result = self.chain[-1]["height"]
+            elif method == "getblockhash":
+                if not 0 <= params[0] - FIRST_HEIGHT < len(self.chain):
+                    raise KeyError(params[0])
+                result = self.chain[params[0] - FIRST_HEIGHT]["hash"]
+            elif method == "getblockheader":
+                block = self.by_hash[params[0]]
+                result = {"hash": block["hash"], "height": block["height"], "time": block["time"],
+                          "nTx": block["n_txs"]}
+            else:
+                return {"id": call["id"], "result": None, "error": {"code": -32601, "message": "Method not found"}}
+        except KeyError:
+            return {"id": call["id"], "result": None, "error": {"code": -8, "message": "Block not found"}}
+        return {"id": call["id"], "result": result, "error": None}
+
+    def client(self) -> NodeRPC:
+        return NodeRPC(port=self.port, user=RPC_USER, password=RPC_PASSWORD)
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'FakeNode':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """The process's peak resident memory so far, None where it can't be read (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+@dataclass
+class StageResult:
+    stage: str
+    seconds: float
+    blocks: int
+    txs: int
+    peak_rss_mb: Optional[float]
+
+    @property
+    def blocks_per_s(self) -> float:
+        return self.blocks / self.seconds if self.seconds else float("inf")
+
+    @property
+    def txs_per_s(self) -> float:
+        return self.txs / self.seconds if self.seconds else float("inf")
+
+
+def time_calls(fn: Callable[[], Any], min_seconds: float = MIN_TIMED_SECONDS) -> Tuple[Any, float]:
+    """
+    Call fn again and again for at least min_seconds, for stages too quick to time once.
+
+    Returns:
+        What fn returned, and the average seconds per call.
+    """
+    n_calls = 0
+    started = time.perf_counter()
+    while True:
+        result = fn()
+        n_calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return result, elapsed / n_calls
+
+
+def price_day(node: NodeRPC, blocks_dir: str, date: datetime, work_dir: str,
+              processes: int = 1) -> Tuple[float, List[StageResult]]:
+    """
+    Price a day, timing each stage.
+
+    The header cache and block index start empty (in work_dir), so Parts 5 and 6
+    are timed cold. Parts 9 to 11 are timed as the average of repeated calls.
+    Peak RSS is the high water mark of the whole process after the stage, so it
+    only ever grows from one stage to the next.
+
+    Returns:
+        The price, and the result of every stage in order.
+    """
+    results = []
+
+    def record(stage: str, started: float, blocks: int, txs: int) -> None:
+        results.append(StageResult(stage, time.perf_counter() - started, blocks, txs, peak_rss_mb()))
+
+    # Part 5, find the day's blocks
+    started = time.perf_counter()
+    index_path = os.path.join(work_dir, "index.db")
+    block_count = node.call("getblockcount")
+
+    def get_block_times(heights):
+        return [(header["time"], header["hash"]) for header in node.get_block_headers(list(heights))]
+
+    header_cache = HeaderCache(index_path)
+    try:
+        header_cache.verify(get_block_times, block_count)
+        header_cache.cover_day(get_block_times, int(date.timestamp()), block_count - 6)
+        day_blocks = header_cache.day_blocks(int(date.timestamp()))
+        if day_blocks is None:
+            raise ValueError(f"the synthetic chain doesn't cover {date:%Y-%m-%d}")
+        block_hashes = [header_cache.block_time(height)[1] for height in range(*day_blocks)]
+        n_headers = len(header_cache)
+    finally:
+        header_cache.close()
+    record("Part 5 find blocks", started, n_headers, 0)
+
+    # Part 6, map the blk files
+    started = time.perf_counter()
+    with BlockIndex(blocks_dir, index_path) as block_index:
+        n_indexed = block_index.update()
+        found = block_index.lookup(block_hashes)
+    if len(found) != len(block_hashes):
+        raise ValueError("some of the day's blocks are missing from the blk files")
+    locations = [(found[block_hash].file, found[block_hash].offset) for block_hash in block_hashes]
+    record("Part 6 index blk files", started, n_indexed, 0)
+
+    # Part 8, parse the blocks and filter the outputs
+    started = time.perf_counter()
+    bins = output_bins()
+    same_day_filter = SameDayFilter()
+    bin_counts = np.zeros(len(bins))
+    raw_outputs = []
+    n_txs = 0
+    for block_outputs in parse_blocks(blocks_dir, locations, processes):
+        n_txs += len(block_outputs.tx_flags)
+        amounts = same_day_filter.accept(block_outputs)
+        bin_counts += bin_amounts(amounts, bins)
+        raw_outputs.extend(amounts)
+    record("Part 8 parse and filter", started, len(locations), n_txs)
+
+    # Part 9, clean the bell curve
+    curve, seconds = time_calls(lambda: clean_curve(bin_counts))
+    results.append(StageResult("Part 9 clean curve", seconds, len(locations), n_txs, peak_rss_mb()))
+
+    # Part 10, slide the stencils for a rough price
+    rough, seconds = time_calls(lambda: rough_price(curve, bins))
+    results.append(StageResult("Part 10 stencil slide", seconds, len(locations), n_txs, peak_rss_mb()))
+
+    # Part 10, the prices of the outputs near round usd amounts
+    def find_price_points():
+        amounts = np.asarray(raw_outputs, dtype=np.float64)
+        exclude = round_sat_mask(amounts, micro_round_amounts(), PCT_MICRO_REMOVE)
+        return usd_price_points(amounts, USDS, rough, PCT_RANGE_WIDE, exclude)[1]
+
+    prices, seconds = time_calls(find_price_points)
+    results.append(StageResult("Part 10 usd price points", seconds, len(locations), n_txs, peak_rss_mb()))
+
+    # Part 11, the central price, and the deviation around it for the chart
+    def find_central_price():
+        sorted_prices = np.sort(prices)
+        price = central_price(sorted_prices, rough)
+        find_central_output(sorted_prices, price - .1 * price, price + .1 * price)
+        return price
+
+    price, seconds = time_calls(find_central_price)
+    results.append(StageResult("Part 11 central price", seconds, len(locations), n_txs, peak_rss_mb()))
+
+    return price, results
+
+
+def prepare_data(data_dir: str, date: datetime, txs_per_block: int, seed: int,
+                 xor: bool) -> List[Dict[str, Any]]:
+    """Write the synthetic chain into data_dir, or reuse it if it was written with the same settings."""
+    settings = {"date": f"{date:%Y-%m-%d}", "txs_per_block": txs_per_block, "seed": seed, "xor": xor}
+    settings_path = os.path.join(data_dir, "settings.json")
+    if os.path.exists(settings_path):
+        with open(settings_path) as f:
+            if json.load(f) == settings:
+                with open(os.path.join(data_dir, "chain.json")) as chain_file:
+                    return json.load(chain_file)
+        shutil.rmtree(data_dir)
+
+    xor_key = random.Random(seed).randbytes(8) if xor else None
+    chain = SyntheticChain(date, txs_per_block, seed=seed).write(data_dir, xor_key)
+    with open(settings_path, "w") as f:
+        json.dump(settings, f)
+    return chain
+
+
+def compare(results: List[StageResult], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return the stages more than tolerance slower than in the baseline."""
+    regressions = []
+    for result in results:
+        before = baseline["stages"].get(result.stage)
+        if before and result.seconds > before["seconds"] * (1 + tolerance):
+            regressions.append(result.stage)
+    return regressions
+
+
+def print_report(results: List[StageResult], baseline: Optional[Dict[str, Any]]) -> None:
+    print(f"{'stage':<26}{'ms':>10}{'blocks/s':>12}{'tx/s':>14}{'peak RSS MB':>13}"
+          + (f"{'vs baseline':>13}" if baseline else ""))
+    for result in results:
+        rss = "-" if result.peak_rss_mb is None else f"{result.peak_rss_mb:.0f}"
+        txs_per_s = f"{result.txs_per_s:,.0f}" if result.txs else "-"
+        line = f"{result.stage:<26}{result.seconds * 1000:>10.3f}{result.blocks_per_s:>12,.0f}{txs_per_s:>14}{rss:>13}"
+        if baseline and result.stage in baseline["stages"]:
+            change = result.seconds / baseline["stages"][result.stage]["seconds"] - 1
+            line += f"{change:>+12.0%} "
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Time every stage of pricing a day on a synthetic chain.")
+    parser.add_argument("-d", "--date", default="2024/01/01", help="UTC day to build the chain around, YYYY/MM/DD")
+    parser.add_argument("-t", "--txs-per-block", type=int, default=2000, help="txs in every synthetic block")
+    parser.add_argument("-s", "--seed", type=int, default=1, help="seed of the synthetic chain")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="number of processes parsing blocks")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument("--xor", action="store_true", help="obfuscate the blk files like Bitcoin Core 28+")
+    parser.add_argument("--data", help="keep the synthetic chain in this directory and reuse it next time")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="the baseline json file")
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction slower than the baseline that counts as a regression")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="don't benchmark, serve the synthetic chain as a node on this port (for UTXOracle.py -p)")
+    args = parser.parse_args(argv)
+
+    date = parse_date(args.date)
+    data_dir = args.data or tempfile.mkdtemp(prefix="utxoracle_bench_")
+    try:
+        started = time.perf_counter()
+        chain = prepare_data(data_dir, date, args.txs_per_block, args.seed, args.xor)
+        print(f"Synthetic chain: {len(chain)} blocks, {sum(block['n_txs'] for block in chain):,} txs "
+              f"in {data_dir} ({time.perf_counter() - started:.1f}s)")
+
+        if args.serve is not None:
+            write_conf(data_dir, args.serve)
+            with FakeNode(chain, args.serve):
+                print(f"Serving on port {args.serve}, run UTXOracle.py -p {data_dir} (ctrl-c to stop)")
+                try:
+                    threading.Event().wait()
+                except KeyboardInterrupt:
+                    return
+
+        best: Dict[str, StageResult] = {}
+        prices = set()
+        with FakeNode(chain) as fake_node:
+            node = fake_node.client()
+            for _ in range(args.repeat):
+                work_dir = tempfile.mkdtemp(prefix="utxoracle_bench_run_")
+                try:
+                    price, results = price_day(node, os.path.join(data_dir, "blocks"), date, work_dir, args.processes)
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                prices.add(price)
+                # the fastest time, and the highest memory, of every stage
+                for result in results:
+                    kept = best.get(result.stage)
+                    if kept is None or result.seconds < kept.seconds:
+                        best[result.stage] = result
+                    if kept is not None and result.peak_rss_mb is not None:
+                        best[result.stage].peak_rss_mb = max(kept.peak_rss_mb, result.peak_rss_mb)
+            node.close()
+        results = list(best.values())
+        price = prices.pop()
+        if prices:
+            raise ValueError("the price changed between runs")
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        if not args.data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    settings = {"date": f"{date:%Y-%m-%d}", "txs_per_block": args.txs_per_block, "seed": args.seed,
+                "xor": args.xor, "processes": args.processes}
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            print("The baseline was run with other settings, not comparing")
+            baseline = None
+
+    print(f"\n{date:%Y-%m-%d} price ${price:,.2f}\n")
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "settings": settings,
+                "price": price,
+                "stages": {result.stage: asdict(result) for result in results},
+            }, f, indent=2)
+        print(f"\nSaved the baseline to {args.baseline}")
+    elif baseline is not None:
+        if price != baseline["price"]:
+            print(f"\nThe price differs from the baseline's ${baseline['price']:,.2f}")
+            sys.exit(1)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nSlower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
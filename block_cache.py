@@ -0,0 +1,130 @@
+import os
+import sqlite3
+from struct import pack, unpack_from
+from typing import Dict, Iterable
+
+from block_reader import BlockOutputs, CandidateTx
+
+# Parsing a block gives the same result every time, yet every run parsed all of
+# the day's blocks again. This cache keeps what Part 8 takes from each block (its
+# txids, per-tx filter flags, and the candidate txs with their input txids and
+# amounts) keyed by block hash, in a compact binary form. Re-running a date, or a
+# block window overlapping the last one, only parses blocks not seen before.
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "UTXOracle_blocks.db")
+
+# bump when parse_block's filters or the blob layout change so old entries are dropped
+CACHE_FORMAT = 1
+
+# about a month of blocks (~100 kB each), the oldest added are dropped past this
+DEFAULT_MAX_BLOCKS = 4500
+
+
+def encode_block_outputs(block: BlockOutputs) -> bytes:
+    """
+    Pack a parsed block into bytes.
+
+    Layout (little endian): tx count (u32), the txids (32 bytes each), the tx flags
+    (1 byte each), candidate count (u32), then per candidate its tx index (u32),
+    input count (u8), amount count (u8), input txids (32 bytes each) and amounts
+    (f64 each).
+    """
+    parts = [pack('<I', len(block.tx_flags))]
+    parts.append(bytes(block.txids))
+    parts.append(bytes(block.tx_flags))
+    parts.append(pack('<I', len(block.candidates)))
+    for candidate in block.candidates:
+        parts.append(pack('<IBB', candidate.tx_index, len(candidate.input_txids), len(candidate.amounts)))
+        parts.extend(candidate.input_txids)
+        parts.append(pack(f'<{len(candidate.amounts)}d', *candidate.amounts))
+    return b''.join(parts)
+
+
+def decode_block_outputs(blob: bytes) -> BlockOutputs:
+    """Unpack bytes from encode_block_outputs() back into a BlockOutputs."""
+    n_txs = unpack_from('<I', blob, 0)[0]
+    pos = 4
+    txids = bytearray(blob[pos:pos + 32 * n_txs])
+    pos += 32 * n_txs
+    tx_flags = bytearray(blob[pos:pos + n_txs])
+    pos += n_txs
+
+    n_candidates = unpack_from('<I', blob, pos)[0]
+    pos += 4
+    candidates = []
+    for _ in range(n_candidates):
+        tx_index, n_inputs, n_amounts = unpack_from('<IBB', blob, pos)
+        pos += 6
+        input_txids = [blob[pos + 32 * i:pos + 32 * i + 32] for i in range(n_inputs)]
+        pos += 32 * n_inputs
+        amounts = list(unpack_from(f'<{n_amounts}d', blob, pos))
+        pos += 8 * n_amounts
+        candidates.append(CandidateTx(tx_index, input_txids, amounts))
+
+    return BlockOutputs(txids=txids, candidates=candidates, tx_flags=tx_flags)
+
+
+class BlockCache:
+    """
+    Persistent block hash -> parsed BlockOutputs cache.
+
+    Args:
+        cache_path: Where the sqlite cache is stored.
+        max_blocks: How many blocks to keep, the oldest added are dropped first.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH, max_blocks: int = DEFAULT_MAX_BLOCKS):
+        self.max_blocks = max_blocks
+        self.db = sqlite3.connect(cache_path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS blocks (
+                hash BLOB PRIMARY KEY,
+                outputs BLOB
+            );
+        """)
+
+        # entries written by another version of the parser can't be trusted
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+        if row is not None and row[0] != str(CACHE_FORMAT):
+            self.db.execute("DELETE FROM blocks")
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('format', ?)", (str(CACHE_FORMAT),))
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> 'BlockCache':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+    def load(self, block_hashes: Iterable[str]) -> Dict[str, BlockOutputs]:
+        """Return the cached blocks among block_hashes (big-endian hex), keyed by hash."""
+        found = {}
+        for block_hash in block_hashes:
+            row = self.db.execute(
+                "SELECT outputs FROM blocks WHERE hash = ?", (bytes.fromhex(block_hash),)
+            ).fetchone()
+            if row is not None:
+                found[block_hash] = decode_block_outputs(row[0])
+        return found
+
+    def store(self, blocks: Dict[str, BlockOutputs]) -> None:
+        """Add parsed blocks (keyed by big-endian hex hash) and drop the oldest past max_blocks."""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO blocks (hash, outputs) VALUES (?, ?)",
+            [(bytes.fromhex(block_hash), encode_block_outputs(block)) for block_hash, block in blocks.items()],
+        )
+        self.db.execute(
+            "DELETE FROM blocks WHERE rowid IN (SELECT rowid FROM blocks ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+            (self.max_blocks,),
+        )
+        self.db.commit()
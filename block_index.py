@@ -0,0 +1,295 @@
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from block_xor import deobfuscate, read_xor_key
+from models import HEADER_LENGTH, MAINNET_MAGIC_BYTES, hash256
+
+# The node stores blocks in blk*.dat files in the order it received them, and it
+# never tells us where a block lives. Finding ~144 blocks by hash used to mean
+# re-reading and hashing every header in a swath of files on every run. Instead
+# we keep a small sqlite index keyed by block hash (and height) that maps each
+# block to its file, byte offset, size and time. It is built once and then
+# extended from the last indexed offset of each file, so later lookups are O(1).
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "UTXOracle_index.db")
+
+# bytes read past the header to reach the BIP-34 height in the coinbase script
+COINBASE_PEEK = 128
+
+
+@dataclass
+class BlockLocation:
+    block_hash: str        # big-endian hex, as shown by the node
+    prev_hash: str         # big-endian hex of the parent block
+    height: Optional[int]  # from the coinbase (BIP-34), None if not decodable
+    file: str              # blk file name, e.g. 'blk04930.dat'
+    offset: int            # byte offset of the magic bytes in the blk file
+    size: int              # block size in bytes (excludes magic + size fields)
+    time: int              # header timestamp (unix seconds)
+
+
+def blk_file_name(file_num: int) -> str:
+    return f"blk{file_num:05}.dat"
+
+
+def list_blk_files(blocks_dir: str) -> List[int]:
+    """Return the numbers of all blk*.dat files in blocks_dir, sorted ascending."""
+    return sorted(
+        int(f[3:8]) for f in os.listdir(blocks_dir)
+        if f.startswith('blk') and f.endswith('.dat')
+    )
+
+
+def coinbase_height(peek: bytes) -> Optional[int]:
+    """
+    Decode the BIP-34 block height from the bytes that follow a block header.
+
+    Args:
+        peek: Bytes starting at the tx count, covering at least the start of the coinbase script.
+
+    Returns:
+        The block height, or None if it cannot be decoded (pre BIP-34 or truncated).
+    """
+    try:
+        pos = 0
+        # skip the tx count (compact size)
+        lead = peek[pos]
+        pos += 1 if lead < 0xfd else {0xfd: 3, 0xfe: 5, 0xff: 9}[lead]
+        # skip version and the segwit marker/flag if present
+        pos += 4
+        if peek[pos] == 0x00:
+            pos += 2
+        # skip n_inputs (always 1 for a coinbase), prev txid and prev vout
+        pos += 1 + 32 + 4
+        # skip script size, then read the height push
+        lead = peek[pos]
+        pos += 1 if lead < 0xfd else 3
+        push_len = peek[pos]
+        if not 1 <= push_len <= 8:
+            return None
+        height_bytes = peek[pos + 1:pos + 1 + push_len]
+        if len(height_bytes) != push_len:
+            return None
+        return int.from_bytes(height_bytes, 'little')
+    except (IndexError, KeyError):
+        return None
+
+
+class BlockIndex:
+    """
+    Persistent on-disk map of block hash / height -> location in the blk files.
+
+    Args:
+        blocks_dir: The node's blocks directory holding the blk*.dat files.
+        index_path: Where the sqlite index is stored.
+    """
+
+    def __init__(self, blocks_dir: str, index_path: str = DEFAULT_INDEX_PATH):
+        self.blocks_dir = blocks_dir
+        self.index_path = index_path
+        self.xor_key = read_xor_key(blocks_dir)
+        self.db = sqlite3.connect(index_path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS blocks (
+                hash BLOB PRIMARY KEY,
+                prev_hash BLOB,
+                height INTEGER,
+                file INTEGER,
+                offset INTEGER,
+                size INTEGER,
+                time INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS blocks_height ON blocks(height);
+            CREATE TABLE IF NOT EXISTS scanned_files (
+                file INTEGER PRIMARY KEY,
+                offset INTEGER
+            );
+        """)
+
+        # an index built for another data dir is useless here, start over
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'blocks_dir'").fetchone()
+        real_blocks_dir = os.path.realpath(blocks_dir)
+        if row is not None and row[0] != real_blocks_dir:
+            self.db.executescript("DELETE FROM blocks; DELETE FROM scanned_files;")
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('blocks_dir', ?)", (real_blocks_dir,)
+        )
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> 'BlockIndex':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+    def update(self, first_file: int = 0, progress: Optional[Callable[[float], None]] = None) -> int:
+        """
+        Index every block written since the last update.
+
+        Each blk file is resumed from the offset where the previous update stopped, so
+        after the first build only the tail of the newest file is read.
+
+        Args:
+            first_file: Ignore blk files numbered below this (useful for a partial cold build).
+            progress: Optional callback receiving the completed fraction (0 to 1).
+
+        Returns:
+            The number of newly indexed blocks.
+        """
+        scanned = dict(self.db.execute("SELECT file, offset FROM scanned_files"))
+        to_scan = []
+        for file_num in list_blk_files(self.blocks_dir):
+            if file_num < first_file:
+                continue
+            file_size = os.path.getsize(os.path.join(self.blocks_dir, blk_file_name(file_num)))
+            if scanned.get(file_num, 0) < file_size:
+                to_scan.append((file_num, scanned.get(file_num, 0)))
+
+        n_new = 0
+        for i, (file_num, start) in enumerate(to_scan):
+            rows, end = self._scan_file(file_num, start)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO blocks (hash, prev_hash, height, file, offset, size, time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO scanned_files (file, offset) VALUES (?, ?)", (file_num, end)
+            )
+            self.db.commit()
+            n_new += len(rows)
+            if progress is not None:
+                progress((i + 1) / len(to_scan))
+
+        return n_new
+
+    def _scan_file(self, file_num: int, start: int) -> tuple[list, int]:
+        """Read the headers of all complete blocks in one blk file from start onward."""
+        rows = []
+        path = os.path.join(self.blocks_dir, blk_file_name(file_num))
+        xor_key = self.xor_key
+        with open(path, "rb") as f:
+
+            def read(pos: int, n: int) -> bytes:
+                f.seek(pos)
+                data = f.read(n)
+                return data if xor_key is None else bytes(deobfuscate(data, xor_key, pos))
+
+            file_size = os.fstat(f.fileno()).st_size
+            pos = start
+            while pos + 8 + HEADER_LENGTH <= file_size:
+                f.seek(pos)
+                stored_magic = f.read(4)
+                # the node pre-allocates blk files with zeros (never obfuscated), so
+                # zeros mean we reached the end of what has been written so far
+                if stored_magic == b'\x00\x00\x00\x00':
+                    break
+                magic = stored_magic if xor_key is None else bytes(deobfuscate(stored_magic, xor_key, pos))
+                if magic != MAINNET_MAGIC_BYTES:
+                    # skip ahead to the next magic bytes
+                    chunk = read(pos + 4, 1 << 20)
+                    found = chunk.find(MAINNET_MAGIC_BYTES)
+                    if found < 0:
+                        pos += 4 + len(chunk) - 3
+                    else:
+                        pos += 4 + found
+                    continue
+
+                size = int.from_bytes(read(pos + 4, 4), "little")
+                if pos + 8 + size > file_size:
+                    break  # block is still being written
+                header_and_peek = read(pos + 8, HEADER_LENGTH + min(COINBASE_PEEK, size - HEADER_LENGTH))
+                header = header_and_peek[:HEADER_LENGTH]
+                peek = header_and_peek[HEADER_LENGTH:]
+
+                rows.append((
+                    hash256(header)[::-1],
+                    header[4:36][::-1],
+                    coinbase_height(peek),
+                    file_num,
+                    pos,
+                    size,
+                    int.from_bytes(header[68:72], "little"),
+                ))
+                pos += 8 + size
+
+        return rows, pos
+
+    @staticmethod
+    def _to_location(row: tuple) -> BlockLocation:
+        block_hash, prev_hash, height, file_num, offset, size, time = row
+        return BlockLocation(
+            block_hash=block_hash.hex(),
+            prev_hash=prev_hash.hex(),
+            height=height,
+            file=blk_file_name(file_num),
+            offset=offset,
+            size=size,
+            time=time,
+        )
+
+    def locate(self, block_hash: str) -> Optional[BlockLocation]:
+        """Return where the block with this (big-endian hex) hash is stored, if indexed."""
+        row = self.db.execute(
+            "SELECT hash, prev_hash, height, file, offset, size, time FROM blocks WHERE hash = ?",
+            (bytes.fromhex(block_hash),),
+        ).fetchone()
+        return None if row is None else self._to_location(row)
+
+    def lookup(self, block_hashes: Iterable[str]) -> Dict[str, BlockLocation]:
+        """Return the locations of all indexed blocks among block_hashes, keyed by hash."""
+        found = {}
+        for block_hash in block_hashes:
+            location = self.locate(block_hash)
+            if location is not None:
+                found[block_hash] = location
+        return found
+
+    def find_blocks(
+        self, block_hashes: Iterable[str], first_file: int, progress: Optional[Callable[[float], None]] = None
+    ) -> Dict[str, BlockLocation]:
+        """
+        Index the blk files from first_file on and look up block_hashes, reaching back
+        one window of files at a time (the window being first_file to the newest file)
+        until every block is found or the first blk file is indexed.
+
+        Args:
+            block_hashes: The (big-endian hex) hashes to find.
+            first_file: The earliest blk file expected to hold one of the blocks.
+            progress: Optional callback receiving the completed fraction of each update.
+
+        Returns:
+            The locations of the blocks found, keyed by hash.
+        """
+        block_hashes = list(block_hashes)
+        blk_files = list_blk_files(self.blocks_dir)
+        first_file = max(first_file, blk_files[0])
+        window = blk_files[-1] - first_file + 1
+
+        self.update(first_file=first_file, progress=progress)
+        locations = self.lookup(block_hashes)
+        while len(locations) != len(block_hashes) and first_file > blk_files[0]:
+            first_file = max(blk_files[0], first_file - window)
+            self.update(first_file=first_file, progress=progress)
+            locations = self.lookup(block_hashes)
+        return locations
+
+    def at_height(self, height: int) -> List[BlockLocation]:
+        """Return every indexed block at this height (stale blocks share heights)."""
+        rows = self.db.execute(
+            "SELECT hash, prev_hash, height, file, offset, size, time FROM blocks WHERE height = ?",
+            (height,),
+        ).fetchall()
+        return [self._to_location(row) for row in rows]
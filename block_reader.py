@@ -0,0 +1,369 @@
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from hashlib import sha256
+from struct import unpack_from
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from block_xor import deobfuscate, read_xor_key
+from compact_size import read_compact_size
+
+# Reading a block with thousands of tiny f.read() calls, and then seeking back to
+# re-read each tx just to hash it, dominates the run time of Part 8. Instead each
+# blk file is memory mapped once and every block is parsed in place by walking
+# byte offsets through a memoryview. Nothing is copied except the few fields the
+# price algorithm actually keeps (txids, input txids and output amounts). If the
+# node obfuscates its blk files, each block is de-obfuscated into a copy first.
+
+TXID_LENGTH = 32
+NULL_TXID = b'\x00' * TXID_LENGTH
+NULL_VOUT = b'\xff\xff\xff\xff'
+OP_RETURN = 0x6a
+
+# why a tx is not a candidate, one bit each in BlockOutputs.tx_flags
+FLAG_COINBASE = 1
+FLAG_OP_RETURN = 2
+FLAG_WITNESS_EXCEEDS = 4   # a witness item or an input's witness over 500 bytes
+FLAG_MANY_INPUTS = 8       # more than 5 inputs
+FLAG_NOT_TWO_OUTPUTS = 16
+
+
+@dataclass
+class CandidateTx:
+    tx_index: int             # position of the tx in its block
+    input_txids: List[bytes]  # prev txids (internal byte order) spent by the tx
+    amounts: List[float]      # output amounts in btc inside 1e-5 < amount < 1e5
+
+
+@dataclass
+class BlockOutputs:
+    """
+    Everything Part 8 needs from one block.
+
+    txids holds the txid of every tx in block order, 32 bytes each back to back,
+    since the same-day filter needs all of them.
+    candidates holds the txs passing every filter that can be decided from the tx
+    alone: at most 5 inputs, exactly 2 outputs, not coinbase, no op_return and no
+    witness item (or input witness) over 500 bytes. tx_flags holds the FLAG_ bits
+    each tx failed, one byte per tx (zero for candidates).
+    """
+    txids: bytearray = field(default_factory=bytearray)
+    candidates: List[CandidateTx] = field(default_factory=list)
+    tx_flags: bytearray = field(default_factory=bytearray)
+
+    def iter_txids(self) -> Iterator[bytes]:
+        """Yield each txid (internal byte order) in block order."""
+        txids = self.txids
+        for pos in range(0, len(txids), TXID_LENGTH):
+            yield bytes(txids[pos:pos + TXID_LENGTH])
+
+
+class BlockReader:
+    """
+    Hand out zero-copy views of raw blocks, memory mapping each blk file once.
+
+    Args:
+        blocks_dir: The node's blocks directory holding the blk*.dat files.
+    """
+
+    def __init__(self, blocks_dir: str):
+        self.blocks_dir = blocks_dir
+        self.xor_key = read_xor_key(blocks_dir)
+        self._maps: Dict[str, mmap.mmap] = {}
+
+    def _map(self, file: str) -> mmap.mmap:
+        if file not in self._maps:
+            with open(os.path.join(self.blocks_dir, file), 'rb') as f:
+                self._maps[file] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[file]
+
+    def block(self, file: str, offset: int) -> memoryview:
+        """
+        Return the raw block (header + txs) stored at offset in a blk file.
+
+        Args:
+            file: The blk file name, e.g. 'blk04930.dat'.
+            offset: Byte offset of the block's magic bytes in that file.
+
+        Returns:
+            A memoryview of the block, valid until close() is called.
+        """
+        mm = self._map(file)
+        if self.xor_key is None:
+            size = unpack_from('<I', mm, offset + 4)[0]
+            return memoryview(mm)[offset + 8:offset + 8 + size]
+
+        size = unpack_from('<I', deobfuscate(mm[offset + 4:offset + 8], self.xor_key, offset + 4))[0]
+        with memoryview(mm) as view:
+            return deobfuscate(view[offset + 8:offset + 8 + size], self.xor_key, offset + 8)
+
+    def close(self) -> None:
+        for mm in self._maps.values():
+            mm.close()
+        self._maps.clear()
+
+    def __enter__(self) -> 'BlockReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def parse_block(buf) -> BlockOutputs:
+    """
+    Parse a raw block in place and collect what Part 8 needs from it.
+
+    Args:
+        buf: The raw block (80 byte header followed by the txs), e.g. from BlockReader.block.
+
+    Returns:
+        A BlockOutputs with every txid and the txs that pass the per-tx filters.
+    """
+    result = BlockOutputs()
+    txids = result.txids
+    candidates = result.candidates
+    tx_flags = result.tx_flags
+
+    # tx count follows the 80 byte header
+    pos = 80
+    n_txs = buf[pos]
+    if n_txs < 0xfd:
+        pos += 1
+    else:
+        n_txs, pos = read_compact_size(buf, pos)
+
+    # Most txs fail a filter, and most of those can be told from a count alone
+    # (inputs, outputs) or from the first input (coinbase). Once a tx has failed,
+    # the rest of it is only walked over by its length fields to find where it
+    # ends: no prev txids are copied and no amounts decoded. The remaining checks
+    # cost a byte or two on that walk, so tx_flags still holds every filter a tx
+    # failed, and its txid is always hashed since the same-day filter needs it.
+    for tx_index in range(n_txs):
+        start_tx = pos
+
+        # segwit txs have a 0x00 marker and 0x01 flag after the version
+        is_segwit = buf[pos + 4] == 0 and buf[pos + 5] == 1
+        pos += 6 if is_segwit else 4
+        start_body = pos
+
+        # inputs
+        input_count = buf[pos]
+        if input_count < 0xfd:
+            pos += 1
+        else:
+            input_count, pos = read_compact_size(buf, pos)
+        flags = FLAG_MANY_INPUTS if input_count > 5 else 0
+        # a coinbase tx has a single input spending the null prevout
+        if buf[pos:pos + 32] == NULL_TXID and buf[pos + 32:pos + 36] == NULL_VOUT:
+            flags |= FLAG_COINBASE
+        input_txids = []
+        for _ in range(input_count):
+            if not flags:
+                input_txids.append(bytes(buf[pos:pos + 32]))
+            pos += 36
+            script_len = buf[pos]
+            if script_len < 0xfd:
+                pos += 1
+            else:
+                script_len, pos = read_compact_size(buf, pos)
+            pos += script_len + 4  # script + sequence
+
+        # outputs
+        output_count = buf[pos]
+        if output_count < 0xfd:
+            pos += 1
+        else:
+            output_count, pos = read_compact_size(buf, pos)
+        if output_count != 2:
+            flags |= FLAG_NOT_TWO_OUTPUTS
+        amounts = []
+        for _ in range(output_count):
+            value_pos = pos
+            pos += 8
+            script_len = buf[pos]
+            if script_len < 0xfd:
+                pos += 1
+            else:
+                script_len, pos = read_compact_size(buf, pos)
+            if script_len and buf[pos] == OP_RETURN:
+                flags |= FLAG_OP_RETURN
+            pos += script_len
+            if not flags:
+                value_btc = unpack_from('<Q', buf, value_pos)[0] / 1e8
+                if 1e-5 < value_btc < 1e5:
+                    amounts.append(value_btc)
+        end_body = pos
+
+        # witness data, one stack per input
+        if is_segwit:
+            for _ in range(input_count):
+                stack_count, pos = read_compact_size(buf, pos)
+                total_witness_len = 0
+                for _ in range(stack_count):
+                    item_len = buf[pos]
+                    if item_len < 0xfd:
+                        pos += 1
+                    else:
+                        item_len, pos = read_compact_size(buf, pos)
+                    pos += item_len
+                    total_witness_len += item_len
+                # an item over 500 bytes makes its input's total over 500 too
+                if total_witness_len > 500:
+                    flags |= FLAG_WITNESS_EXCEEDS
+
+        # locktime
+        pos += 4
+
+        # the txid hashes the tx without the marker, flag and witness data, so
+        # for segwit txs the version, inputs/outputs and locktime ranges are fed
+        # to the hash in turn instead of being copied into a stripped tx first
+        if is_segwit:
+            first_hash = sha256(buf[start_tx:start_tx + 4])
+            first_hash.update(buf[start_body:end_body])
+            first_hash.update(buf[pos - 4:pos])
+        else:
+            first_hash = sha256(buf[start_tx:pos])
+        txids.extend(sha256(first_hash.digest()).digest())
+
+        tx_flags.append(flags)
+        if not flags:
+            candidates.append(CandidateTx(tx_index, input_txids, amounts))
+
+    return result
+
+
+# Each block parses independently of every other block, so blocks can be fanned
+# out to a pool of processes. Results come back in the order the blocks were
+# given, and everything order dependent (the same-day filter and the bell curve)
+# is left to the caller, so the price is identical to a serial run.
+
+_worker_reader: Optional[BlockReader] = None
+
+
+def _init_worker(blocks_dir: str) -> None:
+    global _worker_reader
+    _worker_reader = BlockReader(blocks_dir)
+
+
+def _parse_block_at(location: Tuple[str, int]) -> BlockOutputs:
+    block = _worker_reader.block(*location)
+    try:
+        return parse_block(block)
+    finally:
+        block.release()
+
+
+def parse_blocks(blocks_dir: str, locations: List[Tuple[str, int]], processes: int = 1) -> Iterator[BlockOutputs]:
+    """
+    Parse many blocks, optionally across several processes, yielding results in order.
+
+    Args:
+        blocks_dir: The node's blocks directory holding the blk*.dat files.
+        locations: (blk file name, offset) of each block, in the order results are wanted.
+        processes: Number of worker processes. 1 parses in this process.
+
+    Yields:
+        A BlockOutputs per location, in the same order as locations.
+    """
+    # workers are forked so the calling script is not re-run in each of them;
+    # where fork isn't available the blocks are parsed serially instead
+    if processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(processes, mp_context=context,
+                                 initializer=_init_worker, initargs=(blocks_dir,)) as pool:
+            yield from pool.map(_parse_block_at, locations, chunksize=4)
+    else:
+        with BlockReader(blocks_dir) as reader:
+            for file, offset in locations:
+                block = reader.block(file, offset)
+                try:
+                    yield parse_block(block)
+                finally:
+                    block.release()
+
+
+class SameDayFilter:
+    """
+    Txids seen so far on the target day, used to drop txs that spend an output
+    created earlier on the same day. Blocks must be added in block height order.
+
+    Rather than a set of bytes objects, the txids are kept in a few numpy runs,
+    each sorted by the first 8 bytes of the txid. A lookup binary searches those
+    64 bit prefixes in every run and compares the full txid only where a prefix
+    matches, so the answer is exact while each txid costs 40 bytes. A new block
+    adds a run, and runs are merged whenever the newer one has caught up with the
+    one before it, which keeps the number of runs logarithmic in the day's txs.
+    """
+
+    def __init__(self):
+        # (prefixes, txids as rows of 4 words), both sorted by prefix
+        self._runs: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    @staticmethod
+    def _sorted_run(txids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        txids = txids[np.argsort(txids[:, 0], kind='stable')]
+        return np.ascontiguousarray(txids[:, 0]), txids
+
+    def add(self, txids) -> None:
+        """Add txids given back to back, 32 bytes each (like BlockOutputs.txids)."""
+        if not len(txids):
+            return
+        runs = self._runs
+        runs.append(self._sorted_run(np.frombuffer(txids, dtype='<u8').reshape(-1, 4)))
+        while len(runs) > 1 and len(runs[-2][0]) <= len(runs[-1][0]):
+            newer, older = runs.pop()[1], runs.pop()[1]
+            runs.append(self._sorted_run(np.concatenate([older, newer])))
+
+    def contains(self, txids) -> np.ndarray:
+        """
+        Look up txids given back to back, 32 bytes each.
+
+        Returns:
+            A bool per txid, True if it was added earlier.
+        """
+        keys = np.frombuffer(txids, dtype='<u8').reshape(-1, 4)
+        found = np.zeros(len(keys), dtype=bool)
+        for prefixes, run_txids in self._runs:
+            lo = np.searchsorted(prefixes, keys[:, 0], side='left')
+            hi = np.searchsorted(prefixes, keys[:, 0], side='right')
+            single = np.flatnonzero(hi - lo == 1)
+            found[single] |= (run_txids[lo[single]] == keys[single]).all(axis=1)
+            # several txids sharing a prefix, check each of them
+            for i in np.flatnonzero(hi - lo > 1):
+                found[i] |= (run_txids[lo[i]:hi[i]] == keys[i]).all(axis=1).any()
+        return found
+
+    def accept(self, block: BlockOutputs) -> List[float]:
+        """
+        Add a block's txids and return the amounts of its txs that pass every filter.
+
+        A tx can only spend txs before it, so checking the inputs against every
+        txid of the block at once gives the same answer as going tx by tx.
+
+        Args:
+            block: The parsed block, following the previously accepted block.
+
+        Returns:
+            The output amounts (btc) of the accepted txs in block order.
+        """
+        self.add(block.txids)
+        candidates = block.candidates
+        if not candidates:
+            return []
+
+        # a candidate spends from today if any of its inputs is found
+        found = self.contains(b''.join(txid for candidate in candidates for txid in candidate.input_txids))
+        n_inputs = np.array([len(candidate.input_txids) for candidate in candidates])
+        ends = np.cumsum(n_inputs)
+        found_before = np.concatenate(([0], np.cumsum(found)))
+        is_same_day_tx = found_before[ends] > found_before[ends - n_inputs]
+
+        accepted = []
+        for candidate, same_day in zip(candidates, is_same_day_tx):
+            if not same_day:
+                accepted.extend(candidate.amounts)
+        return accepted
@@ -0,0 +1,60 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+# Since Bitcoin Core 28 the node obfuscates the blk files it writes: every byte is
+# XORed with an 8 byte key stored in blocks/xor.dat, the key byte being picked by
+# the byte's position in the file (file position mod 8). Nodes upgraded from older
+# versions keep an all zero key, which leaves the files as they are. Everything
+# reading blk files goes through deobfuscate(), which undoes the XOR for any range
+# of a file at once by XORing 8 bytes at a time with numpy instead of looping over
+# the bytes in Python.
+
+XOR_KEY_FILE = 'xor.dat'
+XOR_KEY_LENGTH = 8
+
+
+def read_xor_key(blocks_dir: str) -> Optional[bytes]:
+    """
+    Read the key the node obfuscates its blk files with.
+
+    Args:
+        blocks_dir: The node's blocks directory.
+
+    Returns:
+        The 8 byte key, or None if the blk files are not obfuscated (no xor.dat, or an all zero key).
+    """
+    path = os.path.join(blocks_dir, XOR_KEY_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        xor_key = f.read()
+    if len(xor_key) != XOR_KEY_LENGTH:
+        raise ValueError(f"{path} holds {len(xor_key)} bytes, expected a {XOR_KEY_LENGTH} byte key")
+    if xor_key == bytes(XOR_KEY_LENGTH):
+        return None
+    return xor_key
+
+
+def deobfuscate(data, xor_key: bytes, file_pos: int) -> memoryview:
+    """
+    Undo the node's XOR obfuscation of a range of a blk file.
+
+    Args:
+        data: The bytes as stored (bytes, or a memoryview of an mmap).
+        xor_key: The key from read_xor_key().
+        file_pos: Position in the blk file of the first byte of data.
+
+    Returns:
+        A memoryview of a de-obfuscated copy of data.
+    """
+    # rotate the key so its first byte lines up with data[0], then XOR whole words
+    shift = file_pos % XOR_KEY_LENGTH
+    key_word = np.frombuffer(xor_key[shift:] + xor_key[:shift], dtype=np.uint64)[0]
+    n = len(data)
+    buf = bytearray(n + (-n % XOR_KEY_LENGTH))
+    buf[:n] = data
+    words = np.frombuffer(buf, dtype=np.uint64)
+    words ^= key_word
+    return memoryview(buf)[:n]
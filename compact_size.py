@@ -0,0 +1,20 @@
+from struct import unpack_from
+
+# Every count and length in a serialized block (txs, inputs, outputs, script and
+# witness sizes) is a compact size: one byte below 0xfd, otherwise a marker byte
+# followed by a 2, 4 or 8 byte little-endian integer. It lives on its own so the
+# block parsers in models.py and block_reader.py can share it without one
+# importing the other.
+
+
+def read_compact_size(buf, pos: int) -> tuple[int, int]:
+    """Return the compact size integer at pos and the position immediately after."""
+    lead = buf[pos]
+    if lead < 0xfd:
+        return lead, pos + 1
+    elif lead == 0xfd:
+        return unpack_from('<H', buf, pos + 1)[0], pos + 3
+    elif lead == 0xfe:
+        return unpack_from('<I', buf, pos + 1)[0], pos + 5
+    else:
+        return unpack_from('<Q', buf, pos + 1)[0], pos + 9
@@ -1,128 +1,274 @@
 import os
-import polars as pl
-from typing import List, Dict
+from collections import OrderedDict
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 import logging
-from models import RawBlock
+from block_xor import read_xor_key
+from models import CompactBlock
 
+logger = logging.getLogger(__name__)
 
-def process_block_file(file_path: str):
+# Each table (blocks, txs, inputs, outputs) is a directory of parquet part-files,
+# hive partitioned by block height: txs/height_bucket=820/ holds the txs of blocks
+# 820,000 to 820,999. A BlockProcessor keeps one ParquetWriter open per table and
+# partition and appends every full chunk to it as a new row group, so a chunk costs
+# the same to write however much history is already there. Nothing written earlier
+# is ever read back or rewritten; each run adds its own part-files.
+PARTITION_BLOCKS = 1000
+
+# Blk files hold blocks only roughly in height order, so the last few partitions
+# stay open; once the ingest has moved past one, its part-files are finished. A
+# straggler block for a finished partition just starts another part-file there.
+MAX_OPEN_PARTITIONS = 2
+
+# Columns are typed as tightly as the data allows: hashes are raw 32 byte values
+# (in the byte order the node shows them), counts and sizes are uint32 and amounts
+# are uint64 sats. A tx is keyed by (block_id, tx_index), its block's hash and its
+# position in the block, so inputs and outputs join to their tx without repeating
+# its txid on every row. The height alone is not a key: blk files also hold stale
+# blocks, which share their height with a best chain block. The blocks table keeps
+# each block's parent so readers can tell which blocks are on the best chain.
+TXID = pa.binary(32)
+SCHEMAS = {
+    "blocks": pa.schema([
+        ("block_id", TXID),
+        ("prev_block_id", TXID),
+        ("block", pa.uint32()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("n_txs", pa.uint32()),
+    ]),
+    "txs": pa.schema([
+        ("block_id", TXID),
+        ("block", pa.uint32()),
+        ("tx_index", pa.uint32()),
+        ("txid", TXID),
+        ("n_inputs", pa.uint32()),
+        ("n_outputs", pa.uint32()),
+        ("locktime", pa.uint32()),
+        ("is_coinbase", pa.bool_()),
+        ("witness_size", pa.uint32()),
+    ]),
+    "inputs": pa.schema([
+        ("block_id", TXID),
+        ("block", pa.uint32()),
+        ("tx_index", pa.uint32()),
+        ("index", pa.uint32()),
+        ("prev_txid", TXID),
+        ("prev_vout", pa.uint32()),
+        ("script_size", pa.uint32()),
+        ("witness_size", pa.uint32()),
+    ]),
+    "outputs": pa.schema([
+        ("block_id", TXID),
+        ("block", pa.uint32()),
+        ("tx_index", pa.uint32()),
+        ("index", pa.uint32()),
+        ("amount", pa.uint64()),
+        ("script_size", pa.uint32()),
+        ("is_op_return", pa.bool_()),
+    ]),
+}
+
+
+class ColumnBuilder:
+    """
+    The rows of one table waiting to be written, kept as typed NumPy column chunks
+    (a chunk per block) rather than a dict per row.
+
+    Args:
+        schema: The table's Arrow schema, giving the columns and their types.
+    """
+
+    def __init__(self, schema: pa.Schema):
+        self.schema = schema
+        self.chunks: Dict[str, List[np.ndarray]] = {name: [] for name in schema.names}
+        self.n_rows = 0
+
+    def append(self, **columns: np.ndarray):
+        """Add the same number of rows to every column (hash columns as (n, 32) uint8 arrays)."""
+        for name, values in columns.items():
+            self.chunks[name].append(values)
+        self.n_rows += len(next(iter(columns.values())))
+
+    def to_table(self) -> pa.Table:
+        """Hand the rows over as an Arrow table, wrapping the column buffers without converting values."""
+        arrays = []
+        for column in self.schema:
+            values = np.concatenate(self.chunks[column.name])
+            if pa.types.is_fixed_size_binary(column.type):
+                buffer = pa.py_buffer(np.ascontiguousarray(values))
+                arrays.append(pa.FixedSizeBinaryArray.from_buffers(column.type, len(values), [None, buffer]))
+            else:
+                arrays.append(pa.array(values, type=column.type))
+            self.chunks[column.name].clear()
+        self.n_rows = 0
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+
+def gather_bytes(data: np.ndarray, offsets: np.ndarray, width: int) -> np.ndarray:
+    """Copy the width bytes found at each offset of data into an (n, width) array."""
+    return data[offsets[:, None].astype(np.int64) + np.arange(width)]
+
+
+def process_block_file(file_path: str, processor: Optional['BlockProcessor'] = None):
     # Read the block file        
     b = 0  # index of block to read
     pos = 0  # start position of block in file to read raw block data
     logger.info(f"Reading binary block file {file_path}...")
     logger.info("-" * 80)
 
-   # Initialize the processor
-    processor = BlockProcessor(chunk_size=1000, output_dir="dude_data")
+   # Initialize the processor, unless the caller shares one across files
+    own_processor = processor is None
+    if own_processor:
+        processor = BlockProcessor(chunk_size=1000, output_dir="dude_data")
+
+    # newer nodes obfuscate the blk files with the key in the blocks dir's xor.dat
+    xor_key = read_xor_key(os.path.dirname(os.path.abspath(file_path)))
     
     with open(f'{file_path}', 'rb') as f:
-        file_len = len(f.read())
+        file_len = os.fstat(f.fileno()).st_size
         logger.info(f"len {file_path} = {file_len:,} bytes")
         while pos < file_len:
             b += 1
             logger.info(f"  Reading block #{b:3} from byte {pos:12,}...")
-            raw_block, new_pos = RawBlock.parse(f, pos)
-            processor.process_raw_block(raw_block)
+            block, new_pos = CompactBlock.parse(f, pos, xor_key)
+            processor.process_block(block)
             pos = new_pos
 
             # if b >= 2:
             #     break
-    processor.flush() 
+    if own_processor:
+        processor.flush()
 
 class BlockProcessor:
     def __init__(self, chunk_size: int, output_dir: str):
         self.chunk_size = chunk_size
         self.output_dir = output_dir
-        self.block_buffer: List[Dict] = []
-        self.tx_buffer: List[Dict] = []
-        self.input_buffer: List[Dict] = []
-        self.output_buffer: List[Dict] = []
+        # rows waiting to be written and the open part-file writers, by (table, partition)
+        self.builders: Dict[Tuple[str, int], ColumnBuilder] = {}
+        self.writers: Dict[Tuple[str, int], Tuple[pq.ParquetWriter, str]] = {}
+        # partitions with rows or part-files open, least recently used first
+        self.open_buckets: OrderedDict[int, None] = OrderedDict()
         os.makedirs(output_dir, exist_ok=True)
-        self.blocks_file = os.path.join(output_dir, "blocks.parquet")
-        self.txs_file = os.path.join(output_dir, "txs.parquet")
-        self.inputs_file = os.path.join(output_dir, "inputs.parquet")
-        self.outputs_file = os.path.join(output_dir, "outputs.parquet")
 
-    def process_raw_block(self, block: RawBlock):
+    def _part_path(self, table: str, bucket: int) -> str:
+        # a new name for every part-file, so no run (or flush) overwrites another's
+        part_name = f"part-{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}-{os.getpid()}.parquet"
+        return os.path.join(self.output_dir, table, f"height_bucket={bucket}", part_name)
+
+    def _builder(self, table: str, bucket: int) -> ColumnBuilder:
+        if (table, bucket) not in self.builders:
+            self.builders[(table, bucket)] = ColumnBuilder(SCHEMAS[table])
+        return self.builders[(table, bucket)]
+
+    def process_block(self, block: CompactBlock):
         # Extract block-level data
-        block_hash = block.block_header.block_hash.hex()
+        block_header = block.block_header
         block_height = block.block_height
-        timestamp = block.block_header.timestamp
-
-        if block.is_mainnet:# Add block to block_buffer
-            self.block_buffer.append({
-                "block_id": block_hash,
-                "block": block_height,
-                "timestamp": timestamp,
-                "n_txs": block.n_txs,
-            })
-
-            # Process transactions
-            for tx in block.txs:
-                txid = tx.txid
-                self.tx_buffer.append({
-                    "block": block_height,
-                    "txid": txid,
-                    "n_inputs": tx.n_inputs,
-                    "n_outputs": tx.n_outputs,
-                    "locktime": tx.locktime.hex(),
-                    "is_coinbase": tx.is_coinbase,
-                    "witness_size": tx.witness_size
-                })
-
-                for i, input in enumerate(tx.inputs):
-                    self.input_buffer.append({
-                        "index": i,
-                        "txid": txid,
-                        "prev_txid": input.utxo_txid.hex(),
-                        "prev_vout": input.utxo_vout,
-                        "script_size": input.script_size,
-                    })
-
-                for i, output in enumerate(tx.outputs):
-                    self.output_buffer.append({
-                        "index": i,
-                        "txid": txid,
-                        "amount": output.amount,
-                        "script_size": output.script_size,
-                        "is_op_return": output.script[0] == 0x6a
-                    })
-
-        # Write buffers to Parquet if chunk_size is reached
-        for buffer, file_path in [
-            (self.block_buffer, self.blocks_file),
-            (self.tx_buffer, self.txs_file),
-            (self.input_buffer, self.inputs_file),
-            (self.output_buffer, self.outputs_file)
-        ]:
-            if len(buffer) >= self.chunk_size:
-                df = pl.DataFrame(buffer)
-                if os.path.isfile(file_path):
-                    existing_df = pl.read_parquet(file_path)
-                    df = pl.concat([existing_df, df])
-                df.write_parquet(file_path)
-                buffer.clear()
 
-    def flush(self):
-        # Write any remaining data
-        for buffer, file_path, name in [
-            (self.block_buffer, self.blocks_file, "blocks"),
-            (self.tx_buffer, self.txs_file, "txs"),
-            (self.input_buffer, self.inputs_file, "inputs"),
-            (self.output_buffer, self.outputs_file, "outputs")
-        ]:
-            if buffer:
-                logger.info(f"Flushing {len(buffer)} records to {file_path}")
-                df = pl.DataFrame(buffer)
+        if block.is_mainnet and block_height is None:
+            # every block since BIP-34 starts its coinbase script with its height
+            logger.warning(f"Skipping block {block_header.block_hash.hex()}: its coinbase has no height")
+        elif block.is_mainnet:# Add block to the blocks table
+            bucket = block_height // PARTITION_BLOCKS
+            self._use_bucket(bucket)
+            timestamp_us = int(block_header.timestamp.timestamp()) * 1_000_000
+            block_id = np.frombuffer(block_header.block_hash, dtype=np.uint8).reshape(1, 32)
+            self._builder("blocks", bucket).append(
+                block_id=block_id,
+                prev_block_id=np.frombuffer(block_header.prev_block_hash[::-1], dtype=np.uint8).reshape(1, 32),
+                block=np.array([block_height], dtype=np.uint32),
+                timestamp=np.array([timestamp_us], dtype=np.int64),
+                n_txs=np.array([block.n_txs], dtype=np.uint32),
+            )
+
+            # Every column comes straight from the block's arrays, only the txids
+            # need hashing; hashes are stored in the node's (reversed) byte order
+            data = np.frombuffer(block.data, dtype=np.uint8)
+            n_txs = block.n_txs
+            n_inputs = block.tx_n_inputs
+            n_outputs = block.tx_n_outputs
+            tx_index = np.arange(n_txs, dtype=np.uint32)
+            self._builder("txs", bucket).append(
+                block_id=np.repeat(block_id, n_txs, axis=0),
+                block=np.full(n_txs, block_height, dtype=np.uint32),
+                tx_index=tx_index,
+                txid=block.txids()[:, ::-1],
+                n_inputs=n_inputs,
+                n_outputs=n_outputs,
+                locktime=gather_bytes(data, block.tx_offsets[1:] - 4, 4).view('<u4').ravel(),
+                is_coinbase=block.tx_is_coinbase,
+                witness_size=block.tx_witness_sizes,
+            )
+
+            n_block_inputs = len(block.input_offsets)
+            self._builder("inputs", bucket).append(
+                block_id=np.repeat(block_id, n_block_inputs, axis=0),
+                block=np.full(n_block_inputs, block_height, dtype=np.uint32),
+                tx_index=np.repeat(tx_index, n_inputs),
+                index=np.arange(n_block_inputs, dtype=np.uint32) - np.repeat(block.tx_first_input[:-1], n_inputs),
+                prev_txid=gather_bytes(data, block.input_offsets, 32)[:, ::-1],
+                prev_vout=block.input_vouts,
+                script_size=block.input_script_sizes,
+                witness_size=block.input_witness_sizes,
+            )
+
+            n_block_outputs = len(block.output_amounts)
+            self._builder("outputs", bucket).append(
+                block_id=np.repeat(block_id, n_block_outputs, axis=0),
+                block=np.full(n_block_outputs, block_height, dtype=np.uint32),
+                tx_index=np.repeat(tx_index, n_outputs),
+                index=np.arange(n_block_outputs, dtype=np.uint32) - np.repeat(block.tx_first_output[:-1], n_outputs),
+                amount=block.output_amounts,
+                script_size=block.output_script_sizes,
+                is_op_return=block.output_is_op_return,
+            )
+
+        # Append full buffers to their part-files
+        for key, builder in self.builders.items():
+            if builder.n_rows >= self.chunk_size:
+                self._write(key, builder)
+
+    def _use_bucket(self, bucket: int):
+        self.open_buckets[bucket] = None
+        self.open_buckets.move_to_end(bucket)
+        while len(self.open_buckets) > MAX_OPEN_PARTITIONS:
+            self._close_bucket(next(iter(self.open_buckets)))
+
+    def _close_bucket(self, bucket: int):
+        # Write the partition's remaining rows and finish its part-files
+        del self.open_buckets[bucket]
+        for table in SCHEMAS:
+            builder = self.builders.pop((table, bucket), None)
+            if builder is not None and builder.n_rows:
+                logger.info(f"Flushing {builder.n_rows} records to {table} (height_bucket={bucket})")
                 try:
-                    if os.path.isfile(file_path):
-                        existing_df = pl.read_parquet(file_path)
-                        df = pl.concat([existing_df, df])
-                    df.write_parquet(file_path)
-                    buffer.clear()
-                    logger.info(f"Successfully flushed {name} to {file_path}")
+                    self._write((table, bucket), builder)
                 except Exception as e:
-                    logger.error(f"Error flushing {name} to {file_path}: {e}")
+                    logger.error(f"Error flushing {table} (height_bucket={bucket}): {e}")
+            if (table, bucket) in self.writers:
+                writer, path = self.writers.pop((table, bucket))
+                writer.close()
+                os.replace(path + ".tmp", path)
+                logger.info(f"Successfully flushed {table} to {path}")
+
+    def _write(self, key: Tuple[str, int], builder: ColumnBuilder):
+        table, bucket = key
+        arrow_table = builder.to_table()
+        if key not in self.writers:
+            # written under a temporary name until closed, so readers never see a part-file without its footer
+            path = self._part_path(table, bucket)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.writers[key] = (pq.ParquetWriter(path + ".tmp", arrow_table.schema), path)
+        self.writers[key][0].write_table(arrow_table)
+
+    def flush(self):
+        # Write any remaining data and finish the part-files
+        for bucket in list(self.open_buckets):
+            self._close_bucket(bucket)
 
 if __name__ == '__main__':
     # Set up logging
@@ -131,6 +277,8 @@ if __name__ == '__main__':
     
     BLOCKS_DIR = 'blocks'
     block_files_to_read = ['blk04930.dat', 'blk04931.dat']
+    processor = BlockProcessor(chunk_size=1000, output_dir="dude_data")
     for file in block_files_to_read:
         block_file_path = os.path.join(BLOCKS_DIR, file)
-        process_block_file(block_file_path)
\ No newline at end of file
+        process_block_file(block_file_path, processor)
+    processor.flush()
\ No newline at end of file
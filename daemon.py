@@ -0,0 +1,244 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+
+from backfill import DayAccumulator, default_data_dir, parse_date, read_conf
+from block_reader import BlockOutputs
+from header_cache import HeaderCache
+from node_rpc import NodeRPC, RPCError, conf_blocks_dir, conf_setting
+from price_finder import output_bins
+from rolling import BlockLoader
+
+# UTXOracle.py prices one day and exits. The daemon stays running instead: it is
+# told about every new block (by bitcoind over zmq, or by polling the block count),
+# parses just that block, and as soon as a day is buried under the 6 block
+# consensus depth it prices the day and publishes it. Pricing a day is then only the
+# filter and price finding steps, since its blocks were parsed as they arrived.
+
+logger = logging.getLogger(__name__)
+
+CONSENSUS_DEPTH = 6
+
+
+class PollNotifier:
+    """
+    Notify about new blocks by asking the node for its block count.
+
+    Args:
+        node: The node to ask.
+        interval: Seconds between checks.
+    """
+
+    def __init__(self, node: NodeRPC, interval: float = 10):
+        self.node = node
+        self.interval = interval
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        last_count = None
+        while True:
+            try:
+                block_count = self.node.call("getblockcount")
+            except (RPCError, OSError) as e:
+                logger.warning(f"Couldn't reach the node: {e}")
+                block_count = last_count
+            if block_count != last_count:
+                last_count = block_count
+                yield None
+            time.sleep(self.interval)
+
+
+class ZMQNotifier:
+    """
+    Notify about new blocks from bitcoind's zmqpubhashblock publisher.
+
+    zmq messages can be dropped, so after timeout seconds without one a
+    notification is given anyway and the daemon checks the node itself.
+
+    Args:
+        endpoint: The zmqpubhashblock address, e.g. 'tcp://127.0.0.1:28332'.
+        timeout: Seconds to wait for a message before notifying anyway.
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 60):
+        try:
+            import zmq
+        except ImportError:
+            raise ImportError("pyzmq is needed to subscribe to the node's zmq blocks (pip install pyzmq)")
+        self.zmq = zmq
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        context = self.zmq.Context.instance()
+        socket = context.socket(self.zmq.SUB)
+        socket.setsockopt(self.zmq.RCVHWM, 0)
+        socket.setsockopt(self.zmq.SUBSCRIBE, b"hashblock")
+        socket.connect(self.endpoint)
+        try:
+            while True:
+                if socket.poll(int(self.timeout * 1000)):
+                    # multipart message: topic, 32 byte block hash, 4 byte sequence number
+                    _, body, *_ = socket.recv_multipart()
+                    yield body.hex()
+                else:
+                    yield None
+        finally:
+            socket.close()
+
+
+def print_price(date: datetime, price: float, first_block: int, last_block: int) -> None:
+    """Publish a day's price as a line of json on stdout."""
+    print(json.dumps({
+        "date": f"{date:%Y-%m-%d}",
+        "price": price,
+        "first_block": first_block,
+        "last_block": last_block,
+    }), flush=True)
+
+
+class PriceDaemon:
+    """
+    Parse blocks as they arrive and publish each day's price once it is final.
+
+    Args:
+        node: The node to ask about blocks.
+        blocks_dir: The node's blocks directory.
+        publish: Called with (date, price, first block, last block) for each final day.
+        next_day: First UTC day to publish, by default the latest day already final.
+        processes: Number of processes parsing blocks.
+    """
+
+    def __init__(
+        self,
+        node: NodeRPC,
+        blocks_dir: str,
+        publish: Callable[[datetime, float, int, int], None] = print_price,
+        next_day: Optional[datetime] = None,
+        processes: int = 1,
+    ):
+        self.node = node
+        self.publish = publish
+        self.next_day = next_day
+        self.load_blocks = BlockLoader(blocks_dir, processes)
+        self.bins = output_bins()
+        self.last_height: Optional[int] = None
+        self.recent: Dict[str, BlockOutputs] = {}  # blocks parsed as they arrived, by hash
+
+    def get_block_times(self, heights):
+        return [(header["time"], header["hash"]) for header in self.node.get_block_headers(list(heights))]
+
+    def _blocks(self, block_hashes: List[str]) -> List[BlockOutputs]:
+        missing = [block_hash for block_hash in block_hashes if block_hash not in self.recent]
+        self.recent.update(zip(missing, self.load_blocks(missing)))
+        return [self.recent[block_hash] for block_hash in block_hashes]
+
+    def on_block(self) -> None:
+        """Parse the blocks added since the last call and publish the days that became final."""
+        block_count = self.node.call("getblockcount")
+
+        # parse only the new blocks (on the first call there is nothing to catch up on)
+        if self.last_height is not None and block_count > self.last_height:
+            heights = list(range(self.last_height + 1, block_count + 1))
+            block_hashes = self.node.batch(("getblockhash", [height]) for height in heights)
+            self._blocks(block_hashes)
+            logger.info(f"Parsed blocks {heights[0]}-{heights[-1]}")
+        self.last_height = block_count
+
+        # a day is final once the consensus block is on a later day
+        consensus_time = self.get_block_times([block_count - CONSENSUS_DEPTH])[0][0]
+        latest_utc_midnight = datetime.fromtimestamp(consensus_time, tz=timezone.utc).replace(
+            hour=0, minute=0, second=0
+        )
+        if self.next_day is None:
+            self.next_day = latest_utc_midnight - timedelta(days=1)
+
+        # a day that can't be priced yet is tried again on the next block
+        while self.next_day < latest_utc_midnight:
+            if not self._publish_day(self.next_day, block_count - CONSENSUS_DEPTH):
+                break
+            self.next_day += timedelta(days=1)
+
+    def _publish_day(self, date: datetime, consensus_height: int) -> bool:
+        """Price and publish a day, returning whether it was published."""
+        header_cache = HeaderCache()
+        try:
+            header_cache.verify(self.get_block_times, consensus_height + CONSENSUS_DEPTH)
+            header_cache.cover_day(self.get_block_times, int(date.timestamp()), consensus_height)
+            day_blocks = header_cache.day_blocks(int(date.timestamp()))
+            if day_blocks is None:
+                logger.warning(f"Couldn't find the blocks of {date:%Y-%m-%d}")
+                return False
+            heights = list(range(*day_blocks))
+            block_hashes = [header_cache.block_time(height)[1] for height in heights]
+        finally:
+            header_cache.close()
+
+        day = DayAccumulator(date, heights)
+        day.parsed.update(zip(heights, self._blocks(block_hashes)))
+        try:
+            price = day.price(self.bins)
+        except ValueError as e:
+            logger.warning(f"Couldn't price {date:%Y-%m-%d}: {e}")
+            return False
+        self.publish(date, price, heights[0], heights[-1])
+
+        # blocks of earlier days won't be needed again
+        keep = set(block_hashes[-CONSENSUS_DEPTH:])
+        for block_hash in block_hashes:
+            if block_hash not in keep:
+                self.recent.pop(block_hash, None)
+        return True
+
+    def _check_node(self) -> None:
+        try:
+            self.on_block()
+        except (RPCError, OSError) as e:
+            logger.warning(f"Couldn't reach the node: {e}")
+        except ValueError as e:
+            logger.warning(f"Couldn't update: {e}")
+
+    def run(self, notifier) -> None:
+        """Check the node now and on every notification, forever."""
+        self._check_node()
+        for _ in notifier:
+            self._check_node()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Publish each day's price as soon as it is final.")
+    parser.add_argument("-p", "--data-dir", default=default_data_dir(), help="the node's data directory")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="number of processes parsing blocks")
+    parser.add_argument("-z", "--zmq", help="the node's zmqpubhashblock address, e.g. tcp://127.0.0.1:28332")
+    parser.add_argument("-i", "--interval", type=float, default=10, help="seconds between polls without zmq")
+    parser.add_argument("-s", "--start", help="first UTC date to publish, YYYY/MM/DD (default: the latest final day)")
+    args = parser.parse_args(argv)
+
+    conf_settings = read_conf(args.data_dir)
+    blocks_dir = conf_blocks_dir(conf_settings, args.data_dir)
+    node = NodeRPC.from_conf(conf_settings, args.data_dir)
+    zmq_endpoint = args.zmq or conf_setting(conf_settings, "zmqpubhashblock")
+
+    daemon = PriceDaemon(
+        node, blocks_dir, next_day=parse_date(args.start) if args.start else None, processes=args.processes
+    )
+    try:
+        if zmq_endpoint:
+            # the node may bind to all interfaces, we connect to it locally
+            notifier = ZMQNotifier(zmq_endpoint.replace("0.0.0.0", "127.0.0.1"))
+        else:
+            notifier = PollNotifier(node, args.interval)
+        daemon.run(notifier)
+    except KeyboardInterrupt:
+        pass
+    except (ImportError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    main()
@@ -0,0 +1,297 @@
+import sqlite3
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from block_index import DEFAULT_INDEX_PATH, BlockIndex
+
+# Finding the blocks of a day used to be a guess-and-check over block times where
+# every probe was an rpc call. Block times along the best chain never change once
+# buried, so we keep them (and the block hashes) in a local cache next to the
+# block index. Once the cache covers a day, its blocks are found with a bisect and
+# a short walk over the cached times, without asking the node anything.
+
+# get_block_times(heights) -> [(time, hash), ...] is how the cache is filled
+BlockTimesGetter = Callable[[Sequence[int]], List[Tuple[int, str]]]
+
+FILL_BATCH_SIZE = 1000     # headers requested per batch when filling the cache
+REORG_STEP = 144           # heights dropped at a time when the cached tip is stale
+DAY_MARGIN = 2 * 60 * 60   # seconds cached before a day so its first block is found
+MEDIAN_TIME_SPAN = 11      # blocks in the median-time-past window
+
+
+def day_of_month(time_in_seconds: int) -> int:
+    return datetime.fromtimestamp(time_in_seconds, tz=timezone.utc).day
+
+
+def median_time_past(times: Sequence[int], start: int = 0, stop: Optional[int] = None) -> List[int]:
+    """
+    Return the median-time-past of each block: the median time of it and the 10
+    blocks before it. Unlike block times it never decreases along the chain.
+
+    Args:
+        times: Block times of consecutive heights.
+        start: First index to return the median-time-past of.
+        stop: Index to stop at (excluded), the end of times by default.
+    """
+    mtp = []
+    for i in range(start, len(times) if stop is None else stop):
+        window = sorted(times[max(0, i - MEDIAN_TIME_SPAN + 1):i + 1])
+        mtp.append(window[len(window) // 2])
+    return mtp
+
+
+def find_day_blocks(
+    times: Sequence[int], day_start: int, mtp: Optional[Sequence[int]] = None
+) -> Optional[Tuple[int, int]]:
+    """
+    Find the blocks of the UTC day starting at day_start among contiguous block times.
+
+    Block times are not strictly increasing, so the day is located with a bisect over
+    the median-time-past (which is monotonic) and then settled block by block: back up
+    to the last block stamped at or before midnight, start at the block after it, and
+    take blocks until one falls on another day of the month.
+
+    Args:
+        times: Block times of consecutive heights.
+        day_start: Unix time of UTC midnight at the start of the day.
+        mtp: median_time_past(times), if already known.
+
+    Returns:
+        (first, end) indexes into times of the day's blocks (end excluded), or None if
+        times doesn't reach far enough back or forward to settle both ends.
+    """
+    if mtp is None:
+        mtp = median_time_past(times)
+    i = bisect_left(mtp, day_start)
+    if i >= len(times):
+        return None
+
+    # back up to the last block at or before midnight, the day starts after it
+    if times[i] > day_start:
+        while times[i] > day_start:
+            i -= 1
+            if i < 0:
+                return None
+        i += 1
+    elif times[i] < day_start:
+        while times[i] < day_start:
+            i += 1
+            if i >= len(times):
+                return None
+
+    # take blocks until the day changes
+    first = i
+    day = day_of_month(times[first])
+    end = first
+    while day_of_month(times[end]) == day:
+        end += 1
+        if end >= len(times):
+            return None
+
+    return first, end
+
+
+class HeaderCache:
+    """
+    Persistent best-chain cache of height -> (block hash, block time).
+
+    The cached heights are always one contiguous range, and the median-time-past of
+    each is kept alongside the times so finding a day is only a bisect.
+
+    Args:
+        index_path: The sqlite file to keep the cache in (shared with the block index).
+    """
+
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH):
+        self.db = sqlite3.connect(index_path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS headers (
+                height INTEGER PRIMARY KEY,
+                hash BLOB,
+                time INTEGER
+            )
+        """)
+        self.first_height: Optional[int] = None
+        self.hashes: List[str] = []
+        self.times: List[int] = []
+        self.mtp: List[int] = []
+
+        for height, block_hash, time in self.db.execute("SELECT height, hash, time FROM headers ORDER BY height"):
+            if self.first_height is None:
+                self.first_height = height
+            elif height != self.first_height + len(self.times):
+                break  # keep the cache contiguous
+            self.hashes.append(block_hash.hex())
+            self.times.append(time)
+        self.mtp = median_time_past(self.times)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def last_height(self) -> Optional[int]:
+        return None if self.first_height is None else self.first_height + len(self.times) - 1
+
+    def block_time(self, height: int) -> Tuple[int, str]:
+        """Return the (time, hash) of a cached height."""
+        if self.first_height is None or not 0 <= height - self.first_height < len(self.times):
+            raise KeyError(height)
+        i = height - self.first_height
+        return self.times[i], self.hashes[i]
+
+    def _store(self, first_height: int, block_times: List[Tuple[int, str]]) -> None:
+        self.db.executemany(
+            "INSERT OR REPLACE INTO headers (height, hash, time) VALUES (?, ?, ?)",
+            [(first_height + i, bytes.fromhex(h), t) for i, (t, h) in enumerate(block_times)],
+        )
+        self.db.commit()
+
+    def _prepend(self, block_times: List[Tuple[int, str]]) -> None:
+        self.times[0:0] = [t for t, _ in block_times]
+        self.hashes[0:0] = [h for _, h in block_times]
+        # the blocks that were first now have a full window behind them
+        n_changed = min(MEDIAN_TIME_SPAN - 1, len(self.mtp))
+        self.mtp[0:n_changed] = median_time_past(self.times, 0, len(block_times) + n_changed)
+
+    def _append(self, block_times: List[Tuple[int, str]]) -> None:
+        start = len(self.times)
+        self.times.extend(t for t, _ in block_times)
+        self.hashes.extend(h for _, h in block_times)
+        self.mtp.extend(median_time_past(self.times, start))
+
+    def _truncate(self, height: int) -> None:
+        """Drop every cached height at or above height."""
+        self.db.execute("DELETE FROM headers WHERE height >= ?", (height,))
+        self.db.commit()
+        keep = max(0, height - self.first_height)
+        del self.hashes[keep:]
+        del self.times[keep:]
+        del self.mtp[keep:]
+        if not self.times:
+            self.first_height = None
+
+    def extend(self, get_block_times: BlockTimesGetter, first_height: int, last_height: int) -> int:
+        """
+        Make the cache cover first_height through last_height, asking only for missing heights.
+
+        Args:
+            get_block_times: Returns [(time, hash), ...] for a list of heights.
+            first_height: Lowest height the cache must contain.
+            last_height: Highest height the cache must contain (should be buried enough not to reorg).
+
+        Returns:
+            The number of heights added.
+        """
+        first_height = max(0, first_height)
+        n_added = 0
+
+        if self.first_height is None:
+            self.first_height = last_height + 1
+
+        # reach back below the cache
+        stop = self.first_height
+        while stop > first_height:
+            start = max(first_height, stop - FILL_BATCH_SIZE)
+            block_times = get_block_times(range(start, stop))
+            self._store(start, block_times)
+            self._prepend(block_times)
+            self.first_height = start
+            n_added += len(block_times)
+            stop = start
+
+        # reach forward above the cache
+        while self.last_height < last_height:
+            start = self.last_height + 1
+            stop = min(last_height + 1, start + FILL_BATCH_SIZE)
+            block_times = get_block_times(range(start, stop))
+            self._store(start, block_times)
+            self._append(block_times)
+            n_added += len(block_times)
+
+        return n_added
+
+    def verify(self, get_block_times: BlockTimesGetter, tip_height: Optional[int] = None) -> int:
+        """
+        Drop cached heights that are no longer on the node's best chain (after a reorg).
+
+        Args:
+            get_block_times: Returns [(time, hash), ...] for a list of heights.
+            tip_height: The node's block count, heights above it are dropped outright.
+
+        Returns:
+            The number of heights dropped.
+        """
+        n_dropped = 0
+        if tip_height is not None and self.times and self.last_height > tip_height:
+            n_dropped += self.last_height - max(tip_height, self.first_height - 1)
+            self._truncate(tip_height + 1)
+        while self.times:
+            last_height = self.last_height
+            if get_block_times([last_height])[0][1] == self.hashes[-1]:
+                break
+            drop_from = max(self.first_height, last_height - REORG_STEP + 1)
+            n_dropped += last_height + 1 - drop_from
+            self._truncate(drop_from)
+        return n_dropped
+
+    def cover_day(self, get_block_times: BlockTimesGetter, day_start: int, tip_height: int) -> None:
+        """
+        Extend the cache from before the UTC day starting at day_start up to tip_height.
+
+        Args:
+            get_block_times: Returns [(time, hash), ...] for a list of heights.
+            day_start: Unix time of UTC midnight at the start of the day.
+            tip_height: Highest height to cache, e.g. the consensus block.
+        """
+        if self.first_height is None:
+            self.extend(get_block_times, tip_height, tip_height)
+        self.extend(get_block_times, self.first_height, tip_height)
+
+        # estimate how far back the day is at 10 minutes a block, and repeat if short
+        while self.first_height > 0 and self.times[0] > day_start - DAY_MARGIN:
+            blocks_back = (self.times[0] - day_start + DAY_MARGIN) // 600 + MEDIAN_TIME_SPAN
+            self.extend(get_block_times, self.first_height - blocks_back, tip_height)
+
+    def day_blocks(self, day_start: int) -> Optional[Tuple[int, int]]:
+        """
+        Return (first height, end height) of the blocks on the UTC day starting at
+        day_start (end excluded), or None if the cache doesn't cover the whole day.
+        """
+        found = find_day_blocks(self.times, day_start, self.mtp)
+        if found is None:
+            return None
+        first, end = found
+        return self.first_height + first, self.first_height + end
+
+    def fill_from_index(self, block_index: BlockIndex, tip_hash: str) -> int:
+        """
+        Fill the cache from blk-file headers instead of the node, by following parent
+        hashes back from tip_hash through the block index until reaching the cached tip.
+
+        Returns:
+            The number of heights added (0 if the walk can't be joined to the cache).
+        """
+        chain = []
+        location = block_index.locate(tip_hash)
+        while location is not None and location.height is not None:
+            if self.times and location.height <= self.last_height:
+                if self.block_time(location.height)[1] != location.block_hash:
+                    return 0  # the cache holds a different chain, verify() it first
+                break
+            chain.append(location)
+            location = block_index.locate(location.prev_hash)
+
+        if not chain or (self.times and chain[-1].height != self.last_height + 1):
+            return 0
+
+        chain.reverse()
+        if self.first_height is None:
+            self.first_height = chain[0].height
+        block_times = [(location.time, location.block_hash) for location in chain]
+        self._store(chain[0].height, block_times)
+        self._append(block_times)
+        return len(chain)
@@ -0,0 +1,195 @@
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+from block_index import BlockLocation, blk_file_name
+from block_xor import deobfuscate, read_xor_key
+from models import HEADER_LENGTH
+
+# The node already knows where every block is: blocks/index is a LevelDB database
+# holding a record per block header with its height, status, and (once the block
+# is stored) the blk file number and the byte position of the block data. Reading
+# it resolves a block hash straight to its file and offset, with no blk file
+# scanning and no guessing which files to start from, so a block from years ago
+# is as cheap to find as one from today. It needs the plyvel package.
+#
+# LevelDB allows a single process per database, so while the node is running its
+# index is locked. The index is then copied (it is a few hundred MB) to a
+# temporary snapshot which is opened instead.
+
+# record key prefix of a block index entry, followed by the block hash (internal byte order)
+BLOCK_INDEX_PREFIX = b'b'
+
+# CBlockIndex::nStatus bits telling which positions the record holds
+BLOCK_HAVE_DATA = 8
+BLOCK_HAVE_UNDO = 16
+
+# the LevelDB lock file, which a snapshot must not copy
+LOCK_FILE = 'LOCK'
+SNAPSHOT_ATTEMPTS = 3
+
+
+def read_varint(buf: bytes, pos: int) -> tuple[int, int]:
+    """
+    Decode one of the node's own VARINTs (not a compact size) at pos.
+
+    Each byte holds 7 bits, most significant first, with the high bit set on every
+    byte but the last, and one added per continuation so encodings are unique.
+
+    Returns:
+        The integer and the position immediately after it.
+    """
+    n = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n = (n << 7) | (byte & 0x7f)
+        if byte & 0x80:
+            n += 1
+        else:
+            return n, pos
+
+
+def decode_block_record(value: bytes) -> tuple[int, int, Optional[int], Optional[int], bytes]:
+    """
+    Decode a serialized CDiskBlockIndex.
+
+    Returns:
+        (height, status, blk file number, data position, 80 byte header). The file
+        number and data position are None when the node doesn't have the block data.
+    """
+    _, pos = read_varint(value, 0)  # client version
+    height, pos = read_varint(value, pos)
+    status, pos = read_varint(value, pos)
+    _, pos = read_varint(value, pos)  # tx count
+    file_num = data_pos = None
+    if status & (BLOCK_HAVE_DATA | BLOCK_HAVE_UNDO):
+        file_num, pos = read_varint(value, pos)
+    if status & BLOCK_HAVE_DATA:
+        data_pos, pos = read_varint(value, pos)
+    if status & BLOCK_HAVE_UNDO:
+        _, pos = read_varint(value, pos)  # undo data position
+    return height, status, file_num, data_pos, value[pos:pos + HEADER_LENGTH]
+
+
+class LevelDBBlockIndex:
+    """
+    Block hash / height -> location in the blk files, read from the node's own
+    LevelDB block index. Offers the lookups of BlockIndex, but never needs updating.
+
+    Args:
+        blocks_dir: The node's blocks directory (holding the index directory).
+        index_dir: The LevelDB directory, by default blocks_dir/index.
+    """
+
+    def __init__(self, blocks_dir: str, index_dir: Optional[str] = None):
+        try:
+            import plyvel
+        except ImportError:
+            raise ImportError("plyvel is needed to read the node's block index (pip install plyvel)")
+        self.blocks_dir = blocks_dir
+        self.index_dir = index_dir or os.path.join(blocks_dir, 'index')
+        if not os.path.isdir(self.index_dir):
+            raise ValueError(f"no LevelDB block index found at {self.index_dir}")
+        self.xor_key = read_xor_key(blocks_dir)
+        self.snapshot_dir: Optional[str] = None
+        self._heights: Optional[Dict[int, List[bytes]]] = None
+
+        try:
+            self.db = plyvel.DB(self.index_dir, create_if_missing=False)
+        except plyvel.Error:
+            # locked by the running node, read a copy instead
+            self.db = self._open_snapshot(plyvel)
+
+    def _open_snapshot(self, plyvel):
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            self.snapshot_dir = tempfile.mkdtemp(prefix='utxoracle_index_')
+            try:
+                # the node may compact (delete) files while we copy, then try again
+                shutil.copytree(
+                    self.index_dir, self.snapshot_dir, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns(LOCK_FILE),
+                )
+                return plyvel.DB(self.snapshot_dir, create_if_missing=False)
+            except (OSError, plyvel.Error):
+                shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+                self.snapshot_dir = None
+                if attempt == SNAPSHOT_ATTEMPTS - 1:
+                    raise
+
+    def close(self) -> None:
+        self.db.close()
+        if self.snapshot_dir is not None:
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+            self.snapshot_dir = None
+
+    def __enter__(self) -> 'LevelDBBlockIndex':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def update(self, first_file: int = 0, progress=None) -> int:
+        """Nothing to do, the node keeps its index up to date. Kept for BlockIndex compatibility."""
+        if progress is not None:
+            progress(1.0)
+        return 0
+
+    def _block_size(self, file_num: int, data_pos: int) -> int:
+        # the index doesn't record the size, it's the 4 bytes before the block data
+        with open(os.path.join(self.blocks_dir, blk_file_name(file_num)), 'rb') as f:
+            f.seek(data_pos - 4)
+            size_bytes = f.read(4)
+        if self.xor_key is not None:
+            size_bytes = bytes(deobfuscate(size_bytes, self.xor_key, data_pos - 4))
+        return int.from_bytes(size_bytes, 'little')
+
+    def _to_location(self, block_hash: bytes, value: bytes) -> Optional[BlockLocation]:
+        height, _, file_num, data_pos, header = decode_block_record(value)
+        if data_pos is None:
+            return None  # header only, the block itself isn't stored
+        return BlockLocation(
+            block_hash=block_hash[::-1].hex(),
+            prev_hash=header[4:36][::-1].hex(),
+            height=height,
+            file=blk_file_name(file_num),
+            offset=data_pos - 8,  # the position is past the magic bytes and size
+            size=self._block_size(file_num, data_pos),
+            time=int.from_bytes(header[68:72], 'little'),
+        )
+
+    def locate(self, block_hash: str) -> Optional[BlockLocation]:
+        """Return where the block with this (big-endian hex) hash is stored, if the node has it."""
+        internal_hash = bytes.fromhex(block_hash)[::-1]
+        value = self.db.get(BLOCK_INDEX_PREFIX + internal_hash)
+        return None if value is None else self._to_location(internal_hash, value)
+
+    def lookup(self, block_hashes: Iterable[str]) -> Dict[str, BlockLocation]:
+        """Return the locations of all stored blocks among block_hashes, keyed by hash."""
+        found = {}
+        for block_hash in block_hashes:
+            location = self.locate(block_hash)
+            if location is not None:
+                found[block_hash] = location
+        return found
+
+    def at_height(self, height: int) -> List[BlockLocation]:
+        """
+        Return every stored block at this height (stale blocks share heights).
+
+        The index is keyed by hash only, so the first call reads every record once
+        to map heights to hashes.
+        """
+        if self._heights is None:
+            self._heights = {}
+            for key, value in self.db.iterator(prefix=BLOCK_INDEX_PREFIX):
+                record_height = decode_block_record(value)[0]
+                self._heights.setdefault(record_height, []).append(key[1:])
+
+        locations = []
+        for internal_hash in self._heights.get(height, []):
+            location = self._to_location(internal_hash, self.db.get(BLOCK_INDEX_PREFIX + internal_hash))
+            if location is not None:
+                locations.append(location)
+        return locations
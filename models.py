@@ -1,8 +1,14 @@
 from typing import BinaryIO
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from hashlib import sha256
-from typing import Tuple, List, Optional
+from struct import unpack_from
+from typing import Iterator, Tuple, List, Optional
+
+import numpy as np
+
+from block_xor import deobfuscate
+from compact_size import read_compact_size
 
 # invaluable resource: https://learnmeabitcoin.com/technical/block/blkdat/
 MAINNET_MAGIC_BYTES = b'\xf9\xbe\xb4\xd9'
@@ -12,22 +18,23 @@ HEADER_LENGTH = 80  # Bitcoin block header total length (in bytes)
 def hash256(byte_data: bytes) -> bytes:
     return sha256(sha256(byte_data).digest()).digest()
 
-def tx_hash(version: bytes, inputs: bytes, outputs: bytes, locktime: bytes) -> tuple[bytes, str]:
+def tx_hash(version: bytes, inputs: bytes, outputs: bytes, locktime: bytes) -> str:
     # The txid is the double SHA-256 hash of the transaction data
     # The transaction data is the version, inputs, outputs, and locktime
     # The marker and flag are not included in the txid calculation
-        
-    # Using btyearray for increased performance
-    preimage = bytearray(len(version) + len(inputs) + len(outputs) + len(locktime))
-    pos = 0
-    for data in (version, inputs, outputs, locktime):
-        preimage[pos:pos + len(data)] = data
-        pos += len(data)
-    hashed = hash256(preimage)
-
-    return hashed[::-1].hex(), preimage.hex()
+
+    # Feed each section to the hash in turn rather than joining them first
+    first_hash = sha256(version)
+    for data in (inputs, outputs, locktime):
+        first_hash.update(data)
+
+    return sha256(first_hash.digest()).digest()[::-1].hex()
+
+def tx_preimage(version: bytes, inputs: bytes, outputs: bytes, locktime: bytes) -> str:
+    # The preimage is the blob that tx_hash hashes, handy for debugging txids
+    return b''.join((version, inputs, outputs, locktime)).hex()
     
-@dataclass
+@dataclass(slots=True)
 class BlockHeader:
     header: bytes           # Full 80-byte block header
     version: bytes          # First 4 bytes of the header
@@ -42,7 +49,7 @@ class BlockHeader:
         """Get the block hash by hashing the header twice with SHA-256."""
         return hash256(self.header)[::-1]
 
-@dataclass
+@dataclass(slots=True)
 class Input:
     utxo_txid: bytes
     utxo_vout: int
@@ -50,23 +57,23 @@ class Input:
     script: bytes  # only used for legacy locking scripts:  P2PK, P2PKH, P2SH, P2MS
     sequence: bytes
 
-@dataclass
+@dataclass(slots=True)
 class Output:
     amount: int
     script_size: int
     script: bytes
 
-@dataclass
+@dataclass(slots=True)
 class StackItem:
     size: int
     data: bytes
 
-@dataclass
+@dataclass(slots=True)
 class WitnessField:
     n_stack_items: int
     stack_items: List[StackItem]
 
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     version: int
     version_bytes: bytes
@@ -74,84 +81,152 @@ class Transaction:
     flag: Optional[bytes]
     n_inputs: int
     inputs: List[Input]
-    inputs_bytes: bytes
+    inputs_bytes: memoryview  # a slice of the block's tx data, not a copy
     n_outputs: int
     outputs: List[Output]
-    outputs_bytes: bytes
-    witness: Optional[List[WitnessField]] 
+    outputs_bytes: memoryview  # likewise
+    witness: Optional[List[WitnessField]]  # None for legacy txs, or if the witness wasn't asked for
     locktime: bytes
-    txid: bytes
-    preimage: str
     is_coinbase: bool
     is_segwit: bool
     witness_size: int
+    _txid: Optional[str] = field(default=None, repr=False, compare=False)
+
+    @property
+    def txid(self) -> str:
+        """The txid, hashed the first time it's asked for."""
+        if self._txid is None:
+            self._txid = tx_hash(self.version_bytes, self.inputs_bytes, self.outputs_bytes, self.locktime)
+        return self._txid
 
-@dataclass
+    @property
+    def preimage(self) -> str:
+        return tx_preimage(self.version_bytes, self.inputs_bytes, self.outputs_bytes, self.locktime)
+
+@dataclass(slots=True)
 class RawBlock:
     magic_bytes: bytes
     size: int
     block_header: BlockHeader
     n_txs: int
-    txs: List[Transaction]
+    txs: Optional[List[Transaction]]  # None until parsed, see iter_txs
     block_height: int
+    tx_data: bytes = field(default=b'', repr=False)  # only kept while txs is None
 
     @property
     def is_mainnet(self) -> bool:
         """Check if the block is from the mainnet."""
         return self.magic_bytes == MAINNET_MAGIC_BYTES
     
+    def iter_txs(self, witness: bool = True) -> Iterator[Transaction]:
+        """
+        Yield the block's transactions one at a time, each parsed only when reached.
+
+        Args:
+            witness: Build the witness fields. If False the witness data is only
+                skipped over, which is all a caller interested in outputs needs.
+
+        Returns:
+            An iterator over the block's Transaction objects.
+        """
+        if self.txs is not None:
+            return iter(self.txs)
+        return self.iter_tx_data(self.tx_data, witness)
+
+    def load_txs(self) -> List[Transaction]:
+        """Parse every transaction of a lazily parsed block into txs and drop the raw tx data."""
+        if self.txs is None:
+            self.txs, _ = self.parse_txs(self.tx_data)
+            self.tx_data = b''
+        return self.txs
+
     @classmethod
-    def parse(cls, f: BinaryIO, start: int) -> Tuple['RawBlock', int]:
+    def parse(
+        cls, f: BinaryIO, start: int, xor_key: Optional[bytes] = None, lazy: bool = False
+    ) -> Tuple['RawBlock', int]:
         """
         Parse a Bitcoin block from a binary file from the given start position.
 
         Args:
             file: A file object opened in binary mode ('rb') positioned at the start of a block.
+            xor_key: The blocks dir's xor.dat key (see block_xor.read_xor_key) if the file is obfuscated.
+            lazy: Leave txs as None and parse only the coinbase, for callers using iter_txs().
 
         Returns:
             A RawBlock instance.
         """
+        magic_bytes, size, block_data, pos = cls.read_block(f, start, xor_key)
+
+        # Parse block header (starts at byte 0 of block_data)
+        block_header = cls.parse_block_header(block_data)
+
+        # Parse n_txs (compact size, after header at byte 80)
+        n_txs, tx_data_pos, _ = cls.get_compact_size(block_data, pos=80)
+
+        # Transaction data (from tx_data_pos to end)
+        tx_data = block_data[tx_data_pos:]
+        if lazy:
+            txs = None
+            block_height = cls.coinbase_height(next(cls.iter_tx_data(tx_data, witness=False)))
+        else:
+            txs, block_height = cls.parse_txs(tx_data)
+
+        return RawBlock(
+            magic_bytes=magic_bytes,
+            size=size,
+            block_header=block_header,
+            n_txs=n_txs,
+            txs=txs,
+            block_height=block_height,
+            tx_data=tx_data if lazy else b'',
+        ), pos
+    
+    @classmethod
+    def read_block(cls, f: BinaryIO, start: int, xor_key: Optional[bytes] = None) -> Tuple[bytes, int, bytes, int]:
+        """
+        Read the raw block stored at start in a blk file.
+
+        Args:
+            f: A blk file opened in binary mode ('rb').
+            start: Position of the block's magic bytes.
+            xor_key: The blocks dir's xor.dat key if the file is obfuscated.
+
+        Returns:
+            The magic bytes, the block size, the block data (header + n_txs + transactions)
+            and the position immediately after the block.
+        """
         pos = start
         f.seek(pos)
 
         # Read magic bytes (4 bytes)
-        magic_bytes = f.read(4)
+        magic_bytes = cls.read_at(f, pos, 4, xor_key)
         pos += 4
         if len(magic_bytes) != 4:
             raise ValueError(f"Magic bytes size issue: Expected 4 bytes, got {len(magic_bytes)} bytes")
 
         # Read size (4 bytes)
-        size_bytes = f.read(4)
+        size_bytes = cls.read_at(f, pos, 4, xor_key)
         pos += 4
         if len(size_bytes) != 4:
             raise ValueError(f"Block size size issue: Expected 4 bytes, got {len(size_bytes)} bytes")
         size = int.from_bytes(size_bytes, 'little')
 
         # Read block_data (header + n_txs + transactions, based on size)
-        block_data = f.read(size)
+        block_data = cls.read_at(f, pos, size, xor_key)
         pos += size
         if len(block_data) != size:
             raise ValueError(f"Block data size issue: Expected {size} bytes, got {len(block_data)} bytes")
 
-        # Parse block header (starts at byte 0 of block_data)
-        block_header = cls.parse_block_header(block_data)
-
-        # Parse n_txs (compact size, after header at byte 80)
-        n_txs, tx_data_pos, _ = cls.get_compact_size(block_data, pos=80)
+        return magic_bytes, size, block_data, pos
 
-        # Transaction data (from tx_data_pos to end)
-        tx_data = block_data[tx_data_pos:]
-        txs, block_height = cls.parse_txs(tx_data)
+    @staticmethod
+    def read_at(f: BinaryIO, pos: int, n: int, xor_key: Optional[bytes] = None) -> bytes:
+        """Read n bytes of a blk file at pos, de-obfuscating them if there is a key."""
+        data = f.read(n)
+        if xor_key is None:
+            return data
+        return bytes(deobfuscate(data, xor_key, pos))
 
-        return RawBlock(
-            magic_bytes=magic_bytes,
-            size=size,
-            block_header=block_header,
-            n_txs=n_txs,
-            txs=txs,
-            block_height=block_height
-        ), pos
-    
     @staticmethod
     def parse_block_header(block_data: bytes) -> BlockHeader:
         """Extract block header information from raw block bytes.
@@ -217,10 +292,33 @@ class RawBlock:
             return int.from_bytes(byte_data[pos+1:pos+9], 'little'), pos + 9, byte_data[pos:pos+9]
         # The compact size integer is 1 byte for values < 0xfd, 2 bytes for 0xfd, 4 bytes for 0xfe, and 8 bytes for 0xff.
         
-    @staticmethod
-    def parse_txs(tx_data: bytes) -> tuple[List[Transaction], int]:
+    @classmethod
+    def parse_txs(cls, tx_data: bytes) -> tuple[List[Transaction], int]:
         """Parse the transaction data into a list of Transaction objects."""
-        transactions = []
+        transactions = list(cls.iter_tx_data(tx_data))
+        return transactions, cls.coinbase_height(transactions[0])
+
+    @staticmethod
+    def coinbase_height(coinbase: Transaction) -> int:
+        """Read the block height (BIP-34) from the start of the coinbase input's script."""
+        script = coinbase.inputs[0].script
+        block_height_size = int.from_bytes(script[0:1])
+        return int.from_bytes(script[1:block_height_size+1], byteorder='little')
+
+    @staticmethod
+    def iter_tx_data(tx_data: bytes, witness: bool = True) -> Iterator[Transaction]:
+        """
+        Parse the transaction data into Transaction objects, one at a time.
+
+        Args:
+            tx_data: The block's transactions (everything after n_txs).
+            witness: Build the witness fields (otherwise they're only skipped over).
+
+        Yields:
+            A Transaction per transaction, in block order.
+        """
+        # Slicing a memoryview shares tx_data instead of copying it
+        view = memoryview(tx_data)
         pos = 0
         while pos < len(tx_data):
             # Read transaction version
@@ -249,8 +347,12 @@ class RawBlock:
             
             # --------------------------------------------------------------------------------
             # Start of the inputs section
+            #
+            # Only the start and end positions of the inputs and outputs sections are
+            # recorded; once they have been walked they are sliced out of the memoryview,
+            # so the txid is hashed straight from the block's data.
             # --------------------------------------------------------------------------------
-            inputs_bytes = b''
+            inputs_start = pos
             
             # Read number of inputs
             n_inputs, pos, n_input_bytes = RawBlock.get_compact_size(tx_data, pos)
@@ -260,7 +362,6 @@ class RawBlock:
                 raise ValueError(f"Though no formal limit, {n_inputs:,} is a ridiculous number of inputs")
             if len(n_input_bytes) < 1:
                 raise ValueError(f"Per BIP-144, expected at least 1 byte for n_inputs, got {len(n_input_bytes)} bytes")
-            inputs_bytes += n_input_bytes
 
             # Read inputs
             inputs = []
@@ -268,13 +369,11 @@ class RawBlock:
                 # Read previous outpoint txid (32 bytes)
                 utxo_txid = tx_data[pos:pos+32]
                 pos += 32
-                inputs_bytes += utxo_txid
 
                 # Read previous outpoint vout (4 bytes)
                 utxo_vout_bytes = tx_data[pos:pos+4]
                 utxo_vout = int.from_bytes(utxo_vout_bytes, byteorder='little')
                 pos += 4
-                inputs_bytes += utxo_vout_bytes
 
                 is_coinbase = (utxo_txid == b'\x00' * 32) and (utxo_vout == 0xFFFFFFFF)
 
@@ -286,30 +385,25 @@ class RawBlock:
                     raise ValueError(f"Coinbase script size must be <= 100 bytes, got {script_size:,} bytes")
                 if not is_coinbase and script_size > 10_000:
                     raise ValueError(f"Input script size must be <= 10,000 bytes, got {script_size:,} bytes")
-                inputs_bytes += script_size_bytes
 
                 # Read script (variable length)
                 script = tx_data[pos:pos+script_size] if script_size > 0 else b''
                 pos += script_size
-                inputs_bytes += script
-                if is_coinbase:
-                    block_height_size = int.from_bytes(script[0:1])
-                    block_height = int.from_bytes(script[1:block_height_size+1], byteorder='little')
                     
                 # Read sequence (4 bytes)
                 sequence = tx_data[pos:pos+4]
                 pos += 4
-                inputs_bytes += sequence
 
                 # Create input object
                 inputs.append(Input(utxo_txid, utxo_vout, script_size, script, sequence))
+            inputs_bytes = view[inputs_start:pos]
             if len(inputs_bytes) < 41:
                 raise ValueError(f"Per BIP-144, expected at least 41 bytes for inputs, got {len(inputs_bytes)} bytes")
             
             # --------------------------------------------------------------------------------
             # Start of the outputs section
             # --------------------------------------------------------------------------------
-            outputs_bytes = b''
+            outputs_start = pos
 
             # Read number of outputs
             n_outputs, pos, n_outputs_bytes = RawBlock.get_compact_size(tx_data, pos)
@@ -319,7 +413,6 @@ class RawBlock:
                 raise ValueError(f"Though no formal limit, {n_outputs:,} is a ridiculous number of outputs")
             if len(n_outputs_bytes) < 1:
                 raise ValueError(f"Per BIP-144, expected at least 1 byte for n_outputs, got {len(n_outputs_bytes)} bytes")
-            outputs_bytes += n_outputs_bytes
 
             # Read outputs
             outputs = []
@@ -328,19 +421,17 @@ class RawBlock:
                 amount_bytes = tx_data[pos:pos+8]
                 amount = int.from_bytes(amount_bytes, byteorder='little')
                 pos += 8
-                outputs_bytes += amount_bytes
 
                 # Read script size (compact size integer)
                 script_size, pos, script_size_bytes = RawBlock.get_compact_size(tx_data, pos)
-                outputs_bytes += script_size_bytes
 
                 # Read script (variable length)
                 script = tx_data[pos:pos+script_size]
                 pos += script_size
-                outputs_bytes += script
 
                 # Create output object
                 outputs.append(Output(amount, script_size, script))
+            outputs_bytes = view[outputs_start:pos]
             if len(outputs_bytes) < 9:
                 raise ValueError(f"Per BIP-144, expected at least 9 bytes for outputs, got {len(outputs_bytes)} bytes")
             
@@ -355,31 +446,38 @@ class RawBlock:
             #     - a compact size integer (size of the upcoming item)
             #     - the item data
             # --------------------------------------------------------------------------------
-            witness_bytes = b''
+            witness_start = pos
 
-            if witness_flag:
+            if witness_flag and witness:
                 witness_fields = []
                 for _ in range(n_inputs):
                     # Read the number of stack items
                     n_stack_items, pos, n_stack_items_bytes = RawBlock.get_compact_size(tx_data, pos)
-                    witness_bytes += n_stack_items_bytes
                     
                     # Read each stack item
                     stack_items = []
                     for _ in range(n_stack_items):
                         stack_item_size, pos, stack_item_size_bytes = RawBlock.get_compact_size(tx_data, pos)
-                        witness_bytes += stack_item_size_bytes
                         stack_item = tx_data[pos:pos+stack_item_size]
-                        witness_bytes += stack_item
                         pos += stack_item_size
                         stack_items.append(StackItem(stack_item_size, stack_item))
                     
                     witness_fields.append(WitnessField(n_stack_items, stack_items))
-                if len(witness_bytes) < 1:
-                    raise ValueError(f"Per BIP-144, expected at least 1 byte for witness, got {len(witness_bytes)} bytes")
-                witness = witness_fields
+                if pos - witness_start < 1:
+                    raise ValueError(f"Per BIP-144, expected at least 1 byte for witness, got {pos - witness_start} bytes")
+                tx_witness = witness_fields
+            elif witness_flag:
+                # Only find where the witness data ends, without copying it out
+                for _ in range(n_inputs):
+                    n_stack_items, pos = read_compact_size(tx_data, pos)
+                    for _ in range(n_stack_items):
+                        stack_item_size, pos = read_compact_size(tx_data, pos)
+                        pos += stack_item_size
+                tx_witness = None
             else:
-                witness = None
+                tx_witness = None
+
+            witness_size = pos - witness_start
 
             # Read lock time
             lock_time = tx_data[pos:pos+4]
@@ -387,7 +485,7 @@ class RawBlock:
                 raise ValueError(f"Per BIP-144, expected 4 bytes for locktime, got {len(lock_time)} bytes")
             pos += 4
 
-            transactions.append(Transaction(
+            yield Transaction(
                 version=version,
                 version_bytes=version_bytes,
                 marker=marker,
@@ -398,16 +496,12 @@ class RawBlock:
                 n_outputs=n_outputs,
                 outputs=outputs,
                 outputs_bytes=outputs_bytes,
-                witness=witness,
+                witness=tx_witness,
                 locktime=lock_time,
-                txid=tx_hash(version_bytes, inputs_bytes, outputs_bytes, lock_time)[0],
-                preimage=tx_hash(version_bytes, inputs_bytes, outputs_bytes, lock_time)[1],
                 is_coinbase=is_coinbase,
                 is_segwit=witness_flag,
-                witness_size=len(witness_bytes)
-            ))
-
-        return transactions, block_height
+                witness_size=witness_size
+            )
     
     def __repr__(self) -> str:
         result = (
@@ -426,7 +520,7 @@ class RawBlock:
         )
         
         result += "\n    Transactions:\n"
-        for i, tx in enumerate(self.txs, 1):
+        for i, tx in enumerate(self.iter_txs(), 1):
             if i <= 3 or i == self.n_txs:
                 result += (
                     f"    --------------------------\n"
@@ -444,3 +538,215 @@ class RawBlock:
 
         return result + "\n"
         
+
+@dataclass(slots=True, repr=False)
+class CompactBlock:
+    """
+    A whole block kept as its raw bytes plus NumPy arrays of where things are in them.
+
+    RawBlock builds a Transaction, with Input, Output and witness objects holding
+    copies of their bytes, for every tx up front. CompactBlock walks the block once
+    and only records positions, counts and amounts, one array entry per tx, input
+    or output. Everything else (txids, scripts, the header) is decoded from data
+    when asked for, so a parsed block costs little more than its own bytes.
+
+    The inputs of tx i are entries tx_first_input[i] to tx_first_input[i + 1] of the
+    input arrays, and likewise for outputs.
+    """
+    magic_bytes: bytes
+    size: int
+    data: bytes                        # header + n_txs + transactions
+    block_height: Optional[int]        # from the coinbase (BIP-34)
+    tx_offsets: np.ndarray             # start of each tx in data, then the end of the last tx
+    tx_witness_sizes: np.ndarray       # bytes of witness data (0 for legacy txs)
+    tx_is_segwit: np.ndarray
+    tx_first_input: np.ndarray         # index of each tx's first input, then the input count
+    tx_first_output: np.ndarray        # index of each tx's first output, then the output count
+    input_offsets: np.ndarray          # start of each input (its prev txid) in data
+    input_vouts: np.ndarray
+    input_script_sizes: np.ndarray
+    input_witness_sizes: np.ndarray    # total size of each input's witness items (0 for legacy txs)
+    output_amounts: np.ndarray         # sats
+    output_script_offsets: np.ndarray  # start of each output script in data
+    output_script_sizes: np.ndarray
+
+    @property
+    def is_mainnet(self) -> bool:
+        """Check if the block is from the mainnet."""
+        return self.magic_bytes == MAINNET_MAGIC_BYTES
+
+    @property
+    def block_header(self) -> BlockHeader:
+        return RawBlock.parse_block_header(self.data)
+
+    @property
+    def n_txs(self) -> int:
+        return len(self.tx_offsets) - 1
+
+    @property
+    def tx_n_inputs(self) -> np.ndarray:
+        return np.diff(self.tx_first_input)
+
+    @property
+    def tx_n_outputs(self) -> np.ndarray:
+        return np.diff(self.tx_first_output)
+
+    @property
+    def tx_is_coinbase(self) -> np.ndarray:
+        """Whether each tx spends the null outpoint (all-zero txid, vout 0xffffffff)."""
+        is_coinbase = np.zeros(self.n_txs, dtype=bool)
+        for i in np.flatnonzero(self.input_vouts == 0xFFFFFFFF):
+            if self.prev_txid(i) == b'\x00' * 32:
+                is_coinbase[np.searchsorted(self.tx_first_input, i, side='right') - 1] = True
+        return is_coinbase
+
+    @property
+    def output_is_op_return(self) -> np.ndarray:
+        """Whether each output script starts with OP_RETURN."""
+        block_bytes = np.frombuffer(self.data, dtype=np.uint8)
+        has_script = self.output_script_sizes > 0
+        is_op_return = np.zeros(len(self.output_script_sizes), dtype=bool)
+        is_op_return[has_script] = block_bytes[self.output_script_offsets[has_script]] == 0x6a
+        return is_op_return
+
+    def _txid_sections(self, i: int) -> Tuple[memoryview, memoryview, memoryview]:
+        # version, inputs + outputs, locktime: the tx without marker, flag and witness
+        data = memoryview(self.data)
+        start, end = int(self.tx_offsets[i]), int(self.tx_offsets[i + 1])
+        body_start = start + (6 if self.tx_is_segwit[i] else 4)
+        body_end = end - 4 - int(self.tx_witness_sizes[i])
+        return data[start:start + 4], data[body_start:body_end], data[end - 4:end]
+
+    def txid(self, i: int) -> bytes:
+        """The txid of tx i in internal byte order (as inputs refer to it)."""
+        version, body, locktime = self._txid_sections(i)
+        first_hash = sha256(version)
+        first_hash.update(body)
+        first_hash.update(locktime)
+        return sha256(first_hash.digest()).digest()
+
+    def txids(self) -> np.ndarray:
+        """Every txid (internal byte order) as an (n_txs, 32) uint8 array."""
+        txids = b''.join(self.txid(i) for i in range(self.n_txs))
+        return np.frombuffer(txids, dtype=np.uint8).reshape(self.n_txs, 32)
+
+    def txid_hex(self, i: int) -> str:
+        """The txid of tx i as shown by the node (same as Transaction.txid)."""
+        return self.txid(i)[::-1].hex()
+
+    def preimage(self, i: int) -> str:
+        """The blob hashed for the txid of tx i, as hex (same as Transaction.preimage)."""
+        return b''.join(self._txid_sections(i)).hex()
+
+    def locktime(self, i: int) -> bytes:
+        end = int(self.tx_offsets[i + 1])
+        return self.data[end - 4:end]
+
+    def prev_txid(self, j: int) -> bytes:
+        """The txid (internal byte order) spent by input j."""
+        start = int(self.input_offsets[j])
+        return self.data[start:start + 32]
+
+    def output_script(self, k: int) -> bytes:
+        start = int(self.output_script_offsets[k])
+        return self.data[start:start + int(self.output_script_sizes[k])]
+
+    @classmethod
+    def parse(cls, f: BinaryIO, start: int, xor_key: Optional[bytes] = None) -> Tuple['CompactBlock', int]:
+        """
+        Parse a Bitcoin block from a binary file from the given start position.
+
+        Args:
+            f: A file object opened in binary mode ('rb').
+            start: Position of the block's magic bytes.
+            xor_key: The blocks dir's xor.dat key if the file is obfuscated.
+
+        Returns:
+            A CompactBlock instance and the position immediately after the block.
+        """
+        magic_bytes, size, block_data, pos = RawBlock.read_block(f, start, xor_key)
+        return cls.from_block_data(magic_bytes, block_data), pos
+
+    @classmethod
+    def from_block_data(cls, magic_bytes: bytes, data: bytes) -> 'CompactBlock':
+        """Walk the block data (header + n_txs + transactions) once, recording where everything is."""
+        tx_offsets, tx_witness_sizes, tx_is_segwit = [], [], []
+        tx_first_input, tx_first_output = [0], [0]
+        input_offsets, input_vouts, input_script_sizes, input_witness_sizes = [], [], [], []
+        output_amounts, output_script_offsets, output_script_sizes = [], [], []
+
+        n_txs, pos = read_compact_size(data, HEADER_LENGTH)
+        for _ in range(n_txs):
+            tx_offsets.append(pos)
+            # segwit txs have a 0x00 marker and 0x01 flag after the version
+            is_segwit = data[pos + 4] == 0 and data[pos + 5] == 1
+            pos += 6 if is_segwit else 4
+
+            n_inputs, pos = read_compact_size(data, pos)
+            for _ in range(n_inputs):
+                input_offsets.append(pos)
+                input_vouts.append(unpack_from('<I', data, pos + 32)[0])
+                script_size, pos = read_compact_size(data, pos + 36)
+                input_script_sizes.append(script_size)
+                pos += script_size + 4  # script + sequence
+            tx_first_input.append(len(input_offsets))
+
+            n_outputs, pos = read_compact_size(data, pos)
+            for _ in range(n_outputs):
+                output_amounts.append(unpack_from('<Q', data, pos)[0])
+                script_size, pos = read_compact_size(data, pos + 8)
+                output_script_offsets.append(pos)
+                output_script_sizes.append(script_size)
+                pos += script_size
+            tx_first_output.append(len(output_amounts))
+
+            # one stack of items per input
+            witness_start = pos
+            if is_segwit:
+                for _ in range(n_inputs):
+                    n_stack_items, pos = read_compact_size(data, pos)
+                    input_witness_size = 0
+                    for _ in range(n_stack_items):
+                        item_size, pos = read_compact_size(data, pos)
+                        pos += item_size
+                        input_witness_size += item_size
+                    input_witness_sizes.append(input_witness_size)
+            else:
+                input_witness_sizes.extend([0] * n_inputs)
+            tx_witness_sizes.append(pos - witness_start)
+            tx_is_segwit.append(is_segwit)
+            pos += 4  # locktime
+        tx_offsets.append(pos)
+
+        # BIP-34 puts the height at the start of the coinbase script
+        block_height = None
+        if input_offsets and input_vouts[0] == 0xFFFFFFFF:
+            script_start = read_compact_size(data, input_offsets[0] + 36)[1]
+            height_size = data[script_start]
+            block_height = int.from_bytes(data[script_start + 1:script_start + 1 + height_size], 'little')
+
+        return cls(
+            magic_bytes=magic_bytes,
+            size=len(data),
+            data=data,
+            block_height=block_height,
+            tx_offsets=np.array(tx_offsets, dtype=np.uint32),
+            tx_witness_sizes=np.array(tx_witness_sizes, dtype=np.uint32),
+            tx_is_segwit=np.array(tx_is_segwit, dtype=bool),
+            tx_first_input=np.array(tx_first_input, dtype=np.uint32),
+            tx_first_output=np.array(tx_first_output, dtype=np.uint32),
+            input_offsets=np.array(input_offsets, dtype=np.uint32),
+            input_vouts=np.array(input_vouts, dtype=np.uint32),
+            input_script_sizes=np.array(input_script_sizes, dtype=np.uint32),
+            input_witness_sizes=np.array(input_witness_sizes, dtype=np.uint32),
+            output_amounts=np.array(output_amounts, dtype=np.uint64),
+            output_script_offsets=np.array(output_script_offsets, dtype=np.uint32),
+            output_script_sizes=np.array(output_script_sizes, dtype=np.uint32),
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactBlock(height={self.block_height}, hash={self.block_header.block_hash.hex()}, "
+            f"size={self.size:,}, n_txs={self.n_txs:,}, n_inputs={len(self.input_offsets):,}, "
+            f"n_outputs={len(self.output_amounts):,})"
+        )
@@ -0,0 +1,236 @@
+import base64
+import http.client
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Spawning a bitcoin-cli process for every question costs far more than the
+# question itself, and walking a day of block times asks hundreds of them. This
+# client talks JSON-RPC to the node directly over one keep-alive HTTP connection
+# and can send many calls in a single batch request.
+
+DEFAULT_RPC_HOST = "127.0.0.1"
+DEFAULT_RPC_PORT = 8332
+
+# each network's default rpc port and the data dir subfolder holding its .cookie
+NETWORKS = {
+    "main": (8332, ""),
+    "test": (18332, "testnet3"),
+    "testnet4": (48332, "testnet4"),
+    "signet": (38332, "signet"),
+    "regtest": (18443, "regtest"),
+}
+
+# bitcoind only applies these in the [main] section or the network's own section
+NETWORK_ONLY_SETTINGS = {"rpcport"}
+
+
+class RPCError(Exception):
+    """An error reported by the node (or an HTTP level failure talking to it)."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"RPC error {code}: {message}")
+        self.code = code
+        self.message = message
+
+
+def conf_network(conf_settings: Dict[str, str]) -> str:
+    """Return which network ('main', 'test', 'signet', ...) the conf's node runs on."""
+    network = conf_settings.get("chain")
+    if network is None:
+        flags = {"testnet": "test", "testnet4": "testnet4", "signet": "signet", "regtest": "regtest"}
+        network = next((name for flag, name in flags.items() if conf_settings.get(flag, "0") not in ("", "0")), "main")
+    if network not in NETWORKS:
+        raise ValueError(f"Unknown chain in bitcoin.conf: {network}")
+    return network
+
+
+def conf_setting(conf_settings: Dict[str, str], key: str) -> Optional[str]:
+    """
+    Return a bitcoin.conf setting for the conf's network.
+
+    The network's own section ('section.key') wins over the top of the file, and
+    settings bitcoind only takes from a network's section aren't read from the top
+    of the file for the test networks.
+    """
+    network = conf_network(conf_settings)
+    value = conf_settings.get(f"{network}.{key}")
+    if value is None and (network == "main" or key not in NETWORK_ONLY_SETTINGS):
+        value = conf_settings.get(key)
+    return value
+
+
+def conf_blocks_dir(conf_settings: Dict[str, str], data_dir: str) -> str:
+    """Return the blocks directory of the conf's network: blocksdir, or the network's blocks folder in data_dir."""
+    blocks_dir = conf_setting(conf_settings, "blocksdir")
+    if blocks_dir is None:
+        blocks_dir = os.path.join(data_dir, NETWORKS[conf_network(conf_settings)][1], "blocks")
+    return os.path.expanduser(blocks_dir)
+
+
+def split_host_port(address: str) -> Tuple[str, Optional[int]]:
+    """Split an rpcconnect value like 'host', 'host:port' or '[::1]:port' into its host and port."""
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") else ""
+    elif address.count(":") == 1:
+        host, port = address.split(":")
+    else:
+        host, port = address, ""
+    return host, int(port) if port else None
+
+
+class NodeRPC:
+    """
+    Minimal bitcoind JSON-RPC client with keep-alive and batch requests.
+
+    Args:
+        host: The node's RPC host.
+        port: The node's RPC port.
+        user: rpcuser, if the node uses rpcuser/rpcpassword authentication.
+        password: rpcpassword, if the node uses rpcuser/rpcpassword authentication.
+        cookie_path: The node's .cookie file, used when no user/password is given.
+        timeout: Socket timeout in seconds.
+    """
+
+    def __init__(
+        self,
+        host: str = DEFAULT_RPC_HOST,
+        port: int = DEFAULT_RPC_PORT,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        cookie_path: Optional[str] = None,
+        timeout: float = 120,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.cookie_path = cookie_path
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    @classmethod
+    def from_conf(cls, conf_settings: Dict[str, str], data_dir: str) -> 'NodeRPC':
+        """
+        Build a client from the settings parsed out of bitcoin.conf.
+
+        Settings from a [section] of the conf are expected as 'section.key', and
+        the network's own section wins over the top of the file.
+
+        Args:
+            conf_settings: The conf's key=value settings.
+            data_dir: The node's data dir.
+        """
+        default_port, network_dir = NETWORKS[conf_network(conf_settings)]
+
+        host, port = split_host_port(conf_setting(conf_settings, "rpcconnect") or DEFAULT_RPC_HOST)
+        rpcport = conf_setting(conf_settings, "rpcport")
+        if rpcport is not None:
+            port = int(rpcport)
+
+        # a relative cookie file is relative to the network's own data dir
+        cookie_path = conf_setting(conf_settings, "rpccookiefile") or ".cookie"
+        if not os.path.isabs(cookie_path):
+            cookie_path = os.path.join(data_dir, network_dir, cookie_path)
+        return cls(
+            host=host,
+            port=port or default_port,
+            user=conf_setting(conf_settings, "rpcuser"),
+            password=conf_setting(conf_settings, "rpcpassword"),
+            cookie_path=os.path.expanduser(cookie_path),
+        )
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _auth_header(self) -> str:
+        # the cookie is re-written every time the node restarts, so read it per request
+        if self.user is not None and self.password is not None:
+            credentials = f"{self.user}:{self.password}"
+        elif self.cookie_path and os.path.exists(self.cookie_path):
+            with open(self.cookie_path) as f:
+                credentials = f.read().strip()
+        else:
+            credentials = ""
+        return "Basic " + base64.b64encode(credentials.encode()).decode()
+
+    def _post(self, payload: Any) -> Any:
+        body = json.dumps(payload)
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": self._auth_header(),
+        }
+
+        # retry once on a fresh connection if the node closed the kept-alive one
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._conn.request("POST", "/", body, headers)
+                response = self._conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+        if response.status in (401, 403):
+            raise RPCError(response.status, "authorization failed, check rpcuser/rpcpassword or the .cookie file")
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise RPCError(response.status, data.decode(errors="replace").strip() or response.reason)
+
+    def call(self, method: str, *params: Any) -> Any:
+        """
+        Make one RPC call.
+
+        Args:
+            method: The RPC method, e.g. 'getblockhash'.
+            *params: The method's parameters.
+
+        Returns:
+            The call's result, decoded from JSON.
+        """
+        reply = self._post({"jsonrpc": "1.0", "id": 0, "method": method, "params": list(params)})
+        if reply.get("error"):
+            raise RPCError(reply["error"]["code"], reply["error"]["message"])
+        return reply["result"]
+
+    def batch(self, calls: Iterable[Tuple[str, Sequence[Any]]]) -> List[Any]:
+        """
+        Make many RPC calls in one round trip.
+
+        Args:
+            calls: (method, params) pairs.
+
+        Returns:
+            The results, in the same order as calls.
+        """
+        payload = [
+            {"jsonrpc": "1.0", "id": i, "method": method, "params": list(params)}
+            for i, (method, params) in enumerate(calls)
+        ]
+        if not payload:
+            return []
+
+        replies = self._post(payload)
+        if isinstance(replies, dict):
+            error = replies.get("error") or {"code": -32600, "message": "invalid batch reply"}
+            raise RPCError(error["code"], error["message"])
+
+        results: List[Any] = [None] * len(payload)
+        for reply in replies:
+            if reply.get("error"):
+                raise RPCError(reply["error"]["code"], reply["error"]["message"])
+            results[reply["id"]] = reply["result"]
+        return results
+
+    def get_block_headers(self, heights: Sequence[int]) -> List[Dict[str, Any]]:
+        """Return the verbose block headers at these heights using two batch requests."""
+        block_hashes = self.batch(("getblockhash", [height]) for height in heights)
+        return self.batch(("getblockheader", [block_hash, True]) for block_hash in block_hashes)
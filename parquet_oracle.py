@@ -0,0 +1,201 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+import polars as pl
+
+from backfill import FIRST_PRICE_DATE, parse_date
+from create_outputs_data import PARTITION_BLOCKS
+from header_cache import find_day_blocks
+from price_finder import bin_amounts, estimate_price, output_bins
+
+# UTXOracle.py needs the node and the blk files every time it prices a day. Once
+# create_outputs_data has written the blocks into the dude_data tables, a day can be
+# priced from those alone. The day's blocks are found from the blocks table, then
+# Part 8's filters run as lazy polars scans over txs, inputs and outputs, reading
+# only the partitions (and row groups) of the day's block heights and only the
+# columns used. The blk files also hold stale blocks at the same heights as best
+# chain blocks, so the best chain is first walked back through the blocks' parents
+# and the other tables are read by block_id. The amounts that pass go through the same price finding (Parts 9
+# to 11) as UTXOracle.py, so the price is identical.
+
+DEFAULT_DATA_DIR = "dude_data"
+
+# Part 8's filters
+MAX_INPUTS = 5
+N_OUTPUTS = 2
+MAX_WITNESS_SIZE = 500   # bytes of witness data per input
+MIN_AMOUNT = 1e-5        # btc, exclusive
+MAX_AMOUNT = 1e5         # btc, exclusive
+
+# block times read around a day, enough for the median-time-past and stray timestamps
+DAY_MARGIN = timedelta(hours=12)
+
+# blocks read past a range to see which of two competing blocks the chain builds on
+CHAIN_MARGIN = 6
+
+TX_KEY = ["block_id", "tx_index"]
+
+
+def scan_table(data_dir: str, table: str, first_block: int, last_block: int) -> pl.LazyFrame:
+    """Lazily scan the rows of blocks first_block to last_block (inclusive) of a dude_data table."""
+    return (
+        pl.scan_parquet(os.path.join(data_dir, table, "**", "*.parquet"), hive_partitioning=True)
+        .filter(pl.col("height_bucket").is_between(first_block // PARTITION_BLOCKS, last_block // PARTITION_BLOCKS))
+        .filter(pl.col("block").is_between(first_block, last_block))
+    )
+
+
+def best_chain(data_dir: str, first_block: int, last_block: int) -> pl.DataFrame:
+    """
+    Find the best chain blocks first_block to last_block (inclusive) in the blocks table.
+
+    The chain is walked down from the highest block in the data up to CHAIN_MARGIN
+    blocks past last_block, so a stale block is dropped as soon as a later block
+    builds on its sibling.
+
+    Returns:
+        block, block_id and timestamp (unix seconds) of each height, in height order.
+    """
+    blocks = (
+        scan_table(data_dir, "blocks", first_block, last_block + CHAIN_MARGIN)
+        .select("block", "block_id", "prev_block_id", pl.col("timestamp").dt.epoch("s"))
+        .unique("block_id")
+        .collect()
+    )
+    by_height = {}
+    for row in blocks.iter_rows(named=True):
+        by_height.setdefault(row["block"], []).append(row)
+
+    # the blocks at each height that a kept block at the height above builds on
+    top = max(by_height, default=None)
+    if top is None or top < last_block:
+        raise ValueError(f"the data is missing blocks between {first_block} and {last_block}")
+    kept = by_height[top]
+    chain = []
+    for height in range(top, first_block - 1, -1):
+        if height <= last_block:
+            if len(kept) != 1:
+                raise ValueError(f"the data has {len(kept)} competing blocks at height {height}")
+            chain.append(kept[0])
+        parents = {row["prev_block_id"] for row in kept}
+        kept = [row for row in by_height.get(height - 1, []) if row["block_id"] in parents]
+        if not kept and height > first_block:
+            raise ValueError(f"the data is missing blocks between {first_block} and {last_block}")
+
+    return pl.DataFrame(chain[::-1]).select("block", "block_id", "timestamp")
+
+
+def find_day(data_dir: str, date: datetime) -> Tuple[int, int]:
+    """
+    Find the blocks of a UTC day from the block times in the blocks table.
+
+    Returns:
+        The first and last block height of the day.
+    """
+    blocks = pl.scan_parquet(os.path.join(data_dir, "blocks", "**", "*.parquet"), hive_partitioning=True)
+    near = (
+        blocks
+        .filter(pl.col("timestamp").is_between(date - DAY_MARGIN, date + timedelta(days=1) + DAY_MARGIN))
+        .select(pl.col("block").min().alias("first"), pl.col("block").max().alias("last"))
+        .collect()
+    )
+    first, last = near.row(0)
+    if first is None:
+        raise ValueError(f"the data has no blocks on {date:%Y-%m-%d}")
+
+    times = best_chain(data_dir, first, last)
+    day_blocks = find_day_blocks(times["timestamp"].to_list(), int(date.timestamp()))
+    if day_blocks is None:
+        raise ValueError(f"the data doesn't cover all of {date:%Y-%m-%d}")
+    return first + day_blocks[0], first + day_blocks[1] - 1
+
+
+def filtered_amounts(data_dir: str, first_block: int, last_block: int) -> np.ndarray:
+    """
+    Apply Part 8's filters to the blocks first_block to last_block.
+
+    Returns:
+        The output amounts (btc) of the txs that pass, in block order.
+    """
+    # only the rows of best chain blocks, stale blocks' txs would count twice
+    block_ids = best_chain(data_dir, first_block, last_block).lazy().select("block_id")
+    txs, inputs, outputs = (
+        scan_table(data_dir, table, first_block, last_block).join(block_ids, on="block_id", how="semi")
+        for table in ("txs", "inputs", "outputs")
+    )
+
+    # a tx can only spend earlier txs, so spending any of the range's txids is a same-day spend
+    same_day = inputs.join(txs.select(pl.col("txid").alias("prev_txid")), on="prev_txid", how="semi")
+    witness_exceeds = inputs.filter(pl.col("witness_size") > MAX_WITNESS_SIZE)
+    op_return = outputs.filter(pl.col("is_op_return"))
+
+    candidates = (
+        txs
+        .filter(
+            (pl.col("n_inputs") <= MAX_INPUTS)
+            & (pl.col("n_outputs") == N_OUTPUTS)
+            & ~pl.col("is_coinbase")
+        )
+        .select(TX_KEY)
+        .join(same_day.select(TX_KEY), on=TX_KEY, how="anti")
+        .join(witness_exceeds.select(TX_KEY), on=TX_KEY, how="anti")
+        .join(op_return.select(TX_KEY), on=TX_KEY, how="anti")
+    )
+
+    amounts = (
+        outputs
+        .join(candidates, on=TX_KEY, how="semi")
+        .with_columns((pl.col("amount") / 1e8).alias("btc"))
+        .filter((pl.col("btc") > MIN_AMOUNT) & (pl.col("btc") < MAX_AMOUNT))
+        .sort(["block", "tx_index", "index"])
+        .select("btc")
+        .collect(engine="streaming")
+    )
+    return amounts["btc"].to_numpy()
+
+
+def price_blocks(data_dir: str, first_block: int, last_block: int) -> float:
+    """Price the blocks first_block to last_block (inclusive) as UTXOracle.py would."""
+    raw_outputs = filtered_amounts(data_dir, first_block, last_block)
+    if not len(raw_outputs):
+        raise ValueError(f"the data has no outputs for blocks {first_block} to {last_block}")
+    bins = output_bins()
+    return estimate_price(bin_amounts(raw_outputs, bins), raw_outputs, bins)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Price a day (or block range) from the dude_data parquet tables.")
+    parser.add_argument("-d", "--date", help="UTC date to price, YYYY/MM/DD")
+    parser.add_argument("-b", "--blocks", nargs=2, type=int, metavar=("FIRST", "LAST"),
+                        help="price this block height range instead of a date")
+    parser.add_argument("--data", default=DEFAULT_DATA_DIR, help="the dude_data directory")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        if args.blocks:
+            first_block, last_block = args.blocks
+            label = f"blocks {first_block}-{last_block}"
+        elif args.date:
+            date = parse_date(args.date)
+            if date < FIRST_PRICE_DATE:
+                raise ValueError("the date is before 2023-12-15")
+            first_block, last_block = find_day(args.data, date)
+            label = f"{date:%Y-%m-%d} (blocks {first_block}-{last_block})"
+        else:
+            parser.error("give a date (-d) or a block range (-b)")
+        price = price_blocks(args.data, first_block, last_block)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"{label} price: ${int(price):,} ({time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# The price finding steps after the blocks are read (Parts 7 to 11 of UTXOracle.py)
+# only do arithmetic on a few thousand floats, but written as Python loops they run
+# one float at a time. These are the same steps on numpy arrays. Every result is
+# meant to be identical to the loops, down to the last bit, so that anyone running
+# either version gets the same price. UTXOracle.py and the backfill, rolling and
+# daemon tools all call these, so they can't drift apart.
+
+FIRST_BIN_VALUE = -6    # log10 of the smallest btc amount binned
+LAST_BIN_VALUE = 6      # log10 of the btc amount where binning stops
+BINS_PER_DECADE = 200   # bins in every 10x of btc amounts
+
+# bell curve bins of round btc amounts, smoothed over before looking for usd amounts
+ROUND_BTC_BINS = [
+    201,   # 1k sats
+    401,   # 10k
+    461,   # 20k
+    496,   # 30k
+    540,   # 50k
+    601,   # 100k
+    661,   # 200k
+    696,   # 300k
+    740,   # 500k
+    801,   # 0.01 btc
+    861,   # 0.02
+    896,   # 0.03
+    940,   # 0.04
+    1001,  # 0.1
+    1061,  # 0.2
+    1096,  # 0.3
+    1140,  # 0.5
+    1201,  # 1 btc
+]
+
+# spike stencil element -> popularity of the round usd amount there ($1 to $10k)
+SPIKE_STENCIL_WEIGHTS = {
+    40: 0.001300198324984352,   # $1
+    141: 0.001676746949820743,  # $5
+    201: 0.003468805546942046,  # $10
+    202: 0.001991977522512513,
+    236: 0.001905066647961839,  # $15
+    261: 0.003341772718156079,  # $20
+    262: 0.002588902624584287,
+    296: 0.002577893841190244,  # $30
+    297: 0.002733728814200412,
+    340: 0.003076117748975647,  # $50
+    341: 0.005613067550103145,
+    342: 0.003088253178535568,
+    400: 0.002918457489366139,  # $100
+    401: 0.006174500465286022,
+    402: 0.004417068070043504,
+    403: 0.002628663628020371,
+    436: 0.002858828161543839,  # $150
+    461: 0.004097463611984264,  # $200
+    462: 0.003345917406120509,
+    496: 0.002521467726855856,  # $300
+    497: 0.002784125730361008,
+    541: 0.003792850444811335,  # $500
+    601: 0.003688240815848247,  # $1000
+    602: 0.002392400117402263,
+    636: 0.001280993059008106,  # $1500
+    661: 0.001654665137536031,  # $2000
+    662: 0.001395501347054946,
+    741: 0.001154279140906312,  # $5000
+    801: 0.000832244504868709,  # $10000
+}
+STENCIL_LENGTH = 803
+CENTER_P001 = 601       # bin of 0.001 btc, where a zero slide puts $100 ($100k price)
+MIN_SLIDE = -141        # $500k
+MAX_SLIDE = 201         # $5k
+
+# round usd amounts to collect outputs near, and how near (fraction of the amount)
+USDS = [5, 10, 15, 20, 25, 30, 40, 50, 100, 150, 200, 300, 500, 1000]
+PCT_RANGE_WIDE = .25
+PCT_MICRO_REMOVE = .0001
+PCT_RANGE_TIGHT = .05
+
+
+def output_bins() -> np.ndarray:
+    """
+    Return the lower edge of each bell curve bin in btc: zero, then 200 bins for
+    every 10x from 1e-6 to 1e6 btc.
+
+    The edges are computed exactly as in Part 7 (10 ** (exponent + b/200) in Python
+    floats) so that amounts sitting on an edge land in the same bin.
+    """
+    bins = [0.0]
+    for exponent in range(FIRST_BIN_VALUE, LAST_BIN_VALUE):
+        for b in range(0, BINS_PER_DECADE):
+            bins.append(10 ** (exponent + b / BINS_PER_DECADE))
+    return np.array(bins)
+
+
+def bin_amounts(amounts: Sequence[float], bins: np.ndarray) -> np.ndarray:
+    """
+    Count how many amounts fall in each bin.
+
+    An amount belongs to the last bin whose lower edge is at or below it, which is
+    where Part 8's log10 estimate and correction loop always ends up.
+
+    Args:
+        amounts: Output amounts in btc.
+        bins: Bin lower edges from output_bins().
+
+    Returns:
+        Float counts per bin (same length as bins).
+    """
+    bin_numbers = np.searchsorted(bins, np.asarray(amounts, dtype=np.float64), side='right') - 1
+    return np.bincount(bin_numbers, minlength=len(bins)).astype(np.float64)
+
+
+def stencil_scores(curve: np.ndarray, stencil: Sequence[float], left: int, first_slide: int, stop_slide: int) -> np.ndarray:
+    """
+    Score a stencil at every slide over the bell curve in one pass.
+
+    The score of a slide is sum(curve[left + slide + n] * stencil[n]). Rather than a
+    correlation (which adds the products in another order and can change the last
+    bits), every slide is scored at once and the products are added one stencil
+    element at a time, in the same order as the loop over n. Each slide's score is
+    then bit for bit the loop's. Zero stencil elements add nothing to a finite curve
+    and are skipped, which makes the sparse spike stencil cheap.
+
+    Args:
+        curve: The bell curve bin counts.
+        stencil: The stencil weights.
+        left: Bell curve bin under stencil element 0 at slide 0.
+        first_slide: First slide to score.
+        stop_slide: Slide to stop before.
+
+    Returns:
+        The scores of slides first_slide through stop_slide - 1.
+    """
+    n_slides = stop_slide - first_slide
+    start = left + first_slide
+    scores = np.zeros(n_slides)
+    for n, weight in enumerate(stencil):
+        if weight != 0.0:
+            scores += curve[start + n:start + n + n_slides] * weight
+    return scores
+
+
+def find_central_output(sorted_prices: np.ndarray, price_min: float, price_max: float) -> Tuple[float, float]:
+    """
+    Find the most central price inside a price window and the deviation around it.
+
+    The central price is the one with the smallest total distance to every other
+    price in the window, found with prefix sums. The deviation is the median absolute
+    deviation from it. The window is a slice of prices sorted once up front, so
+    repeated calls while converging on a price don't filter or sort anything.
+
+    Args:
+        sorted_prices: All price points, sorted ascending.
+        price_min: Lower bound of the window (excluded).
+        price_max: Upper bound of the window (excluded).
+
+    Returns:
+        (central price, median absolute deviation)
+    """
+    lo = np.searchsorted(sorted_prices, price_min, side='right')
+    hi = np.searchsorted(sorted_prices, price_max, side='left')
+    outputs = sorted_prices[lo:hi]
+    n = len(outputs)
+
+    # prefix sums (cumsum adds in order, like a running total)
+    prefix_sum = np.cumsum(outputs)
+    total = prefix_sum[-1]
+
+    # count the number of points and their sums left and right of each point
+    left_counts = np.arange(n)
+    right_counts = n - left_counts - 1
+    left_sums = np.concatenate(([0.0], prefix_sum[:-1]))
+    right_sums = total - prefix_sum
+
+    # the total distance to other points, the first smallest is the most central
+    total_dists = (outputs * left_counts - left_sums) + (right_sums - outputs * right_counts)
+    best_output = outputs[np.argmin(total_dists)]
+
+    # median absolute deviation
+    deviations = np.sort(np.abs(outputs - best_output))
+    if n % 2 == 0:
+        mad = (deviations[n // 2 - 1] + deviations[n // 2]) / 2
+    else:
+        mad = deviations[n // 2]
+
+    return float(best_output), float(mad)
+
+
+def round_sat_mask(amounts: np.ndarray, round_amounts: Sequence[float], pct: float) -> np.ndarray:
+    """
+    Flag the amounts within pct of any round satoshi amount.
+
+    Each round amount r excludes the open interval (r - pct*r, r + pct*r). The
+    intervals are sorted by their lower bound once, so an amount is inside one of
+    them exactly when the farthest upper bound among the intervals starting below
+    it is above it.
+
+    Args:
+        amounts: Output amounts in btc.
+        round_amounts: The round satoshi amounts to exclude.
+        pct: Half width of each excluded interval as a fraction of the round amount.
+
+    Returns:
+        A boolean array, True for amounts to exclude.
+    """
+    r = np.asarray(round_amounts, dtype=np.float64)
+    rm_dn = r - pct * r
+    rm_up = r + pct * r
+    order = np.argsort(rm_dn, kind='stable')
+    rm_dn = rm_dn[order]
+    reach = np.maximum.accumulate(rm_up[order])
+
+    k = np.searchsorted(rm_dn, amounts, side='left') - 1
+    return (k >= 0) & (reach[np.maximum(k, 0)] > amounts)
+
+
+def usd_price_points(amounts: np.ndarray, usds: Sequence[int], rough_price: float, pct_range: float,
+                     exclude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert each output near a round usd amount to the btc price that makes it round.
+
+    Args:
+        amounts: Output amounts in btc.
+        usds: The round usd amounts.
+        rough_price: The rough usd price of bitcoin.
+        pct_range: How far (as a fraction) an output may be from a round usd amount.
+        exclude: Outputs to skip, e.g. from round_sat_mask.
+
+    Returns:
+        (output indexes, prices) ordered by output and then by usd amount, so that an
+        output near several usd amounts appears once for each.
+    """
+    usds = np.asarray(usds, dtype=np.float64)
+    avbtc = usds / rough_price
+    btc_up = avbtc + pct_range * avbtc
+    btc_dn = avbtc - pct_range * avbtc
+
+    column = amounts[:, None]
+    near = (btc_dn < column) & (column < btc_up) & ~exclude[:, None]
+
+    # nonzero walks rows first, which is output order then usd order
+    rows, cols = np.nonzero(near)
+    return rows, usds[cols] / amounts[rows]
+
+
+def smooth_stencil() -> List[float]:
+    """Return the smooth stencil: a bell shape over a typical day's outputs plus a slight slope."""
+    mean = 411
+    std_dev = 201
+    stencil = []
+    for x in range(STENCIL_LENGTH):
+        exp_part = -((x - mean) ** 2) / (2 * (std_dev ** 2))
+        stencil.append((.00150 * 2.718281828459045 ** exp_part) + (.0000005 * x))
+    return stencil
+
+
+def spike_stencil() -> List[float]:
+    """Return the spike stencil: the popularity of round usd amounts at their bins."""
+    stencil = [0.0] * STENCIL_LENGTH
+    for n, weight in SPIKE_STENCIL_WEIGHTS.items():
+        stencil[n] = weight
+    return stencil
+
+
+def micro_round_amounts() -> List[float]:
+    """Return the micro round satoshi amounts (5k sats up to 1 btc) excluded from usd outputs."""
+    amounts = []
+    for start, stop, step in ((.00005000, .0001, .00001), (.0001, .001, .00001), (.001, .01, .0001),
+                              (.01, .1, .001), (.1, 1, .01)):
+        i = start
+        while i < stop:
+            amounts.append(i)
+            i += step
+    return amounts
+
+
+def clean_curve(bin_counts: np.ndarray) -> np.ndarray:
+    """
+    Remove non-usd outputs from the bell curve (Part 9 of UTXOracle.py).
+
+    Bins below 10k sats and above 10 btc are zeroed, round btc bins are replaced
+    with the average of their neighbors, and the curve is normalized to sum to one
+    with values capped at 0.008.
+
+    Args:
+        bin_counts: Output counts per bin.
+
+    Returns:
+        A new array with the cleaned curve.
+    """
+    curve = np.array(bin_counts, dtype=np.float64)
+    curve[:201] = 0
+    curve[1601:] = 0
+    for r in ROUND_BTC_BINS:
+        curve[r] = .5 * (curve[r + 1] + curve[r - 1])
+
+    # the sum is added up in bin order, like the loop
+    curve_sum = np.cumsum(curve[201:1601])[-1]
+    curve[201:1601] /= curve_sum
+    curve[201:1601] = np.minimum(curve[201:1601], 0.008)
+    return curve
+
+
+def rough_price(curve: np.ndarray, bins: np.ndarray) -> int:
+    """
+    Estimate a rough price from the best fitting stencil slide (Part 10 of UTXOracle.py).
+
+    Args:
+        curve: The cleaned bell curve from clean_curve().
+        bins: Bin lower edges from output_bins().
+
+    Returns:
+        The rough usd price, weighted between the best slide and its best neighbor.
+    """
+    left = CENTER_P001 - int((STENCIL_LENGTH + 1) / 2)
+    smooth_scores = stencil_scores(curve, smooth_stencil(), left, MIN_SLIDE, MAX_SLIDE)
+    spike_scores = stencil_scores(curve, spike_stencil(), left, MIN_SLIDE - 1, MAX_SLIDE + 1)
+    slides = np.arange(MIN_SLIDE, MAX_SLIDE)
+
+    # neglect the smooth stencil over the wrong regions
+    slide_scores = spike_scores[1:-1]
+    slide_scores = np.where(slides < 150, slide_scores + smooth_scores * .65, slide_scores)
+
+    best_slide = 0
+    best_slide_score = 0
+    best_index = int(np.argmax(slide_scores))
+    if slide_scores[best_index] > best_slide_score:
+        best_slide_score = float(slide_scores[best_index])
+        best_slide = int(slides[best_index])
+    total_score = float(np.cumsum(slide_scores)[-1])
+    btc_in_usd_best = 100 / float(bins[CENTER_P001 + best_slide])
+
+    # the better scoring neighbor of the best slide
+    neighbor_up_score = float(spike_scores[best_slide - MIN_SLIDE + 2])
+    neighbor_down_score = float(spike_scores[best_slide - MIN_SLIDE])
+    best_neighbor = +1
+    neighbor_score = neighbor_up_score
+    if neighbor_down_score > neighbor_up_score:
+        best_neighbor = -1
+        neighbor_score = neighbor_down_score
+    btc_in_usd_2nd = 100 / float(bins[CENTER_P001 + best_slide + best_neighbor])
+
+    # weight average the two usd price estimates
+    avg_score = total_score / len(slides)
+    a1 = best_slide_score - avg_score
+    a2 = abs(neighbor_score - avg_score)
+    w1 = a1 / (a1 + a2)
+    w2 = a2 / (a1 + a2)
+    return int(w1 * btc_in_usd_best + w2 * btc_in_usd_2nd)
+
+
+def central_price(sorted_prices: np.ndarray, rough: float) -> float:
+    """
+    Find the central price of the day's price points around a rough price (Part 11 of UTXOracle.py).
+
+    Args:
+        sorted_prices: All price points, sorted ascending.
+        rough: The rough price from rough_price().
+
+    Returns:
+        The central price.
+    """
+    price_up = rough + PCT_RANGE_TIGHT * rough
+    price_dn = rough - PCT_RANGE_TIGHT * rough
+    price, _ = find_central_output(sorted_prices, price_dn, price_up)
+
+    # re-center the bounds and find a new center until it repeats
+    avs = set()
+    avs.add(price)
+    while price not in avs:
+        avs.add(price)
+        price_up = price + PCT_RANGE_TIGHT * price
+        price_dn = price - PCT_RANGE_TIGHT * price
+        price, _ = find_central_output(sorted_prices, price_dn, price_up)
+    return price
+
+
+def estimate_price(bin_counts: np.ndarray, raw_outputs: Sequence[float], bins: np.ndarray) -> float:
+    """
+    Run the whole price finding pipeline on one day's outputs.
+
+    Gives the same price as UTXOracle.py for the same blocks.
+
+    Args:
+        bin_counts: Output counts per bin, e.g. summed from bin_amounts().
+        raw_outputs: Every binned output amount (btc), in block order.
+        bins: Bin lower edges from output_bins().
+
+    Returns:
+        The central usd price.
+    """
+    curve = clean_curve(bin_counts)
+    rough = rough_price(curve, bins)
+
+    amounts = np.asarray(raw_outputs, dtype=np.float64)
+    exclude = round_sat_mask(amounts, micro_round_amounts(), PCT_MICRO_REMOVE)
+    _, prices = usd_price_points(amounts, USDS, rough, PCT_RANGE_WIDE, exclude)
+    return central_price(np.sort(prices), rough)
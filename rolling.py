@@ -0,0 +1,254 @@
+import argparse
+import logging
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backfill import default_data_dir, read_conf
+from block_cache import BlockCache
+from block_index import BlockIndex, list_blk_files
+from block_reader import BlockOutputs, CandidateTx, parse_blocks
+from node_rpc import NodeRPC, RPCError, conf_blocks_dir
+from price_finder import bin_amounts, estimate_price, output_bins
+
+# UTXOracle.py -rb prices the last 144 blocks from scratch every time it runs. In
+# rolling mode the window is kept in memory instead: a new block adds its outputs
+# to the bell curve and the oldest block's outputs are taken out, so only the
+# price finding steps run again on each block.
+#
+# The same-day filter makes this a little subtle. A tx spending an output created
+# inside the window is left out, but once the block holding that output slides out
+# of the window the tx counts again. So every tx held back is remembered under the
+# newest window block it spends from, and is let in when that block is evicted.
+# The outputs in the window are then exactly those a fresh -rb run would find.
+
+logger = logging.getLogger(__name__)
+
+WINDOW_BLOCKS = 144
+RECENT_BLK_FILES = 10  # blk files searched first when the index has never been built
+
+
+@dataclass
+class WindowBlock:
+    height: int
+    block_hash: str
+    outputs: BlockOutputs
+    accepted: Dict[int, List[float]] = field(default_factory=dict)  # tx index -> amounts
+
+
+class RollingWindow:
+    """
+    The outputs of a window of consecutive blocks, kept up to date as blocks are
+    added at the top and evicted at the bottom.
+
+    Args:
+        bins: Bin lower edges from output_bins().
+    """
+
+    def __init__(self, bins: Optional[np.ndarray] = None):
+        self.bins = output_bins() if bins is None else bins
+        self.blocks: Deque[WindowBlock] = deque()
+        self.bin_counts = np.zeros(len(self.bins))
+        self._txid_heights: Dict[bytes, int] = {}
+        self._held: Dict[int, List[Tuple[WindowBlock, CandidateTx]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def reset(self) -> None:
+        self.blocks.clear()
+        self.bin_counts[:] = 0
+        self._txid_heights.clear()
+        self._held.clear()
+
+    def _accept(self, block: WindowBlock, candidate: CandidateTx) -> None:
+        block.accepted[candidate.tx_index] = candidate.amounts
+        self.bin_counts += bin_amounts(candidate.amounts, self.bins)
+
+    def push(self, height: int, block_hash: str, outputs: BlockOutputs) -> None:
+        """Add the block following the top of the window."""
+        if self.blocks and height != self.blocks[-1].height + 1:
+            raise ValueError(f"block {height} doesn't follow the window top {self.blocks[-1].height}")
+        block = WindowBlock(height, block_hash, outputs)
+        self.blocks.append(block)
+        for txid in outputs.iter_txids():
+            self._txid_heights[txid] = height
+
+        # a tx can only spend outputs of earlier txs, so any input found in the
+        # window (this block included) is a same-window spend
+        for candidate in outputs.candidates:
+            spent_heights = [
+                self._txid_heights[txid] for txid in candidate.input_txids if txid in self._txid_heights
+            ]
+            if spent_heights:
+                self._held.setdefault(max(spent_heights), []).append((block, candidate))
+            else:
+                self._accept(block, candidate)
+
+    def evict(self) -> WindowBlock:
+        """Remove the bottom block of the window and let in the txs it was holding back."""
+        block = self.blocks.popleft()
+        for txid in block.outputs.iter_txids():
+            if self._txid_heights.get(txid) == block.height:
+                del self._txid_heights[txid]
+        for amounts in block.accepted.values():
+            self.bin_counts -= bin_amounts(amounts, self.bins)
+
+        # held txs spend nothing newer than this block, so nothing in the window now
+        for owner, candidate in self._held.pop(block.height, []):
+            if owner is not block:
+                self._accept(owner, candidate)
+        return block
+
+    def raw_outputs(self) -> List[float]:
+        """Every accepted amount in block order (and tx order within a block)."""
+        raw_outputs = []
+        for block in self.blocks:
+            for tx_index in sorted(block.accepted):
+                raw_outputs.extend(block.accepted[tx_index])
+        return raw_outputs
+
+    def price(self) -> float:
+        return estimate_price(self.bin_counts, self.raw_outputs(), self.bins)
+
+    def sync(self, wanted: Sequence[Tuple[int, str]], load_blocks) -> int:
+        """
+        Slide the window onto the wanted blocks.
+
+        Blocks still wanted stay, blocks below the wanted range are evicted and new
+        blocks are pushed. If a wanted block differs from the one in the window (a
+        reorg) the window is rebuilt.
+
+        Args:
+            wanted: (height, hash) of the blocks the window should hold, in height order.
+            load_blocks: Returns the BlockOutputs of a list of block hashes.
+
+        Returns:
+            The number of blocks pushed.
+        """
+        wanted_hashes = dict(wanted)
+        first_height = wanted[0][0]
+        for block in self.blocks:
+            if block.height >= first_height and wanted_hashes.get(block.height) != block.block_hash:
+                self.reset()
+                break
+        if self.blocks and self.blocks[-1].height < first_height - 1:
+            self.reset()
+
+        while self.blocks and self.blocks[0].height < first_height:
+            self.evict()
+
+        top = self.blocks[-1].height if self.blocks else first_height - 1
+        to_push = [(height, block_hash) for height, block_hash in wanted if height > top]
+        for (height, block_hash), outputs in zip(to_push, load_blocks([bh for _, bh in to_push])):
+            self.push(height, block_hash, outputs)
+        return len(to_push)
+
+
+class BlockLoader:
+    """
+    Load parsed blocks by hash from the block cache, parsing the ones not cached yet.
+
+    Args:
+        blocks_dir: The node's blocks directory.
+        processes: Number of processes parsing blocks.
+    """
+
+    def __init__(self, blocks_dir: str, processes: int = 1):
+        self.blocks_dir = blocks_dir
+        self.processes = processes
+
+    def __call__(self, block_hashes: List[str]) -> List[BlockOutputs]:
+        with BlockCache() as block_cache:
+            found = block_cache.load(block_hashes)
+            missing = [block_hash for block_hash in block_hashes if block_hash not in found]
+            if missing:
+                with BlockIndex(self.blocks_dir) as block_index:
+                    # recent blocks are in the last few files, so a cold index starts there
+                    first_file = list_blk_files(self.blocks_dir)[-1] - RECENT_BLK_FILES
+                    locations = block_index.find_blocks(missing, first_file)
+                if len(locations) != len(missing):
+                    raise ValueError("some blocks are not in the blk files yet")
+                parsed = parse_blocks(
+                    self.blocks_dir, [(locations[bh].file, locations[bh].offset) for bh in missing], self.processes
+                )
+                new_blocks = dict(zip(missing, parsed))
+                block_cache.store(new_blocks)
+                found.update(new_blocks)
+        return [found[block_hash] for block_hash in block_hashes]
+
+
+def window_blocks(node: NodeRPC, window: int = WINDOW_BLOCKS) -> List[Tuple[int, str]]:
+    """Return (height, hash) of the blocks -rb prices: the window below the tip."""
+    block_count = node.call("getblockcount")
+    heights = list(range(block_count - window, block_count))
+    block_hashes = node.batch(("getblockhash", [height]) for height in heights)
+    return list(zip(heights, block_hashes))
+
+
+def run(data_dir: str, interval: float = 10, processes: int = 1, once: bool = False) -> None:
+    """
+    Print a new price every time the node has a new block.
+
+    Args:
+        data_dir: The node's data directory (holding bitcoin.conf).
+        interval: Seconds between asking the node for its block count.
+        processes: Number of processes parsing blocks.
+        once: Print the current price and return.
+    """
+    conf_settings = read_conf(data_dir)
+    blocks_dir = conf_blocks_dir(conf_settings, data_dir)
+    node = NodeRPC.from_conf(conf_settings, data_dir)
+    load_blocks = BlockLoader(blocks_dir, processes)
+    rolling_window = RollingWindow()
+
+    last_top = None
+    while True:
+        try:
+            wanted = window_blocks(node)
+        except (RPCError, OSError) as e:
+            logger.warning(f"Couldn't reach the node: {e}")
+            wanted = None
+
+        if wanted and wanted[-1] != last_top:
+            started = time.perf_counter()
+            pushed = rolling_window.sync(wanted, load_blocks)
+            price = rolling_window.price()
+            last_top = wanted[-1]
+            now = datetime.now(timezone.utc)
+            print(
+                f"{now:%Y-%m-%d %H:%M:%S} blocks {wanted[0][0]}-{wanted[-1][0]} price ${int(price):,} "
+                f"({pushed} new, {time.perf_counter() - started:.2f}s)",
+                flush=True,
+            )
+
+        if once:
+            return
+        time.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Keep the -rb price of the last 144 blocks updated on every block.")
+    parser.add_argument("-p", "--data-dir", default=default_data_dir(), help="the node's data directory")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="number of processes parsing blocks")
+    parser.add_argument("-i", "--interval", type=float, default=10, help="seconds between checks for a new block")
+    parser.add_argument("--once", action="store_true", help="print the current price and exit")
+    args = parser.parse_args(argv)
+
+    try:
+        run(args.data_dir, args.interval, args.processes, args.once)
+    except KeyboardInterrupt:
+        pass
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    main()
@@ -0,0 +1,26 @@
+import pytest
+
+import backfill
+from node_rpc import RPCError
+
+
+def run_main(argv, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        backfill.main(argv)
+    assert exit_info.value.code == 1
+    return capsys.readouterr().out
+
+
+def test_missing_conf_is_reported(tmp_path, capsys):
+    out = run_main(["-s", "2024/01/01", "-e", "2024/01/01", "-p", str(tmp_path)], capsys)
+    assert out.startswith("Error: ") and "bitcoin.conf" in out
+
+
+def test_node_error_is_reported(tmp_path, capsys, monkeypatch):
+    def backfill_before_first_block(*args):
+        raise RPCError(-8, "Block height out of range")
+        yield
+
+    monkeypatch.setattr(backfill, "backfill", backfill_before_first_block)
+    out = run_main(["-s", "2008/01/01", "-e", "2008/01/01", "-p", str(tmp_path)], capsys)
+    assert out == "Error: RPC error -8: Block height out of range\n"
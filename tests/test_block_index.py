@@ -0,0 +1,36 @@
+import pytest
+
+from block_index import BlockIndex, blk_file_name
+
+
+@pytest.fixture
+def block_index(tmp_path):
+    """A BlockIndex over blk00000-blk00019 where block 'bN' is found in file N once that file is indexed."""
+    blocks_dir = tmp_path / "blocks"
+    blocks_dir.mkdir()
+    for file_num in range(20):
+        (blocks_dir / blk_file_name(file_num)).write_bytes(b"")
+
+    index = BlockIndex(str(blocks_dir), str(tmp_path / "index.db"))
+    index.updates = []
+    index.update = lambda first_file=0, progress=None: index.updates.append(first_file)
+    index.lookup = lambda block_hashes: {
+        block_hash: int(block_hash[1:]) for block_hash in block_hashes if index.updates[-1] <= int(block_hash[1:]) < 20
+    }
+    yield index
+    index.close()
+
+
+def test_recent_blocks_need_one_update(block_index):
+    assert block_index.find_blocks(["b17", "b18"], 16) == {"b17": 17, "b18": 18}
+    assert block_index.updates == [16]
+
+
+def test_older_blocks_step_back_a_window_at_a_time(block_index):
+    assert block_index.find_blocks(["b9", "b18"], 16) == {"b9": 9, "b18": 18}
+    assert block_index.updates == [16, 12, 8]
+
+
+def test_missing_blocks_stop_at_the_first_file(block_index):
+    assert block_index.find_blocks(["b18", "b25"], 16) == {"b18": 18}
+    assert block_index.updates == [16, 12, 8, 4, 0]
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import daemon
+from block_reader import BlockOutputs
+from header_cache import HeaderCache
+from node_rpc import RPCError
+
+FIRST_HEIGHT = 1000
+DAY_1 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeNode:
+    """A node with a block every 10 minutes from 4 hours before DAY_1 (at 5 past), whose tip can be moved."""
+
+    def __init__(self, n_blocks):
+        start = int(DAY_1.timestamp()) - 4 * 3600 + 300
+        self.times = [start + 600 * i for i in range(n_blocks)]
+        self.tip = FIRST_HEIGHT + n_blocks - 1
+        self.fail = False
+
+    def _check(self):
+        if self.fail:
+            raise RPCError(-28, "Loading block index")
+
+    def call(self, method, *params):
+        self._check()
+        assert method == "getblockcount"
+        return self.tip
+
+    def batch(self, calls):
+        self._check()
+        return [f"{params[0]:064x}" for method, params in calls]
+
+    def get_block_headers(self, heights):
+        self._check()
+        return [{"time": self.times[height - FIRST_HEIGHT], "hash": f"{height:064x}"} for height in heights]
+
+
+class FakeDay:
+    """Prices a day as its first block height, or fails while the day is in failing_days."""
+
+    failing_days = set()
+
+    def __init__(self, date, heights):
+        self.date = date
+        self.heights = heights
+        self.parsed = {}
+
+    def price(self, bins):
+        if self.date in FakeDay.failing_days:
+            raise ValueError("no outputs")
+        return float(self.heights[0])
+
+
+@pytest.fixture
+def make_daemon(tmp_path, monkeypatch):
+    monkeypatch.setattr(daemon, "HeaderCache", lambda: HeaderCache(str(tmp_path / "index.db")))
+    monkeypatch.setattr(daemon, "DayAccumulator", FakeDay)
+    FakeDay.failing_days = set()
+
+    def make(node):
+        published = []
+        price_daemon = daemon.PriceDaemon(
+            node, str(tmp_path), publish=lambda *day: published.append(day), next_day=DAY_1
+        )
+        price_daemon.load_blocks = lambda block_hashes: [BlockOutputs() for _ in block_hashes]
+        return price_daemon, published
+
+    return make
+
+
+def blocks_of_day(day):
+    first = FIRST_HEIGHT + 24 + 144 * day
+    return first, first + 143
+
+
+def test_publishes_each_day_once_final(make_daemon):
+    node = FakeNode(24 + 144 + 3)  # the consensus block is still on day 1
+    price_daemon, published = make_daemon(node)
+    price_daemon.run([None])
+    assert published == []
+
+    node.times += [node.times[-1] + 600 * i for i in range(1, 147)]
+    node.tip += 146  # the consensus block is on day 2
+    price_daemon.run([None, None])
+    assert published == [(DAY_1, float(blocks_of_day(0)[0]), *blocks_of_day(0))]
+
+
+def test_unpriced_day_is_retried(make_daemon):
+    node = FakeNode(24 + 3 * 144 + 20)
+    price_daemon, published = make_daemon(node)
+    FakeDay.failing_days = {DAY_1 + timedelta(days=1)}
+
+    price_daemon.run([])
+    assert [day[0] for day in published] == [DAY_1]
+    assert price_daemon.next_day == DAY_1 + timedelta(days=1)
+
+    FakeDay.failing_days = set()
+    price_daemon.run([None])
+    assert [day[0] for day in published] == [DAY_1, DAY_1 + timedelta(days=1), DAY_1 + timedelta(days=2)]
+
+
+def test_missing_day_blocks_are_retried(make_daemon, monkeypatch):
+    node = FakeNode(24 + 144 + 20)
+    price_daemon, published = make_daemon(node)
+    day_blocks = HeaderCache.day_blocks
+    headers_missing = True
+    monkeypatch.setattr(
+        HeaderCache, "day_blocks", lambda self, day_start: None if headers_missing else day_blocks(self, day_start)
+    )
+
+    price_daemon.run([])
+    assert published == []
+    assert price_daemon.next_day == DAY_1
+
+    headers_missing = False
+    price_daemon.run([None])
+    assert [day[0] for day in published] == [DAY_1]
+
+
+def test_node_errors_dont_stop_the_daemon(make_daemon):
+    node = FakeNode(24 + 144 + 20)
+    node.fail = True
+    price_daemon, published = make_daemon(node)
+
+    def notifications():
+        yield None
+        node.fail = False
+        yield None
+
+    price_daemon.run(notifications())
+    assert [day[0] for day in published] == [DAY_1]
@@ -0,0 +1,38 @@
+import random
+
+from header_cache import HeaderCache, find_day_blocks, median_time_past
+
+DAY_START = 1704067200  # 2024-01-01
+
+
+def chain(n_blocks, seed=1):
+    """Block times a day either side of DAY_START, jittered so they aren't monotonic."""
+    rng = random.Random(seed)
+    start = DAY_START - 144 * 600
+    return [start + 600 * i + rng.randint(-3600, 3600) for i in range(n_blocks)]
+
+
+def test_mtp_kept_in_step(tmp_path):
+    times = chain(500)
+
+    def get_block_times(heights):
+        return [(times[height], f"{height:064x}") for height in heights]
+
+    cache = HeaderCache(str(tmp_path / "index.db"))
+    cache.extend(get_block_times, 300, 320)
+    cache.extend(get_block_times, 295, 320)  # fewer new blocks than the window
+    cache.extend(get_block_times, 10, 450)
+    assert cache.mtp == median_time_past(cache.times)
+
+    cache.verify(get_block_times, tip_height=400)
+    assert cache.mtp == median_time_past(cache.times)
+    assert cache.day_blocks(DAY_START) == tuple(10 + i for i in find_day_blocks(times[10:401], DAY_START))
+    cache.close()
+
+    cache = HeaderCache(str(tmp_path / "index.db"))
+    assert cache.mtp == median_time_past(times[10:401])
+
+
+def test_median_time_past_range():
+    times = chain(100)
+    assert median_time_past(times, 20, 50) == median_time_past(times)[20:50]
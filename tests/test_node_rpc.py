@@ -0,0 +1,110 @@
+import base64
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from backfill import read_conf
+from node_rpc import NodeRPC, conf_blocks_dir
+
+
+class StubNode(BaseHTTPRequestHandler):
+    """Answers getblockcount with 42 and records the credentials it was sent."""
+
+    protocol_version = "HTTP/1.1"
+    credentials = []
+
+    def do_POST(self):
+        auth = self.headers["Authorization"].split()[1]
+        StubNode.credentials.append(base64.b64decode(auth).decode())
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        assert request["method"] == "getblockcount"
+        body = json.dumps({"result": 42, "error": None, "id": request["id"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_node():
+    server = HTTPServer(("127.0.0.1", 0), StubNode)
+    StubNode.credentials = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def node_from_conf(tmp_path, conf):
+    (tmp_path / "bitcoin.conf").write_text(conf)
+    return NodeRPC.from_conf(read_conf(str(tmp_path)), str(tmp_path))
+
+
+@pytest.mark.parametrize("conf, port", [
+    ("", 8332),
+    ("testnet=1\n", 18332),
+    ("signet=1\n", 38332),
+    ("regtest=1\n", 18443),
+    ("chain=regtest\n", 18443),
+    ("rpcport=9000\n", 9000),
+    ("regtest=1\nrpcport=9000\n", 18443),  # the top of the file doesn't set a test network's port
+    ("regtest=1\n[regtest]\nrpcport=9000\n", 9000),
+    ("[main]\nrpcport=9000\n", 9000),
+    ("signet=1\n[main]\nrpcport=9000\n", 38332),
+    ("rpcconnect=10.0.0.2:9000\n", 9000),
+    ("rpcconnect=10.0.0.2:9000\nrpcport=9001\n", 9001),
+])
+def test_port(tmp_path, conf, port):
+    assert node_from_conf(tmp_path, conf).port == port
+
+
+@pytest.mark.parametrize("rpcconnect, host, port", [
+    ("10.0.0.2", "10.0.0.2", 8332),
+    ("node.local:9000", "node.local", 9000),
+    ("::1", "::1", 8332),
+    ("[::1]:9000", "::1", 9000),
+])
+def test_rpcconnect(tmp_path, rpcconnect, host, port):
+    node = node_from_conf(tmp_path, f"rpcconnect={rpcconnect}\n")
+    assert (node.host, node.port) == (host, port)
+
+
+@pytest.mark.parametrize("conf, blocks_dir", [
+    ("", "blocks"),
+    ("testnet=1\n", "testnet3/blocks"),
+    ("chain=signet\n", "signet/blocks"),
+    ("blocksdir=/mnt/blocks\n", "/mnt/blocks"),
+    ("regtest=1\nblocksdir=/mnt/blocks\n", "/mnt/blocks"),
+    ("regtest=1\nblocksdir=/mnt/blocks\n[regtest]\nblocksdir=/mnt/regtest\n", "/mnt/regtest"),
+])
+def test_blocks_dir(tmp_path, conf, blocks_dir):
+    (tmp_path / "bitcoin.conf").write_text(conf)
+    assert conf_blocks_dir(read_conf(str(tmp_path)), str(tmp_path)) == os.path.join(str(tmp_path), blocks_dir)
+
+
+def test_unknown_chain(tmp_path):
+    with pytest.raises(ValueError):
+        node_from_conf(tmp_path, "chain=nonsense\n")
+
+
+def test_network_section_reaches_node(tmp_path, stub_node):
+    (tmp_path / "regtest").mkdir()
+    (tmp_path / "regtest" / ".cookie").write_text("__cookie__:regtest")
+    node = node_from_conf(tmp_path, f"regtest=1\nrpcuser=main\n[regtest]\nrpcconnect=127.0.0.1:{stub_node}\n")
+    assert node.call("getblockcount") == 42
+    assert StubNode.credentials == ["__cookie__:regtest"]
+
+    node = node_from_conf(
+        tmp_path,
+        f"regtest=1\nrpcconnect=127.0.0.1\n[regtest]\nrpcport={stub_node}\nrpcuser=alice\nrpcpassword=secret\n",
+    )
+    assert node.call("getblockcount") == 42
+    assert StubNode.credentials[-1] == "alice:secret"
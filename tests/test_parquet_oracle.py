@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from create_outputs_data import SCHEMAS
+from parquet_oracle import best_chain, filtered_amounts
+
+FIRST_TIME = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def block_id(name):
+    return name.encode().ljust(32, b"\x00")
+
+
+def write_chain(data_dir, blocks):
+    """
+    Write dude_data tables for blocks given as (name, parent name, height, output amounts);
+    each block holds a coinbase and one 1-input 2-output tx paying those amounts.
+    """
+    rows = {table: [] for table in SCHEMAS}
+    for name, parent, height, amounts in blocks:
+        key = {"block_id": block_id(name), "block": height}
+        rows["blocks"].append({**key, "prev_block_id": block_id(parent), "n_txs": 2,
+                               "timestamp": datetime.fromtimestamp(FIRST_TIME + 600 * height, timezone.utc)})
+        for tx_index, is_coinbase in enumerate((True, False)):
+            rows["txs"].append({**key, "tx_index": tx_index, "txid": block_id(f"{name}-tx{tx_index}"),
+                                "n_inputs": 1, "n_outputs": 2, "locktime": 0,
+                                "is_coinbase": is_coinbase, "witness_size": 0})
+            rows["inputs"].append({**key, "tx_index": tx_index, "index": 0, "prev_txid": block_id("earlier"),
+                                   "prev_vout": 0, "script_size": 0, "witness_size": 0})
+            for index, amount in enumerate(amounts):
+                rows["outputs"].append({**key, "tx_index": tx_index, "index": index, "amount": amount,
+                                        "script_size": 22, "is_op_return": False})
+    for table, schema in SCHEMAS.items():
+        path = data_dir / table / "height_bucket=0"
+        path.mkdir(parents=True)
+        pq.write_table(pa.Table.from_pylist(rows[table], schema=schema), path / "part-0.parquet")
+
+
+@pytest.fixture
+def forked_data(tmp_path):
+    # 101b is stale: 102 builds on 101a
+    write_chain(tmp_path, [
+        ("100", "99", 100, [100_000, 200_000]),
+        ("101a", "100", 101, [300_000, 400_000]),
+        ("101b", "100", 101, [500_000, 600_000]),
+        ("102", "101a", 102, [700_000, 800_000]),
+    ])
+    return str(tmp_path)
+
+
+def test_best_chain_drops_stale_blocks(forked_data):
+    chain = best_chain(forked_data, 100, 102)
+    assert chain["block"].to_list() == [100, 101, 102]
+    assert chain["block_id"].to_list() == [block_id("100"), block_id("101a"), block_id("102")]
+
+
+def test_competing_tip_is_an_error(tmp_path):
+    write_chain(tmp_path, [
+        ("100", "99", 100, [100_000, 200_000]),
+        ("101a", "100", 101, [300_000, 400_000]),
+        ("101b", "100", 101, [500_000, 600_000]),
+    ])
+    assert best_chain(str(tmp_path), 100, 100)["block_id"].to_list() == [block_id("100")]
+    with pytest.raises(ValueError, match="2 competing blocks at height 101"):
+        best_chain(str(tmp_path), 100, 101)
+
+
+def test_stale_block_outputs_are_left_out(forked_data):
+    assert filtered_amounts(forked_data, 100, 102).tolist() == [.001, .002, .003, .004, .007, .008]
@@ -0,0 +1,248 @@
+from math import log10
+
+import numpy as np
+import pytest
+
+from price_finder import (
+    CENTER_P001,
+    FIRST_BIN_VALUE,
+    LAST_BIN_VALUE,
+    MAX_SLIDE,
+    MIN_SLIDE,
+    PCT_MICRO_REMOVE,
+    PCT_RANGE_TIGHT,
+    PCT_RANGE_WIDE,
+    ROUND_BTC_BINS,
+    STENCIL_LENGTH,
+    USDS,
+    bin_amounts,
+    clean_curve,
+    estimate_price,
+    find_central_output,
+    micro_round_amounts,
+    output_bins,
+    round_sat_mask,
+    smooth_stencil,
+    spike_stencil,
+    stencil_scores,
+    usd_price_points,
+)
+
+# The loops below are Parts 8 to 11 of UTXOracle.py as they were before the
+# price finding moved to numpy. The numpy versions must give the same results,
+# bit for bit, on the same day.
+
+PRICE = 43000
+
+
+@pytest.fixture(scope="module")
+def amounts():
+    """A synthetic day of output amounts (btc): random amounts, round usd amounts and round sat amounts."""
+    rng = np.random.default_rng(7)
+    sats = [rng.lognormal(np.log(2e6), 2.5, 3000)]
+    usd_amounts = rng.choice(USDS, 1500)
+    sats.append(usd_amounts / PRICE * 1e8 * rng.normal(1, .01, len(usd_amounts)))
+    sats.append(rng.choice([10_000, 50_000, 100_000, 1_000_000, 10_000_000], 500))
+    sats = np.concatenate(sats)
+    sats = sats[(sats >= 1e4) & (sats < 1e9)].astype(np.int64)
+    return [float(s) / 1e8 for s in sats]
+
+
+@pytest.fixture(scope="module")
+def curve(amounts):
+    return clean_curve(bin_amounts(amounts, output_bins()))
+
+
+def loop_bin_counts(amounts):
+    output_bell_curve_bins = output_bins().tolist()
+    number_of_bins = len(output_bell_curve_bins)
+    output_bell_curve_bin_counts = [0.0] * number_of_bins
+    for amount in amounts:
+        amount_log = log10(amount)
+        percent_in_range = (amount_log - FIRST_BIN_VALUE) / (LAST_BIN_VALUE - FIRST_BIN_VALUE)
+        bin_number_est = int(percent_in_range * number_of_bins)
+        while output_bell_curve_bins[bin_number_est] <= amount:
+            bin_number_est += 1
+        bin_number = bin_number_est - 1
+        output_bell_curve_bin_counts[bin_number] += 1.0
+    return output_bell_curve_bin_counts
+
+
+def loop_clean_curve(output_bell_curve_bin_counts):
+    curve = list(output_bell_curve_bin_counts)
+    for n in range(0, 201):
+        curve[n] = 0
+    for n in range(1601, len(curve)):
+        curve[n] = 0
+    for r in ROUND_BTC_BINS:
+        curve[r] = .5 * (curve[r + 1] + curve[r - 1])
+    curve_sum = 0.0
+    for n in range(201, 1601):
+        curve_sum += curve[n]
+    for n in range(201, 1601):
+        curve[n] /= curve_sum
+        if curve[n] > 0.008:
+            curve[n] = 0.008
+    return curve
+
+
+def loop_slide_scores(curve, stencil):
+    left_p001 = CENTER_P001 - int((STENCIL_LENGTH + 1) / 2)
+    right_p001 = CENTER_P001 + int((STENCIL_LENGTH + 1) / 2)
+    scores = []
+    for slide in range(MIN_SLIDE - 1, MAX_SLIDE + 1):
+        shifted_curve = curve[left_p001 + slide:right_p001 + slide]
+        slide_score = 0.0
+        for n in range(0, len(stencil)):
+            slide_score += shifted_curve[n] * stencil[n]
+        scores.append(slide_score)
+    return scores
+
+
+def loop_rough_price(curve):
+    bins = output_bins().tolist()
+    smooth_scores = loop_slide_scores(curve, smooth_stencil())[1:-1]
+    spike_scores = loop_slide_scores(curve, spike_stencil())
+    best_slide = 0
+    best_slide_score = 0
+    total_score = 0
+    for i, slide in enumerate(range(MIN_SLIDE, MAX_SLIDE)):
+        slide_score = spike_scores[i + 1]
+        if slide < 150:
+            slide_score = slide_score + smooth_scores[i] * .65
+        if slide_score > best_slide_score:
+            best_slide_score = slide_score
+            best_slide = slide
+        total_score += slide_score
+    btc_in_usd_best = 100 / (bins[CENTER_P001 + best_slide])
+
+    neighbor_up_score = spike_scores[best_slide - MIN_SLIDE + 2]
+    neighbor_down_score = spike_scores[best_slide - MIN_SLIDE]
+    best_neighbor = +1
+    neighbor_score = neighbor_up_score
+    if neighbor_down_score > neighbor_up_score:
+        best_neighbor = -1
+        neighbor_score = neighbor_down_score
+    btc_in_usd_2nd = 100 / (bins[CENTER_P001 + best_slide + best_neighbor])
+
+    avg_score = total_score / len(range(MIN_SLIDE, MAX_SLIDE))
+    a1 = best_slide_score - avg_score
+    a2 = abs(neighbor_score - avg_score)
+    w1 = a1 / (a1 + a2)
+    w2 = a2 / (a1 + a2)
+    return int(w1 * btc_in_usd_best + w2 * btc_in_usd_2nd)
+
+
+def loop_output_prices(raw_outputs, rough_price_estimate):
+    micro_remove_list = micro_round_amounts()
+    output_prices = []
+    for n in raw_outputs:
+        for usd in USDS:
+            avbtc = usd / rough_price_estimate
+            btc_up = avbtc + PCT_RANGE_WIDE * avbtc
+            btc_dn = avbtc - PCT_RANGE_WIDE * avbtc
+            if btc_dn < n < btc_up:
+                append = True
+                for r in micro_remove_list:
+                    rm_dn = r - PCT_MICRO_REMOVE * r
+                    rm_up = r + PCT_MICRO_REMOVE * r
+                    if rm_dn < n < rm_up:
+                        append = False
+                if append:
+                    output_prices.append(usd / n)
+    return output_prices
+
+
+def loop_find_central_output(r2, price_min, price_max):
+    r6 = [r for r in r2 if price_min < r < price_max]
+    outputs = sorted(r6)
+    n = len(outputs)
+
+    prefix_sum = []
+    total = 0
+    for x in outputs:
+        total += x
+        prefix_sum.append(total)
+
+    left_counts = list(range(n))
+    right_counts = [n - i - 1 for i in left_counts]
+    left_sums = [0] + prefix_sum[:-1]
+    right_sums = [total - x for x in prefix_sum]
+
+    total_dists = []
+    for i in range(n):
+        dist = (outputs[i] * left_counts[i] - left_sums[i]) + (right_sums[i] - outputs[i] * right_counts[i])
+        total_dists.append(dist)
+
+    min_index, _ = min(enumerate(total_dists), key=lambda x: x[1])
+    best_output = outputs[min_index]
+
+    deviations = [abs(x - best_output) for x in outputs]
+    deviations.sort()
+    m = len(deviations)
+    if m % 2 == 0:
+        mad = (deviations[m // 2 - 1] + deviations[m // 2]) / 2
+    else:
+        mad = deviations[m // 2]
+
+    return best_output, mad
+
+
+def loop_estimate_price(raw_outputs):
+    curve = loop_clean_curve(loop_bin_counts(raw_outputs))
+    rough_price_estimate = loop_rough_price(curve)
+    output_prices = loop_output_prices(raw_outputs, rough_price_estimate)
+
+    price_up = rough_price_estimate + PCT_RANGE_TIGHT * rough_price_estimate
+    price_dn = rough_price_estimate - PCT_RANGE_TIGHT * rough_price_estimate
+    central_price, _ = loop_find_central_output(output_prices, price_dn, price_up)
+    avs = set()
+    avs.add(central_price)
+    while central_price not in avs:
+        avs.add(central_price)
+        price_up = central_price + PCT_RANGE_TIGHT * central_price
+        price_dn = central_price - PCT_RANGE_TIGHT * central_price
+        central_price, _ = loop_find_central_output(output_prices, price_dn, price_up)
+    return central_price
+
+
+@pytest.mark.parametrize("stencil", [smooth_stencil(), spike_stencil()], ids=["smooth", "spike"])
+def test_stencil_scores(curve, stencil):
+    left = CENTER_P001 - int((STENCIL_LENGTH + 1) / 2)
+    scores = stencil_scores(curve, stencil, left, MIN_SLIDE - 1, MAX_SLIDE + 1)
+    assert scores.tolist() == loop_slide_scores(curve.tolist(), stencil)
+
+
+def test_usd_price_points(amounts):
+    array = np.array(amounts)
+    exclude = round_sat_mask(array, micro_round_amounts(), PCT_MICRO_REMOVE)
+    assert exclude.any()
+    indexes, prices = usd_price_points(array, USDS, PRICE, PCT_RANGE_WIDE, exclude)
+    assert prices.tolist() == loop_output_prices(amounts, PRICE)
+    assert (np.diff(indexes) >= 0).all()
+
+
+def test_find_central_output(amounts):
+    prices = loop_output_prices(amounts, PRICE)
+    sorted_prices = np.sort(prices)
+    for pct in (PCT_RANGE_TIGHT, .1, .2):
+        price_dn = PRICE - pct * PRICE
+        price_up = PRICE + pct * PRICE
+        assert find_central_output(sorted_prices, price_dn, price_up) == loop_find_central_output(prices, price_dn, price_up)
+
+
+def test_bin_amounts(amounts):
+    # Part 8 only bins amounts strictly between 1e-5 and 1e5 btc
+    bins = output_bins()
+    edges = bins[(bins > 1e-5) & (bins < 1e5)]
+    edge_amounts = np.concatenate([edges, np.nextafter(edges, 0), np.nextafter(edges, np.inf)])
+    limits = [np.nextafter(1e-5, 1), np.nextafter(1e5, 0), 1e-5 + 1e-13, 99999.99999999]
+    test_amounts = amounts + edge_amounts.tolist() + limits
+    assert bin_amounts(test_amounts, bins).tolist() == loop_bin_counts(test_amounts)
+
+
+def test_estimate_price(amounts):
+    bins = output_bins()
+    price = estimate_price(bin_amounts(amounts, bins), amounts, bins)
+    assert abs(price - PRICE) < .05 * PRICE
+    assert price == loop_estimate_price(amounts)